@@ -1,17 +1,55 @@
+import os
 from .model_parser import ModelParser
 from .optimizor import Optimizer
-from .code_generator import CodeGenerator
+from .optimizor.patch import best_patch_plan
+from .code_generator import CodeGenerator, ConstMode
+from .batch import CompileResult, compile_many, format_results
+from .executor import ReferenceExecutor
+from .cache import CompileCache, FILES_DIR
 
 def compile_model_at(
     model_path: str,
     output_dir: str,
+    sram_scale: float = 1.0,
+    fuse_blocks: bool = False,
+    patch_overhead: float | None = None,
+    reorder: bool = False,
+    schedule_budget: float | None = None,
+    cache_dir: str | None = None,
 ) -> int:
-    model = ModelParser(model_path).parse_model()
-    
-    optimizer = Optimizer(model)
-    (model, sram_usage)= optimizer.optimize(1.0)
+    '''cache_dir: reuse the code of an earlier compile of the same model file, compiler and options from this cache'''
+    options = {
+        "sram_scale": sram_scale,
+        "fuse_blocks": fuse_blocks,
+        "patch_overhead": patch_overhead,
+        "reorder": reorder,
+        "schedule_budget": schedule_budget,
+    }
+    cache = None if cache_dir is None else CompileCache(cache_dir)
+    key = "" if cache is None else cache.key(model_path, options)
+    if cache is not None:
+        result = cache.lookup(key)
+        if result is not None and cache.materialize(key, output_dir):
+            return result["peak_mem"]
+
+    model = ModelParser(model_path).parse_model(fuse_blocks)
     
-    code_generator = CodeGenerator(output_dir)
-    code_generator.generate(model, sram_usage)
+    optimizer = Optimizer(model, schedule_budget)
+    if patch_overhead is not None:
+        optimizer.use_patches(best_patch_plan(optimizer.plan_patches(), patch_overhead))
+    if reorder:
+        optimizer.reorder()
+    (model, sram_usage)= optimizer.optimize(sram_scale)
     
+    if cache is None:
+        code_generator = CodeGenerator(output_dir)
+        code_generator.generate(model, sram_usage)
+        return sram_usage
+
+    staging = cache.stage()
+    const_size = CodeGenerator(os.path.join(staging, FILES_DIR)).generate(model, sram_usage)
+    cache.store(key, staging, model, sram_usage, const_size)
+    if not cache.materialize(key, output_dir):
+        # evicted by another compile right after storing it
+        CodeGenerator(output_dir).generate(model, sram_usage)
     return sram_usage
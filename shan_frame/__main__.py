@@ -0,0 +1,44 @@
+import argparse
+
+from .batch import compile_many, format_results
+from .code_generator import ConstMode, RequantMode
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="shan_frame", description="compile tflite models into C code for MCUs")
+    parser.add_argument("models", nargs="+", help="input tflite model files")
+    parser.add_argument("-s", "--sram-scale", type=float, nargs="+", default=[1.0],
+                        help="allowed peak sram usage against minimum usage")
+    parser.add_argument("-o", "--output-dir", default="out",
+                        help="output root, code goes to <output-dir>/<model>/sram<scale>")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes, defaults to cpu count")
+    parser.add_argument("--plot", action="store_true",
+                        help="plot memory footprint of each configuration")
+    parser.add_argument("--const-blob", action="store_true",
+                        help="write model constants as a binary blob instead of C arrays")
+    parser.add_argument("--profile", action="store_true",
+                        help="time every layer of inference() with SHAN_PROFILE_BEGIN/END hooks")
+    parser.add_argument("--fixed-point", action="store_true",
+                        help="requantize conv outputs with integer multiplier and shift instead of float scales")
+    parser.add_argument("--fuse-blocks", action="store_true",
+                        help="run expand, depthwise and project convs of inverted residual blocks as one row-buffered kernel")
+    parser.add_argument("--patch-overhead", type=float, default=None, metavar="RATIO",
+                        help="run the first stage patch by patch with the lowest peak sram within RATIO extra macs")
+    parser.add_argument("--reorder", action="store_true",
+                        help="run the ops in the valid order with the lowest peak sram instead of the tflite order")
+    parser.add_argument("--schedule-budget", type=float, default=None, metavar="SECONDS",
+                        help="search placement orders of the memory schedule with a portfolio of strategies for SECONDS")
+    args = parser.parse_args()
+
+    const_mode = ConstMode.BLOB if args.const_blob else ConstMode.HEADER
+    requant = RequantMode.FIXED_POINT if args.fixed_point else RequantMode.FLOAT
+    results = compile_many(args.models, args.sram_scale, args.output_dir, args.jobs, args.plot, const_mode, args.profile,
+                           requant, args.fuse_blocks, args.patch_overhead, args.reorder,
+                           args.schedule_budget)
+    print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+
+from .ir import Model
+from .model_parser import ModelParser
+from .optimizor import Optimizer
+from .optimizor.patch import best_patch_plan, format_patch_plans
+from .optimizor.mem_scheduler import format_search
+from .code_generator import CodeGenerator, ConstMode, RequantMode
+
+
+class CompileResult:
+    model_path: str
+    sram_scale: float
+    output_dir: str
+    peak_mem: int
+    # liveness lower bound of the peak
+    lower_bound: int
+    const_size: int
+    parse_time: float
+    compile_time: float
+    error: str | None
+
+    def __init__(self, model_path: str, sram_scale: float, output_dir: str) -> None:
+        self.model_path = model_path
+        self.sram_scale = sram_scale
+        self.output_dir = output_dir
+        self.peak_mem = -1
+        self.lower_bound = -1
+        self.const_size = -1
+        self.parse_time = 0
+        self.compile_time = 0
+        self.error = None
+
+    @property
+    def model_name(self) -> str:
+        return os.path.splitext(os.path.basename(self.model_path))[0]
+
+    @property
+    def wall_time(self) -> float:
+        return self.parse_time + self.compile_time
+
+
+def config_output_dir(output_root: str, model_path: str, sram_scale: float) -> str:
+    model_name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(output_root, model_name, f"sram{sram_scale:g}")
+
+
+def _parse(model_path: str, fuse_blocks: bool) -> tuple[Model, float]:
+    start = time.perf_counter()
+    model = ModelParser(model_path).parse_model(fuse_blocks)
+    return (model, time.perf_counter() - start)
+
+
+def _compile(model: Model, result: CompileResult, plot: bool, const_mode: ConstMode, profile: bool,
+             requant: RequantMode, patch_overhead: float | None, reorder: bool,
+             schedule_budget: float | None) -> CompileResult:
+    start = time.perf_counter()
+    try:
+        # the batch already runs a compile per core, the placement search stays in this worker
+        optimizer = Optimizer(model, schedule_budget, jobs=1)
+        footprint_path = os.path.join(result.output_dir, "footprint.png") if plot else None
+        os.makedirs(result.output_dir, exist_ok=True)
+        if patch_overhead is not None:
+            plans = optimizer.plan_patches()
+            with open(os.path.join(result.output_dir, "patch_plans.txt"), "w") as f:
+                f.write(format_patch_plans(plans) + "\n")
+            optimizer.use_patches(best_patch_plan(plans, patch_overhead))
+        if reorder:
+            optimizer.reorder()
+        (model, peak_mem) = optimizer.optimize(result.sram_scale, footprint_path)
+        if schedule_budget is not None:
+            scheduler = optimizer.mem_scheduler
+            with open(os.path.join(result.output_dir, "schedule_search.txt"), "w") as f:
+                f.write(format_search(scheduler.search_results, scheduler.lower_bound) + "\n")
+        result.const_size = CodeGenerator(result.output_dir, const_mode, profile, requant).generate(model, peak_mem)
+        result.peak_mem = peak_mem
+        if optimizer.schedule_report is not None:
+            result.lower_bound = optimizer.schedule_report.lower_bound
+            with open(os.path.join(result.output_dir, "schedule_report.txt"), "w") as f:
+                f.write(str(optimizer.schedule_report) + "\n")
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.compile_time = time.perf_counter() - start
+    return result
+
+
+def compile_many(
+    model_paths: list[str],
+    sram_scales: list[float],
+    output_root: str,
+    jobs: int | None = None,
+    plot: bool = False,
+    const_mode: ConstMode = ConstMode.HEADER,
+    profile: bool = False,
+    requant: RequantMode = RequantMode.FLOAT,
+    fuse_blocks: bool = False,
+    patch_overhead: float | None = None,
+    reorder: bool = False,
+    schedule_budget: float | None = None,
+) -> list[CompileResult]:
+    '''compile every (model, sram_scale) pair into output_root/<model>/sram<scale>
+    each model is parsed once and the IR is shared by all of its sram_scale variants
+    patch_overhead: run the first stage patch by patch with the lowest peak sram within this
+    fraction of extra macs, the trade-off of every split point goes to patch_plans.txt
+    reorder: run the ops in the valid order with the lowest peak sram instead of the tflite order
+    schedule_budget: seconds of portfolio search for the placement order of the base schedule of each compile,
+    run in the compile worker, the peak of every member and the gap to the lower bound go to schedule_search.txt'''
+    results: dict[tuple[int, int], CompileResult] = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        parsing: dict[Future, int] = {pool.submit(_parse, path, fuse_blocks): idx for idx, path in enumerate(model_paths)}
+        compiling: dict[Future, tuple[int, int]] = {}
+        pending: set[Future] = set(parsing.keys())
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in parsing:
+                    model_idx = parsing[future]
+                    model_path = model_paths[model_idx]
+                    error = future.exception()
+                    for scale_idx, scale in enumerate(sram_scales):
+                        result = CompileResult(
+                            model_path, scale, config_output_dir(output_root, model_path, scale))
+                        if error is not None:
+                            result.error = f"{type(error).__name__}: {error}"
+                            results[(model_idx, scale_idx)] = result
+                            continue
+                        (model, result.parse_time) = future.result()
+                        task = pool.submit(_compile, model, result, plot, const_mode, profile, requant, patch_overhead, reorder,
+                                           schedule_budget)
+                        compiling[task] = (model_idx, scale_idx)
+                        pending.add(task)
+                else:
+                    results[compiling[future]] = future.result()
+    return [results[key] for key in sorted(results.keys())]
+
+
+def format_results(results: list[CompileResult]) -> str:
+    header = ("model", "sram_scale", "peak_sram", "lower_bound", "const_size", "parse(s)", "compile(s)", "wall(s)", "status")
+    rows = [header]
+    for result in results:
+        rows.append((
+            result.model_name,
+            f"{result.sram_scale:g}",
+            str(result.peak_mem) if result.error is None else "-",
+            str(result.lower_bound) if result.error is None else "-",
+            str(result.const_size) if result.error is None else "-",
+            f"{result.parse_time:.2f}",
+            f"{result.compile_time:.2f}",
+            f"{result.wall_time:.2f}",
+            "ok" if result.error is None else result.error,
+        ))
+    widths = [max(len(row[col]) for row in rows) for col in range(len(header) - 1)]
+    lines = []
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row, widths)]
+        lines.append("  ".join(cells + [row[-1]]))
+    return "\n".join(lines)
@@ -0,0 +1,199 @@
+import functools
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import uuid
+
+from .ir import Model
+from .code_generator import remove_stale_files
+from .code_generator.utils import write_if_changed
+from .ir.decisions import Decisions
+
+# generated sources of an entry, laid out like the output dir
+FILES_DIR = "files"
+MODEL_FILE = "model.pickle"
+DECISIONS_FILE = "decisions.json"
+RESULT_FILE = "result.json"
+STAGE_PREFIX = ".stage-"
+# entries renamed away to be removed, readers never see an entry half removed
+TRASH_PREFIX = ".evict-"
+# a stage dir this old belongs to a compile that died
+STALE_STAGE_SECONDS = 3600
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@functools.cache
+def compiler_digest() -> str:
+    '''hash of the compiler sources, any change of the compiler makes new keys'''
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for name in sorted(file_names):
+            if name.endswith(".py"):
+                path = os.path.join(dir_path, name)
+                digest.update(os.path.relpath(path, root).encode())
+                digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(dir_path, name)) for dir_path, _, file_names in os.walk(path) for name in file_names)
+
+
+class CompileCache:
+    '''content addressed cache of compiled models, keyed by the model file, the compiler sources and the options
+    an entry keeps the optimized IR, its decisions and schedule, and the generated sources.
+    entries are used least recently first evicted when the cache grows over max_bytes'''
+    cache_dir: str
+    max_bytes: int
+
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_CACHE_BYTES) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, model_path: str, options: dict) -> str:
+        '''options: every compile option that changes the output, json serializable'''
+        digest = hashlib.sha256()
+        digest.update(file_digest(model_path).encode())
+        digest.update(compiler_digest().encode())
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def complete(self, key: str) -> bool:
+        return os.path.isfile(os.path.join(self.entry_dir(key), RESULT_FILE))
+
+    def lookup(self, key: str) -> dict | None:
+        '''result of the entry ({"peak_mem", "const_size", "size"}), None on a miss, a hit counts as a use'''
+        path = self.entry_dir(key)
+        try:
+            with open(os.path.join(path, RESULT_FILE)) as f:
+                result = json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return result
+
+    def materialize(self, key: str, output_dir: str) -> bool:
+        '''copy the generated sources of the entry into output_dir, files already holding the same content are not touched
+        generated files of an earlier compile into output_dir that the entry does not hold are removed.
+        returns False if the entry is incomplete or got evicted meanwhile, output_dir then needs a compile'''
+        if not self.complete(key):
+            return False
+        files_dir = os.path.join(self.entry_dir(key), FILES_DIR)
+        emitted: set[str] = set()
+        try:
+            for dir_path, _, file_names in os.walk(files_dir):
+                for name in file_names:
+                    path = os.path.join(dir_path, name)
+                    output_path = os.path.normpath(os.path.join(output_dir, os.path.relpath(path, files_dir)))
+                    with open(path, "rb") as f:
+                        write_if_changed(output_path, f.read())
+                    emitted.add(output_path)
+        except FileNotFoundError:
+            return False
+        if len(emitted) == 0:
+            return False
+        remove_stale_files(output_dir, emitted)
+        return True
+
+    def load_model(self, key: str) -> Model:
+        with open(os.path.join(self.entry_dir(key), MODEL_FILE), "rb") as f:
+            return pickle.load(f)
+
+    def load_decisions(self, key: str) -> Decisions:
+        with open(os.path.join(self.entry_dir(key), DECISIONS_FILE)) as f:
+            return Decisions.from_json(f.read())
+
+    def stage(self) -> str:
+        '''new entry dir to generate sources into under FILES_DIR, store() moves it into the cache'''
+        return tempfile.mkdtemp(prefix=STAGE_PREFIX, dir=self.cache_dir)
+
+    def store(self, key: str, staging: str, model: Model, peak_mem: int, const_size: int) -> None:
+        with open(os.path.join(staging, MODEL_FILE), "wb") as f:
+            pickle.dump(model, f)
+        with open(os.path.join(staging, DECISIONS_FILE), "w") as f:
+            f.write(Decisions.capture(model, peak_mem).to_json())
+        result = {"peak_mem": int(peak_mem), "const_size": int(const_size), "size": dir_size(staging)}
+        # the result file goes last, it marks the entry complete
+        with open(os.path.join(staging, RESULT_FILE), "w") as f:
+            json.dump(result, f)
+        for _ in range(2):
+            try:
+                os.rename(staging, self.entry_dir(key))
+                break
+            except OSError:
+                if self.complete(key):
+                    # another compile stored the same key first
+                    shutil.rmtree(staging)
+                    break
+                # an entry without its result file, left by a crash, is replaced
+                self.discard(key)
+        else:
+            shutil.rmtree(staging)
+            raise RuntimeError(f"cannot store cache entry {key}")
+        self.evict(keep=key)
+
+    def discard(self, name: str) -> None:
+        '''remove an entry or a stage dir, renamed away first so nothing reads it half removed'''
+        trash = os.path.join(self.cache_dir, f"{TRASH_PREFIX}{uuid.uuid4().hex}")
+        try:
+            os.rename(self.entry_dir(name), trash)
+        except OSError:
+            # removed by another compile
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def evict(self, keep: str | None = None) -> None:
+        '''remove least recently used entries until the cache fits max_bytes, except keep
+        incomplete entries, stage dirs of dead compiles and leftovers of interrupted evictions go first,
+        stage dirs of running compiles count toward the size'''
+        entries: list[tuple[float, str, int]] = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.cache_dir):
+            path = self.entry_dir(name)
+            try:
+                if name.startswith(TRASH_PREFIX):
+                    shutil.rmtree(path, ignore_errors=True)
+                    continue
+                if name.startswith(STAGE_PREFIX):
+                    if now - os.path.getmtime(path) > STALE_STAGE_SECONDS:
+                        self.discard(name)
+                    else:
+                        total += dir_size(path)
+                    continue
+                with open(os.path.join(path, RESULT_FILE)) as f:
+                    size = json.load(f)["size"]
+                entries.append((os.path.getmtime(path), name, size))
+            except NotADirectoryError:
+                continue
+            except FileNotFoundError:
+                # an entry without its result file, left by a crash
+                self.discard(name)
+                continue
+            total += size
+        for (_, name, size) in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            self.discard(name)
+            total -= size
@@ -1,17 +1,24 @@
-from .utils import buffer_name, indent_lines
+from .utils import buffer_name, indent_lines, format_const, write_if_changed
 from .gen_minorop import generate_minor_declare, generate_minor_def
 from .gen_intrinsics import generate_intrin
 from .gen_vecmul import generate_vec_mul_def
 from .gen_ch_conv import generate_ch_conv_def
-from .output_code import OutputCode
+from .output_code import OutputCode, KernelFunc, LayerCode, ConstMode, RequantMode, C_TYPE_DTYPE, parse_const_declare
 from .gen_conv2d import generate_conv2d
 from .gen_dep_conv2d import generate_depthwise_conv2d
 from .gen_add import generate_add
 from .gen_avgpool import generate_avgpool
-from ..ir.operator import Conv2D, DepthConv2D, Add, AvgPool2D, Reshape
-from ..ir import Model
+from .gen_reshape import generate_reshape
+from .gen_inverted_residual import generate_inverted_residual
+from .gen_patch import generate_patch_stage
+from .gen_profile import layer_name, layer_row, generate_profile_declare, generate_profile_def
+from ..ir.operator import Conv2D, DepthConv2D, Add, AvgPool2D, Reshape, InvertedResidual, PatchStage
+from ..ir import Model, Operator
+from ..ir.decisions import Decisions
 from .gen_ch_conv import test
 import os
+import re
+from concurrent.futures import ProcessPoolExecutor
 
 class CodeGenerator:
     output_dir: str
@@ -25,54 +32,106 @@ class CodeGenerator:
     intrin_file_name = "intrinsics"
     const_file_name = "model_const"
     inference_file_name = "inference"
+    profile_file_name = "profile"
     inference_input_var = "input"
+    const_blob_symbol = "shan_const_blob"
+    const_blob_section = ".rodata.shan_weights"
+    const_blob_align = 4
+    const_mode: ConstMode
+    # wrap every layer call of inference() in SHAN_PROFILE_BEGIN/END
+    profile: bool
+    # float scales or integer-only (multiplier, shift) requantization of conv outputs
+    requant: RequantMode
+    # files written or found unchanged by the current generate()
+    emitted: set[str]
+    # worker processes generating layers, 1 generates them in this process
+    jobs: int | None
     
-    def __init__(self, output_dir: str) -> None:
+    def __init__(self, output_dir: str, const_mode: ConstMode = ConstMode.HEADER, profile: bool = False,
+                 requant: RequantMode = RequantMode.FLOAT, jobs: int | None = 1) -> None:
         self.output_dir = output_dir
-        
+        self.const_mode = const_mode
+        self.profile = profile
+        self.requant = requant
+        self.jobs = jobs
+        self.emitted = set()
+
+    def write_file(self, file_path: str, data: str | bytes) -> None:
+        # files holding the same content keep their mtime, so make only rebuilds what changed
+        self.emitted.add(os.path.normpath(file_path))
+        write_if_changed(file_path, data.encode() if isinstance(data, str) else data)
+
     def write_src(self, name: str, lines: list[str]) -> None:
         file_path = os.path.join(self.output_dir, self.src_dir, f"{name}.c")
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "w") as f:
-            f.writelines(lines)
+        self.write_file(file_path, "".join(lines))
             
     def write_include(self, name: str, lines: list[str]) -> None:
         file_path = os.path.join(self.output_dir, self.include_dir, f"{name}.h")
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        with open(file_path, "w") as f:
-            f.write(f"#ifndef {name.upper()}_H\n")
-            f.write(f"#define {name.upper()}_H\n")
-            f.writelines(lines)
-            f.write(f"#endif\n")
+        self.write_file(file_path, "".join([f"#ifndef {name.upper()}_H\n", f"#define {name.upper()}_H\n", *lines, f"#endif\n"]))
         
-    def generate(self, model: Model, peak_mem: int) -> None:
-        output_code = OutputCode(self.output_dir, peak_mem)
-        self.generate_kernel(model, output_code)
+    def generate(self, model: Model, peak_mem: int) -> int:
+        '''peak_mem: sram size of an optimized model
+        returns total size of model constants'''
+        output_code = OutputCode(self.output_dir, peak_mem, self.requant)
+        self.emitted = set()
+        layers = self.generate_layers(model, peak_mem)
+        for layer in layers:
+            output_code.merge(layer.code)
         self.output_inference(model, output_code)
-        self.output_kernel(output_code)
+        if self.profile:
+            self.output_profile(model, output_code)
+        self.output_kernel(output_code, {layer.op_idx: layer.source for layer in layers})
         self.output_ch_conv(output_code)
         self.output_vec_mul(output_code)
-        self.output_const(output_code)
+        const_size = self.output_const(output_code)
         self.output_intrin()
         self.output_minor_op()
+        self.remove_stale()
+        return const_size
+
+    def generate_from(self, model: Model, decisions: Decisions) -> int:
+        '''apply decisions, e.g. of a pareto point, to the model and generate it
+        returns total size of model constants'''
+        decisions.apply(model)
+        return self.generate(model, decisions.peak_mem)
+
+    def generate_layers(self, model: Model, peak_mem: int) -> list[LayerCode]:
+        '''every layer on its own, in op order, across jobs worker processes unless jobs is 1'''
+        op_idx_list = list(model.operators.keys())
+        if self.jobs == 1:
+            return [self.generate_layer(model, op_idx, peak_mem) for op_idx in op_idx_list]
+        # the model goes to every worker once instead of with every layer
+        with ProcessPoolExecutor(self.jobs, initializer=_init_layer_worker, initargs=(self, model, peak_mem)) as pool:
+            return list(pool.map(_generate_worker_layer, op_idx_list, chunksize=4))
+
+    def generate_layer(self, model: Model, op_idx: int, peak_mem: int) -> LayerCode:
+        '''kernel and source file of one layer, the helpers it calls go to a code of its own'''
+        code = OutputCode(self.output_dir, peak_mem, self.requant)
+        self.generate_op(model, model.operators[op_idx], code)
+        kernel = code.kernels[op_idx]
+        source = self.layer_source(kernel) if len(kernel.definition) > 0 else ""
+        return LayerCode(op_idx, code, source)
 
-    def generate_kernel(self, model: Model, output_code: OutputCode) -> None:
-        for op in model.operators.values():
-            match op:
-                case Conv2D():
-                    generate_conv2d(self.inference_input_var, model, op, output_code)
-                case DepthConv2D():
-                    generate_depthwise_conv2d(self.inference_input_var, model, op, output_code)
-                case Add():
-                    generate_add(model, op, output_code)
-                case AvgPool2D():
-                    generate_avgpool(self.inference_input_var, model, op, output_code)
-                case Reshape():
-                    pass
-                case _:
-                    raise NotImplementedError(op.op_type)
-                
-    def output_kernel(self, output_code: OutputCode) -> None:
+    def generate_op(self, model: Model, op: Operator, output_code: OutputCode) -> None:
+        match op:
+            case Conv2D():
+                generate_conv2d(self.inference_input_var, model, op, output_code)
+            case DepthConv2D():
+                generate_depthwise_conv2d(self.inference_input_var, model, op, output_code)
+            case Add():
+                generate_add(model, op, output_code)
+            case AvgPool2D():
+                generate_avgpool(self.inference_input_var, model, op, output_code)
+            case Reshape():
+                generate_reshape(self.inference_input_var, model, op, output_code)
+            case InvertedResidual():
+                generate_inverted_residual(self.inference_input_var, model, op, output_code)
+            case PatchStage():
+                generate_patch_stage(self.inference_input_var, model, op, output_code)
+            case _:
+                raise NotImplementedError(op.op_type)
+
+    def output_kernel(self, output_code: OutputCode, sources: dict[int, str]) -> None:
         # generate header file
         lines = [f"#include <stdint.h>\n"]
         for _, kernel in output_code.kernels.items():
@@ -80,26 +139,34 @@ class CodeGenerator:
                 continue
             lines.append(f"{kernel.definition};\n")
         self.write_include(self.kernel_file_name, lines)
-        # generate kernel source files
+        # kernel source files
         for idx, kernel in output_code.kernels.items():
             if len(kernel.definition) == 0:
                 continue
-            lines = [
-                f"#include <stdint.h>\n"
-                f"#include \"{self.vec_mul_file_name}.h\"\n",
-                f"#include \"{self.ch_conv_file_name}.h\"\n",
-                f"#include \"{self.kernel_file_name}.h\"\n",
-                f"#include \"{self.intrin_file_name}.h\"\n",
-            ]
-            for const_name, _ in kernel.const:
-                lines.append(f"extern {const_name};\n")
-            lines.extend([
-                f"{kernel.definition}{{\n" ,
-                kernel.content,
-                f"}}\n"
-            ])
-            self.write_src(f"{self.layer_file_name_base}{idx}", lines)
-           
+            self.write_src(f"{self.layer_file_name_base}{idx}", [sources[idx]])
+
+    def layer_source(self, kernel: KernelFunc) -> str:
+        lines = [
+            f"#include <stdint.h>\n"
+            f"#include \"{self.vec_mul_file_name}.h\"\n",
+            f"#include \"{self.ch_conv_file_name}.h\"\n",
+            f"#include \"{self.kernel_file_name}.h\"\n",
+            f"#include \"{self.intrin_file_name}.h\"\n",
+        ]
+        if self.const_mode == ConstMode.BLOB:
+            lines.append(f"#include \"{self.const_file_name}.h\"\n")
+        else:
+            # every layer defines its own consts, a change of one layer's weights only rebuilds its file
+            for declare, data in kernel.const:
+                lines.extend([f"{declare} = {{", *format_const(data), "};\n"])
+        lines.extend([
+            kernel.helpers,
+            f"{kernel.definition}{{\n" ,
+            kernel.content,
+            f"}}\n"
+        ])
+        return "".join(lines)
+
     def output_vec_mul(self, output_code: OutputCode) -> None:
         # generate header file
         lines = [f"#include <stdint.h>\n"]
@@ -134,46 +201,127 @@ class CodeGenerator:
             lines.append(f"}}\n")
         self.write_src(self.ch_conv_file_name, lines)
             
-    def output_const(self, output_code: OutputCode) -> None:
-        lines = ["#include <stdint.h>\n"]
+    def output_const(self, output_code: OutputCode) -> int:
+        if self.const_mode == ConstMode.BLOB:
+            return self.output_const_blob(output_code)
         const_size = 0
+        lines = []
         for kernel in output_code.kernels.values():
             for declare, data in kernel.const:
                 const_size += data.size * data.itemsize
-                elements = [str(element) for element in data.flatten()]
-                data_str = ", ".join(elements)
-                lines.append(f"{declare} = {{{data_str}}};\n")
-        lines.insert(0, f"//total const size: {const_size}\n")
-        self.write_include(self.const_file_name, lines)
+                lines.append(f"extern {declare};\n")
+        # the arrays are defined in the layer files
+        self.write_include(self.const_file_name, [
+            f"//total const size: {const_size}\n",
+            "#include <stdint.h>\n",
+            *lines,
+        ])
+        return const_size
+        
+    def output_const_blob(self, output_code: OutputCode) -> int:
+        blob_size = output_code.layout_blob(self.const_blob_align)
+        name = self.const_file_name
+        symbol = self.const_blob_symbol
+        # binary blob
+        blob = bytearray(blob_size)
+        for kernel in output_code.kernels.values():
+            for (declare, data), offset in zip(kernel.const, kernel.const_offset):
+                (ctype, _) = parse_const_declare(declare)
+                # wraps out-of-range values like the C array initializer does
+                raw = data.reshape(-1).astype(C_TYPE_DTYPE[ctype]).tobytes()
+                blob[offset:offset + len(raw)] = raw
+        self.write_file(os.path.join(self.output_dir, self.src_dir, f"{name}.bin"), bytes(blob))
+        # offset table, each const becomes a typed pointer into the blob
+        lines = [
+            f"//total const size: {blob_size}\n",
+            f"#include <stdint.h>\n",
+            f"extern const uint8_t {symbol}[];\n",
+        ]
+        for kernel in output_code.kernels.values():
+            for (declare, _), offset in zip(kernel.const, kernel.const_offset):
+                (ctype, const_name) = parse_const_declare(declare)
+                lines.append(f"#define {const_name.upper()}_OFFSET {offset}\n")
+                lines.append(f"#define {const_name} ((const {ctype} *)({symbol} + {const_name.upper()}_OFFSET))\n")
+        self.write_include(name, lines)
+        # assembler stub pulling the blob into its own linker section
+        lines = [
+            f"// model constants, offsets are in {name}.h\n",
+            f"// assemble with the directory of {name}.bin on the include path (-I),\n",
+            f"// and place {self.const_blob_section} in flash from the linker script.\n",
+            f"// alternatively, skip this file and convert the blob with objcopy:\n",
+            f"//   objcopy -I binary -O <elf target> \\\n",
+            f"//     --rename-section .data={self.const_blob_section},alloc,load,readonly,data,contents \\\n",
+            f"//     --redefine-sym _binary_{name}_bin_start={symbol} \\\n",
+            f"//     {name}.bin {name}.o\n",
+            f"    .section {self.const_blob_section}, \"a\"\n",
+            f"    .balign {self.const_blob_align}\n",
+            f"    .global {symbol}\n",
+            f"    .type {symbol}, %object\n",
+            f"{symbol}:\n",
+            f"    .incbin \"{name}.bin\"\n",
+            f"    .size {symbol}, . - {symbol}\n",
+            f"#if defined(__linux__) && defined(__ELF__)\n",
+            f"    .section .note.GNU-stack, \"\", %progbits\n",
+            f"#endif\n",
+        ]
+        self.write_file(os.path.join(self.output_dir, self.src_dir, f"{name}.S"), "".join(lines))
+        return blob_size
         
     def output_inference(self, model: Model, output_code: OutputCode) -> None:
         # generate include file
-        lines = [f"#include <stdint.h>\n"]
+        first_op = next(iter(model.operators.values()))
+        last_op = next(reversed(model.operators.values()))
+        input_size = model.tensors[first_op.input_idx_list[0]].mem_size()
+        output_size = model.tensors[last_op.output_idx].mem_size()
+        lines = [
+            f"#include <stdint.h>\n",
+            f"#define INFERENCE_INPUT_SIZE {input_size}\n",
+            f"#define INFERENCE_OUTPUT_SIZE {output_size}\n",
+        ]
         inference_declare = f"int8_t *{self.inference_file_name}(int8_t *{self.inference_input_var})"
         lines.append(f"{inference_declare};\n")
         self.write_include(self.inference_file_name, lines)
         # generate source file
         lines = [
             f"#include <stdint.h>\n",
+            f"#include <string.h>\n",
             f"#include \"{self.inference_file_name}.h\"\n",
             f"#include \"{self.minor_op_file_name}.h\"\n",
             f"#include \"{self.const_file_name}.h\"\n",
             f"#include \"{self.kernel_file_name}.h\"\n",
             f"int8_t {buffer_name()}[{output_code.mem_size}];\n"
         ]
-        last_op = next(reversed(model.operators.values()))
+        if self.profile:
+            lines.insert(-1, f"#include \"{self.profile_file_name}.h\"\n")
         output_addr = model.tensors[last_op.output_idx].addr
         output = f"&{buffer_name()}[{output_addr}]"
         content = f"{inference_declare}{{\n"
         indent = 1
-        for idx, kernel in output_code.kernels.items():
-            content += indent_lines(f"{kernel.call};", indent)
+        for layer, (idx, kernel) in enumerate(output_code.kernels.items()):
+            if not self.profile:
+                content += indent_lines(f"{kernel.call};", indent)
+                continue
+            name = layer_name(kernel.call, idx)
+            content += indent_lines(f"""
+                SHAN_PROFILE_BEGIN({layer}, "{name}");
+                {kernel.call};
+                SHAN_PROFILE_END({layer}, "{name}");""", indent)
         content += indent_lines(f"return {output};", indent)
         content += "}\n"
         lines.append(content)
         self.write_src(self.inference_file_name, lines)
         
 
+    def output_profile(self, model: Model, output_code: OutputCode) -> None:
+        rows = [layer_row(model, model.operators[idx], layer_name(kernel.call, idx))
+                for idx, kernel in output_code.kernels.items()]
+        self.write_include(self.profile_file_name, [generate_profile_declare(len(rows))])
+        lines = [f"#include \"{self.profile_file_name}.h\"\n", generate_profile_def(rows)]
+        self.write_src(self.profile_file_name, lines)
+
+    def remove_stale(self) -> None:
+        remove_stale_files(self.output_dir, self.emitted)
+
     def output_intrin(self) -> None:
         self.write_include(self.intrin_file_name, [generate_intrin()])
         
@@ -182,4 +330,37 @@ class CodeGenerator:
         lines = [f"#include \"{self.intrin_file_name}.h\"\n"]
         lines.append(generate_minor_def())
         self.write_src(self.minor_op_file_name, lines)
-        
\ No newline at end of file
+        
+
+
+def remove_stale_files(output_dir: str, emitted: set[str]) -> None:
+    '''remove the generated files in output_dir that are not in emitted (normalized paths)
+    files of an earlier compile in another configuration would still be compiled and linked,
+    like the layers of a bigger model, a profiling table or the const blob'''
+    stale_names = {
+        CodeGenerator.src_dir: re.compile(rf"({CodeGenerator.layer_file_name_base}\d+|{CodeGenerator.profile_file_name})\.c|{CodeGenerator.const_file_name}\.(bin|S)"),
+        CodeGenerator.include_dir: re.compile(rf"{CodeGenerator.profile_file_name}\.h"),
+    }
+    for sub_dir, pattern in stale_names.items():
+        dir_path = os.path.join(output_dir, sub_dir)
+        if not os.path.isdir(dir_path):
+            continue
+        for name in os.listdir(dir_path):
+            file_path = os.path.normpath(os.path.join(dir_path, name))
+            if pattern.fullmatch(name) and file_path not in emitted:
+                os.remove(file_path)
+
+
+# generator and model of a layer worker process, set once when the worker starts
+_layer_worker: tuple[CodeGenerator, Model, int] | None = None
+
+
+def _init_layer_worker(generator: CodeGenerator, model: Model, peak_mem: int) -> None:
+    global _layer_worker
+    _layer_worker = (generator, model, peak_mem)
+
+
+def _generate_worker_layer(op_idx: int) -> LayerCode:
+    assert _layer_worker is not None
+    (generator, model, peak_mem) = _layer_worker
+    return generator.generate_layer(model, op_idx, peak_mem)
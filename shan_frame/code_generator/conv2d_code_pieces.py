@@ -1,480 +1,530 @@
-from .output_code import OutputCode, VecMulFunc
+from .output_code import OutputCode, VecMulFunc, RequantMode, scales_type
 from .utils import *
 from ..ir import DataLayout, Tensor
 
 
-def c2o2_setup(col_size: int, output_layout: DataLayout, indent: int) -> str:
-    setup_str = f"""
+def c2o2_setup(out: CodeEmitter, col_size: int, output_layout: DataLayout, requant: RequantMode) -> None:
+    out.lines(f"""
         int8_t *out_0 = output;
         const int32_t *contrib_p = contrib;
-        const float *scales_p = scales;
+        const {scales_type(requant)} *scales_p = scales;
         const int8_t *ip_a0 = weight;
         const int8_t *ip_a1 = ip_a0 + {col_size};
-    """
+    """)
     match output_layout:
         case DataLayout.HWC:
-            setup_str += "int8_t *out_1 = out_0 + row_count;"
+            out.line("int8_t *out_1 = out_0 + row_count;")
         case DataLayout.CHW:
-            setup_str += "int8_t *out_1 = out_0 + ch_offset;"
-    return indent_lines(setup_str, indent)
+            out.line("int8_t *out_1 = out_0 + ch_offset;")
 
 
-def mac_setup(c: int, o: int, col_size: int, indent: int) -> str:
-    content = ""
+def mac_setup(out: CodeEmitter, c: int, o: int, col_size: int, requant: RequantMode) -> None:
     for j in range(0, o):
-        content += indent_lines(f"const int8_t *ip_b{j} = input + {j} * {col_size};", indent)
+        out.line(f"const int8_t *ip_b{j} = input + {j} * {col_size};")
     for i in range(0, c):
-        content += indent_lines(f"""
-            const int32_t contrib_{i} = *(contrib_p++);
-            const float scale_{i} = *(scales_p++);""", indent)
+        out.line(f"const int32_t contrib_{i} = *(contrib_p++);")
+        if requant == RequantMode.FLOAT:
+            out.line(f"const float scale_{i} = *(scales_p++);")
+        else:
+            out.line(f"const int32_t multiplier_{i} = *(scales_p++);")
+            out.line(f"const int32_t shift_{i} = *(scales_p++);")
         for j in range(0, o):
-            content += indent_lines(
-                f"int32_t ch_{i}_out_{j} = contrib_{i};", indent)
-    content += indent_lines(f"int32_t val0, val1, val2, val3, val4, val5;", indent)
-    return content
-    
-
-def c2o1_mac_4(indent: int) -> str:
-    return indent_lines("""
-        val1 = read_int8x4_ia(&ip_b0);
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4_ia(&ip_a0);
-        val3 = __SXTB16(val0);
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
-        ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
-        val0 = read_int8x4_ia(&ip_a1);
-        val3 = __SXTB16(val0);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_1_out_0 = __SMLAD(val3, val2, ch_1_out_0);
-        ch_1_out_0 = __SMLAD(val0, val1, ch_1_out_0);""", indent)
-
-
-def c2o2_mac_4(is_head: bool, is_tail: bool, indent: int) -> str:
-    mac_head = indent_lines("""
-        val1 = read_int8x4_ia(&ip_b0);
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4_ia(&ip_a0);
-        val3 = __SXTB16(val0);
-        val4 = read_int8x4_ia(&ip_b1);""" if is_head else """
-        val1 = read_int8x4_ia(&ip_b0);
-        ch_1_out_1 = __SMLAD(val0, val4, ch_1_out_1);
-        val4 = read_int8x4_ia(&ip_b1);
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4_ia(&ip_a0);
-        val3 = __SXTB16(val0);""", indent)
-    mac_body = indent_lines("""
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
-        val5 = __SXTB16(val4);
-        ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
-        val4 = __SXTB16_RORn(val4, 8);
-        ch_0_out_1 = __SMLAD(val3, val5, ch_0_out_1);
-        ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);
-        val0 = read_int8x4_ia(&ip_a1);
-        val3 = __SXTB16(val0);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_1_out_0 = __SMLAD(val3, val2, ch_1_out_0);
-        ch_1_out_1 = __SMLAD(val3, val5, ch_1_out_1);
-        ch_1_out_0 = __SMLAD(val0, val1, ch_1_out_0);""", indent)
-    mac_tail = indent_lines("""
-        ch_1_out_1 = __SMLAD(val0, val4, ch_1_out_1);""" if is_tail else "", indent)
-
-    return mac_head + mac_body + mac_tail
-
-
-def c2o1_mac_3(indent: int) -> str:
-    return indent_lines(f"""
-        val1 = read_int8x4(ip_b0);
-        ip_b0 += 3;
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4(ip_a0);
-        ip_a0 += 3;
-        val3 = __SXTB16(val0);
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
-        ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
-        val0 = read_int8x4(ip_a1);
-        ip_a1 += 3;
-        val3 = __SXTB16(val0);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_1_out_0 = __SMLAD(val3, val2, ch_1_out_0);
-        ch_1_out_0 = __SMLABB(val0, val1, ch_1_out_0);""", indent)
-
-
-def c2o2_mac_3(is_head: bool, is_tail: bool, indent: int) -> str:
+            out.line(f"int32_t ch_{i}_out_{j} = contrib_{i};")
+    out.line(f"int32_t val0, val1, val2, val3, val4, val5;")
+
+
+C2O1_MAC_4 = template("""
+    val1 = read_int8x4_ia(&ip_b0);
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4_ia(&ip_a0);
+    val3 = __SXTB16(val0);
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
+    ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
+    val0 = read_int8x4_ia(&ip_a1);
+    val3 = __SXTB16(val0);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_1_out_0 = __SMLAD(val3, val2, ch_1_out_0);
+    ch_1_out_0 = __SMLAD(val0, val1, ch_1_out_0);""")
+
+
+def c2o1_mac_4(out: CodeEmitter) -> None:
+    out.lines(C2O1_MAC_4)
+
+
+C2O2_MAC_4_HEAD = template("""
+    val1 = read_int8x4_ia(&ip_b0);
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4_ia(&ip_a0);
+    val3 = __SXTB16(val0);
+    val4 = read_int8x4_ia(&ip_b1);""")
+C2O2_MAC_4_NEXT = template("""
+    val1 = read_int8x4_ia(&ip_b0);
+    ch_1_out_1 = __SMLAD(val0, val4, ch_1_out_1);
+    val4 = read_int8x4_ia(&ip_b1);
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4_ia(&ip_a0);
+    val3 = __SXTB16(val0);""")
+C2O2_MAC_4_BODY = template("""
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
+    val5 = __SXTB16(val4);
+    ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
+    val4 = __SXTB16_RORn(val4, 8);
+    ch_0_out_1 = __SMLAD(val3, val5, ch_0_out_1);
+    ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);
+    val0 = read_int8x4_ia(&ip_a1);
+    val3 = __SXTB16(val0);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_1_out_0 = __SMLAD(val3, val2, ch_1_out_0);
+    ch_1_out_1 = __SMLAD(val3, val5, ch_1_out_1);
+    ch_1_out_0 = __SMLAD(val0, val1, ch_1_out_0);""")
+C2O2_MAC_4_TAIL = template("""
+    ch_1_out_1 = __SMLAD(val0, val4, ch_1_out_1);""")
+
+
+def c2o2_mac_4(out: CodeEmitter, is_head: bool, is_tail: bool) -> None:
+    out.lines(C2O2_MAC_4_HEAD if is_head else C2O2_MAC_4_NEXT)
+    out.lines(C2O2_MAC_4_BODY)
+    if is_tail:
+        out.lines(C2O2_MAC_4_TAIL)
+
+
+C2O1_MAC_3 = template("""
+    val1 = read_int8x4(ip_b0);
+    ip_b0 += 3;
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4(ip_a0);
+    ip_a0 += 3;
+    val3 = __SXTB16(val0);
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
+    ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
+    val0 = read_int8x4(ip_a1);
+    ip_a1 += 3;
+    val3 = __SXTB16(val0);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_1_out_0 = __SMLAD(val3, val2, ch_1_out_0);
+    ch_1_out_0 = __SMLABB(val0, val1, ch_1_out_0);""")
+
+
+def c2o1_mac_3(out: CodeEmitter) -> None:
+    out.lines(C2O1_MAC_3)
+
+
+C2O2_MAC_3_HEAD = template("""
+    val1 = read_int8x4(ip_b0);
+    ip_b0 += 3;
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4(ip_a0);
+    ip_a0 += 3;
+    val3 = __SXTB16(val0);
+    val4 = read_int8x4(ip_b1);
+    ip_b1 += 3;""")
+C2O2_MAC_3_NEXT = template("""
+    val1 = read_int8x4(ip_b0);
+    ip_b0 += 3;
+    ch_1_out_1 = __SMLAD(val0, val4, ch_1_out_1);
+    val4 = read_int8x4(ip_b1);
+    ip_b1 += 3;
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4(ip_a0);
+    ip_a0 += 3;
+    val3 = __SXTB16(val0);""")
+C2O2_MAC_3_BODY = template("""
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
+    val5 = __SXTB16(val4);
+    ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
+    val4 = __SXTB16_RORn(val4, 8);
+    ch_0_out_1 = __SMLAD(val3, val5, ch_0_out_1);
+    ch_0_out_1 = __SMLABB(val0, val4, ch_0_out_1);
+    val0 = read_int8x4(ip_a1);
+    ip_a1 += 3;
+    val3 = __SXTB16(val0);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_1_out_0 = __SMLAD(val3, val2, ch_1_out_0);
+    ch_1_out_1 = __SMLAD(val3, val5, ch_1_out_1);
+    ch_1_out_0 = __SMLABB(val0, val1, ch_1_out_0);""")
+C2O2_MAC_3_TAIL = template("""
+    ch_1_out_1 = __SMLABB(val0, val4, ch_1_out_1);""")
+
+
+def c2o2_mac_3(out: CodeEmitter, is_head: bool, is_tail: bool) -> None:
+    # XXX: if not is_head, the previous mac must be mac_4
+    out.lines(C2O2_MAC_3_HEAD if is_head else C2O2_MAC_3_NEXT)
+    out.lines(C2O2_MAC_3_BODY)
+    assert is_tail, "SIMD MAC non 4 must be tail"
+    out.lines(C2O2_MAC_3_TAIL)
+
+
+C2O1_MAC_2 = template("""
+    val1 = read_int8x4(ip_b0);
+    ip_b0 += 2;
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4(ip_a0);
+    ip_a0 += 2;
+    val3 = __SXTB16(val0);
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    val1 = __PKHBT_LSLn(val1, val2, 16); //b00 b01
+    val0 = __PKHBT_LSLn(val0, val3, 16); //a00 a01
+    ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
+    val2 = read_int8x4(ip_a1);
+    ip_a1 += 2;
+    val3 = __SXTB16(val0);
+    val2 = __SXTB16_RORn(val2, 8);
+    val2 = __PKHBT_LSLn(val2, val3, 16); //a10, a11
+    ch_1_out_0 = __SMLAD(val2, val1, ch_1_out_0);""")
+
+
+def c2o1_mac_2(out: CodeEmitter) -> None:
+    out.lines(C2O1_MAC_2)
+
+
+C2O2_MAC_2_HEAD = template("""
+    val1 = read_int8x4(ip_b0);
+    ip_b0 += 2;
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4(ip_a0);
+    ip_a0 += 2;
+    val3 = __SXTB16(val0);
+    val4 = read_int8x4(ip_b1);
+    ip_b1 += 2;""")
+C2O2_MAC_2_NEXT = template("""
+    val1 = read_int8x4(ip_b0);
+    ip_b0 += 2;
+    ch_1_out_1 = __SMLAD(val0, val4, ch_1_out_1);
+    val4 = read_int8x4(ip_b1);
+    ip_b1 += 2;
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4(ip_a0);
+    ip_a0 += 2;
+    val3 = __SXTB16(val0);""")
+C2O2_MAC_2_BODY = template("""
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    val1 = __PKHBT_LSLn(val1, val2, 16); //b00 b01
+    val0 = __PKHBT_LSLn(val0, val3, 16); //a00 a01
+    ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
+    val5 = __SXTB16(val4);
+    val4 = __SXTB16_RORn(val4, 8);
+    val4 = __PKHBT_LSLn(val4, val5, 16); //b10, b11
+    ch_0_out_1 = __SMLAD(val0, val4, ch_1_out_1);
+    val2 = read_int8x4(ip_a1);
+    ip_a1 += 2;
+    val3 = __SXTB16(val0);
+    val2 = __SXTB16_RORn(val2, 8);
+    val2 = __PKHBT_LSLn(val2, val3, 16); //a10, a11
+    ch_1_out_0 = __SMLAD(val2, val1, ch_1_out_0);""")
+C2O2_MAC_2_TAIL = template("""
+    ch_1_out_1 = __SMLAD(val2, val4, ch_1_out_1);""")
+
+
+def c2o2_mac_2(out: CodeEmitter, is_head: bool, is_tail: bool) -> None:
     # XXX: if not is_head, the previous mac must be mac_4
-    mac_head = indent_lines("""
-        val1 = read_int8x4(ip_b0);
-        ip_b0 += 3;
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4(ip_a0);
-        ip_a0 += 3;
-        val3 = __SXTB16(val0);
-        val4 = read_int8x4(ip_b1);
-        ip_b1 += 3;""" if is_head else """
-        val1 = read_int8x4(ip_b0);
-        ip_b0 += 3;
-        ch_1_out_1 = __SMLAD(val0, val4, ch_1_out_1);
-        val4 = read_int8x4(ip_b1);
-        ip_b1 += 3;
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4(ip_a0);
-        ip_a0 += 3;
-        val3 = __SXTB16(val0);""", indent)
-    mac_body = indent_lines("""
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
-        val5 = __SXTB16(val4);
-        ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
-        val4 = __SXTB16_RORn(val4, 8);
-        ch_0_out_1 = __SMLAD(val3, val5, ch_0_out_1);
-        ch_0_out_1 = __SMLABB(val0, val4, ch_0_out_1);
-        val0 = read_int8x4(ip_a1);
-        ip_a1 += 3;
-        val3 = __SXTB16(val0);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_1_out_0 = __SMLAD(val3, val2, ch_1_out_0);
-        ch_1_out_1 = __SMLAD(val3, val5, ch_1_out_1);
-        ch_1_out_0 = __SMLABB(val0, val1, ch_1_out_0);""", indent)
+    out.lines(C2O2_MAC_2_HEAD if is_head else C2O2_MAC_2_NEXT)
+    out.lines(C2O2_MAC_2_BODY)
     assert is_tail, "SIMD MAC non 4 must be tail"
-    mac_tail = indent_lines("""
-        ch_1_out_1 = __SMLABB(val0, val4, ch_1_out_1);""", indent)
+    out.lines(C2O2_MAC_2_TAIL)
 
-    return mac_head + mac_body + mac_tail
 
+C2O1_MAC_1 = template("""
+    val1 = *(ip_b0++);
+    val0 = *(ip_a0++);
+    ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
+    val5 = *(ip_a1++);
+    ch_1_out_0 = __SMLABB(val5, val1, ch_1_out_0);""")
 
-def c2o1_mac_2(indent: int) -> str:
-    return indent_lines(f"""
-        val1 = read_int8x4(ip_b0);
-        ip_b0 += 2;
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4(ip_a0);
-        ip_a0 += 2;
-        val3 = __SXTB16(val0);    
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        val1 = __PKHBT_LSLn(val1, val2, 16); //b00 b01
-        val0 = __PKHBT_LSLn(val0, val3, 16); //a00 a01
-        ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
-        val2 = read_int8x4(ip_a1);
-        ip_a1 += 2;
-        val3 = __SXTB16(val0);
-        val2 = __SXTB16_RORn(val2, 8);
-        val2 = __PKHBT_LSLn(val2, val3, 16); //a10, a11
-        ch_1_out_0 = __SMLAD(val2, val1, ch_1_out_0);""", indent)
-
-
-def c2o2_mac_2(is_head: bool, is_tail: bool, indent: int) -> str:
-    # XXX: if not is_head, the previous mac must be mac_4
-    mac_head = indent_lines("""
-        val1 = read_int8x4(ip_b0);
-        ip_b0 += 2;
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4(ip_a0);
-        ip_a0 += 2;
-        val3 = __SXTB16(val0);
-        val4 = read_int8x4(ip_b1);
-        ip_b1 += 2;""" if is_head else """
-        val1 = read_int8x4(ip_b0);
-        ip_b0 += 2;
-        ch_1_out_1 = __SMLAD(val0, val4, ch_1_out_1);
-        val4 = read_int8x4(ip_b1);
-        ip_b1 += 2;
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4(ip_a0);
-        ip_a0 += 2;
-        val3 = __SXTB16(val0);""", indent)
-    mac_body = indent_lines("""
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        val1 = __PKHBT_LSLn(val1, val2, 16); //b00 b01
-        val0 = __PKHBT_LSLn(val0, val3, 16); //a00 a01
-        ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
-        val5 = __SXTB16(val4);
-        val4 = __SXTB16_RORn(val4, 8);
-        val4 = __PKHBT_LSLn(val4, val5, 16); //b10, b11
-        ch_0_out_1 = __SMLAD(val0, val4, ch_1_out_1);
-        val2 = read_int8x4(ip_a1);
-        ip_a1 += 2;
-        val3 = __SXTB16(val0);
-        val2 = __SXTB16_RORn(val2, 8);
-        val2 = __PKHBT_LSLn(val2, val3, 16); //a10, a11
-        ch_1_out_0 = __SMLAD(val2, val1, ch_1_out_0);""", indent)
-    assert is_tail, "SIMD MAC non 4 must be tail"
-    mac_tail = indent_lines("""
-        ch_1_out_1 = __SMLAD(val2, val4, ch_1_out_1);""", indent)
 
-    return mac_head + mac_body + mac_tail
+def c2o1_mac_1(out: CodeEmitter) -> None:
+    out.lines(C2O1_MAC_1)
 
 
-def c2o1_mac_1(indent: int) -> str:
-    return indent_lines("""
-        val1 = *(ip_b0++);
-        val0 = *(ip_a0++);
-        ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
-        val5 = *(ip_a1++);
-        ch_1_out_0 = __SMLABB(val5, val1, ch_1_out_0);
-    """, indent)
+C2O2_MAC_1_HEAD = template("""
+    val1 = *(ip_b0++);
+    val0 = *(ip_a0++);
+    val4 = *(ip_b1++);""")
+C2O2_MAC_1_NEXT = template("""
+    val1 = *(ip_b0++);
+    ch_1_out_1 = __SMLAD(val0, val4, ch_1_out_1);
+    val4 = *(ip_b1++);
+    val0 = *(ip_a0++);""")
+C2O2_MAC_1_BODY = template("""
+    ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
+    ch_0_out_1 = __SMLABB(val0, val4, ch_0_out_1);
+    val5 = *(ip_a1++);
+    ch_1_out_0 = __SMLABB(val5, val1, ch_1_out_0);""")
+C2O2_MAC_1_TAIL = template("""
+    ch_1_out_1 = __SMLABB(val5, val4, ch_1_out_1);""")
 
 
-def c2o2_mac_1(is_head: bool, is_tail: bool, indent: int) -> str:
+def c2o2_mac_1(out: CodeEmitter, is_head: bool, is_tail: bool) -> None:
     # XXX: if not is_head, the previous mac must be mac_4
-    mac_head = indent_lines("""
-        val1 = *(ip_b0++);
-        val0 = *(ip_a0++);
-        val4 = *(ip_b1++);""" if is_head else """
-        val1 = *(ip_b0++);
-        ch_1_out_1 = __SMLAD(val0, val4, ch_1_out_1);
-        val4 = *(ip_b1++);
-        val0 = *(ip_a0++);""", indent)
-    mac_body = indent_lines("""
-        ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
-        ch_0_out_1 = __SMLABB(val0, val4, ch_0_out_1);
-        val5 = *(ip_a1++);
-        ch_1_out_0 = __SMLABB(val5, val1, ch_1_out_0);""", indent)
+    out.lines(C2O2_MAC_1_HEAD if is_head else C2O2_MAC_1_NEXT)
+    out.lines(C2O2_MAC_1_BODY)
     assert is_tail, "SIMD MAC non 4 must be tail"
-    mac_tail = indent_lines("""
-        ch_1_out_1 = __SMLABB(val5, val4, ch_1_out_1);""", indent)
+    out.lines(C2O2_MAC_1_TAIL)
+
+
+def requant_line(element: str, i: int | str, requant: RequantMode) -> str:
+    if requant == RequantMode.FLOAT:
+        return f"{element} = (int32_t)((float){element} * scale{i});"
+    return f"{element} = shan_requantize({element}, multiplier{i}, shift{i});"
+
 
-    return mac_head + mac_body + mac_tail
-        
+MAC_OUTPUT_SETUP = template("""
+    const int8_t activation_max = 127;
+    const int8_t activation_min = -128;""")
 
-def mac_output(c: int, o: int, output_layout: DataLayout, indent: int) -> str:
-    content = """
-        const int8_t activation_max = 127;
-        const int8_t activation_min = -128;"""
+
+def mac_output(out: CodeEmitter, c: int, o: int, output_layout: DataLayout, requant: RequantMode) -> None:
+    out.lines(MAC_OUTPUT_SETUP)
     # requantization
+    lines: list[str] = []
     for i in range(0, c):
         for j in range(0, o):
             element = f"ch_{i}_out_{j}"
-            scale = f"scale_{i}"
-            content += f"""
-                {element} = (int32_t)((float){element} * {scale});
-                {element} += out_offset;
-                {element} = MAX({element}, activation_min);
-                {element} = MIN({element}, activation_max);"""
+            lines.append(requant_line(element, f"_{i}", requant))
+            lines.append(f"{element} += out_offset;")
+            lines.append(f"{element} = MAX({element}, activation_min);")
+            lines.append(f"{element} = MIN({element}, activation_max);")
     # write output
+    stores: list[str] = []
     for i in range(0, c):
         for j in range(0, o):
             element = f"ch_{i}_out_{j}"
             pos = f"out_{j}" if output_layout == DataLayout.HWC else f"out_{i}"
-            content += f"*({pos}++) = (int8_t){element};\n"
+            stores.append(f"*({pos}++) = (int8_t){element};")
         if output_layout == DataLayout.CHW:
             pos = f"out_{i}"
-            content += f"{pos} += {c} * ch_offset - {o};\n"
-
-    return indent_lines(content, indent)
-
-
-def c1o1_mac_4(indent: int) -> str:
-    return indent_lines("""
-        val1 = read_int8x4_ia(&ip_b0);
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4_ia(&ip_a0);
-        val3 = __SXTB16(val0);
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
-        ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
-    """, indent)
-
-
-def c1o2_mac_4(is_head: bool, is_tail: bool, indent: int) -> str:
-    mac_head = indent_lines("""
-        val1 = read_int8x4_ia(&ip_b0);
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4_ia(&ip_a0);
-        val3 = __SXTB16(val0);
-        val4 = read_int8x4_ia(&ip_b1);""" if is_head else """
-        val1 = read_int8x4_ia(&ip_b0);
-        ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);
-        val4 = read_int8x4_ia(&ip_b1);
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4_ia(&ip_a0);
-        val3 = __SXTB16(val0);""", indent)
-    mac_body = indent_lines("""
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
-        val5 = __SXTB16(val4);
-        ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
-        val4 = __SXTB16_RORn(val4, 8);
-        ch_0_out_1 = __SMLAD(val3, val5, ch_0_out_1);""", indent)
-    mac_tail = indent_lines("""
-        ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);""" if is_tail else "", indent)
-
-    return mac_head + mac_body + mac_tail
-
-
-def c1o1_mac_3(indent: int) -> str:
-    return indent_lines("""
-        val1 = read_int8x4_ia(&ip_b0);
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4_ia(&ip_a0);
-        val3 = __SXTB16(val0);
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
-        ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
-    """, indent)
-
-
-def c1o2_mac_3(is_head: bool, is_tail: bool, indent: int) -> str:
+            stores.append(f"{pos} += {c} * ch_offset - {o};")
+    # the first store stays on the line of the last clamp
+    lines[-1] += stores[0]
+    for line in lines + stores[1:]:
+        out.line(line)
+
+
+C1O1_MAC_4 = template("""
+    val1 = read_int8x4_ia(&ip_b0);
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4_ia(&ip_a0);
+    val3 = __SXTB16(val0);
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
+    ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);""")
+
+
+def c1o1_mac_4(out: CodeEmitter) -> None:
+    out.lines(C1O1_MAC_4)
+
+
+C1O2_MAC_4_HEAD = template("""
+    val1 = read_int8x4_ia(&ip_b0);
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4_ia(&ip_a0);
+    val3 = __SXTB16(val0);
+    val4 = read_int8x4_ia(&ip_b1);""")
+C1O2_MAC_4_NEXT = template("""
+    val1 = read_int8x4_ia(&ip_b0);
+    ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);
+    val4 = read_int8x4_ia(&ip_b1);
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4_ia(&ip_a0);
+    val3 = __SXTB16(val0);""")
+C1O2_MAC_4_BODY = template("""
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
+    val5 = __SXTB16(val4);
+    ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
+    val4 = __SXTB16_RORn(val4, 8);
+    ch_0_out_1 = __SMLAD(val3, val5, ch_0_out_1);""")
+C1O2_MAC_4_TAIL = template("""
+    ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);""")
+
+
+def c1o2_mac_4(out: CodeEmitter, is_head: bool, is_tail: bool) -> None:
+    out.lines(C1O2_MAC_4_HEAD if is_head else C1O2_MAC_4_NEXT)
+    out.lines(C1O2_MAC_4_BODY)
+    if is_tail:
+        out.lines(C1O2_MAC_4_TAIL)
+
+
+C1O1_MAC_3 = template("""
+    val1 = read_int8x4_ia(&ip_b0);
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4_ia(&ip_a0);
+    val3 = __SXTB16(val0);
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
+    ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);""")
+
+
+def c1o1_mac_3(out: CodeEmitter) -> None:
+    out.lines(C1O1_MAC_3)
+
+
+# the head and the next round read like c1o2_mac_4
+C1O2_MAC_3_BODY = template("""
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
+    val5 = __SXTB16(val4);
+    ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
+    val4 = __SXTB16_RORn(val4, 8);
+    ch_0_out_1 = __SMLAD(val3, val5, ch_0_out_1);""")
+C1O2_MAC_3_TAIL = template("""
+    ch_0_out_1 = __SMLABB(val0, val4, ch_0_out_1);""")
+
+
+def c1o2_mac_3(out: CodeEmitter, is_head: bool, is_tail: bool) -> None:
     # XXX: if not is_head, the previous mac must be mac_4
-    mac_head = indent_lines("""
-        val1 = read_int8x4_ia(&ip_b0);
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4_ia(&ip_a0);
-        val3 = __SXTB16(val0);
-        val4 = read_int8x4_ia(&ip_b1);""" if is_head else """
-        val1 = read_int8x4_ia(&ip_b0);
-        ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);
-        val4 = read_int8x4_ia(&ip_b1);
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4_ia(&ip_a0);
-        val3 = __SXTB16(val0);""", indent)
-    mac_body = indent_lines("""
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        ch_0_out_0 = __SMLAD(val3, val2, ch_0_out_0);
-        val5 = __SXTB16(val4);
-        ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);
-        val4 = __SXTB16_RORn(val4, 8);
-        ch_0_out_1 = __SMLAD(val3, val5, ch_0_out_1);""", indent)
-    mac_tail = indent_lines("""
-        ch_0_out_1 = __SMLABB(val0, val4, ch_0_out_1);""" if is_tail else "", indent)
-
-    return mac_head + mac_body + mac_tail
-
-
-def c1o1_mac_2(indent: int) -> str:
-    return indent_lines("""
-        val1 = read_int8x4_ia(&ip_b0);
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4_ia(&ip_a0);
-        val3 = __SXTB16(val0);
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        val1 = __PKHBT_LSLn(val1, val2, 16); //b00 b01
-        val0 = __PKHBT_LSLn(val0, val3, 16); //a00 a01
-        ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);""", indent)
-
-
-def c1o2_mac_2(is_head: bool, is_tail: bool, indent: int) -> str:
+    out.lines(C1O2_MAC_4_HEAD if is_head else C1O2_MAC_4_NEXT)
+    out.lines(C1O2_MAC_3_BODY)
+    if is_tail:
+        out.lines(C1O2_MAC_3_TAIL)
+
+
+C1O1_MAC_2 = template("""
+    val1 = read_int8x4_ia(&ip_b0);
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4_ia(&ip_a0);
+    val3 = __SXTB16(val0);
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    val1 = __PKHBT_LSLn(val1, val2, 16); //b00 b01
+    val0 = __PKHBT_LSLn(val0, val3, 16); //a00 a01
+    ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);""")
+
+
+def c1o1_mac_2(out: CodeEmitter) -> None:
+    out.lines(C1O1_MAC_2)
+
+
+C1O2_MAC_2_HEAD = template("""
+    val1 = read_int8x4(ip_b0);
+    ip_b0 += 2;
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4(ip_a0);
+    ip_a0 += 2;
+    val3 = __SXTB16(val0);
+    val4 = read_int8x4(ip_b1);
+    ip_b1 += 2;""")
+C1O2_MAC_2_NEXT = template("""
+    val1 = read_int8x4(ip_b0);
+    ip_b0 += 2;
+    ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);
+    val4 = read_int8x4(ip_b1);
+    ip_b1 += 2;
+    val2 = __SXTB16(val1);
+    val0 = read_int8x4(ip_a0);
+    ip_a0 += 2;
+    val3 = __SXTB16(val0);""")
+C1O2_MAC_2_BODY = template("""
+    val1 = __SXTB16_RORn(val1, 8);
+    val0 = __SXTB16_RORn(val0, 8);
+    val1 = __PKHBT_LSLn(val1, val2, 16); //b00 b01
+    val0 = __PKHBT_LSLn(val0, val3, 16); //a00 a01
+    ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
+    val5 = __SXTB16(val4);
+    val4 = __SXTB16_RORn(val4, 8);
+    val4 = __PKHBT_LSLn(val4, val5, 16); //b10, b11""")
+C1O2_MAC_2_TAIL = template("""
+    ch_0_out_1 = __SMLAD(val0, val4, ch_1_out_1);""")
+
+
+def c1o2_mac_2(out: CodeEmitter, is_head: bool, is_tail: bool) -> None:
     # XXX: if not is_head, the previous mac must be mac_4
-    mac_head = indent_lines("""
-        val1 = read_int8x4(ip_b0);
-        ip_b0 += 2;
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4(ip_a0);
-        ip_a0 += 2;
-        val3 = __SXTB16(val0);
-        val4 = read_int8x4(ip_b1);
-        ip_b1 += 2;""" if is_head else """
-        val1 = read_int8x4(ip_b0);
-        ip_b0 += 2;
-        ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);
-        val4 = read_int8x4(ip_b1);
-        ip_b1 += 2;
-        val2 = __SXTB16(val1);
-        val0 = read_int8x4(ip_a0);
-        ip_a0 += 2;
-        val3 = __SXTB16(val0);""", indent)
-    mac_body = indent_lines("""
-        val1 = __SXTB16_RORn(val1, 8);
-        val0 = __SXTB16_RORn(val0, 8);
-        val1 = __PKHBT_LSLn(val1, val2, 16); //b00 b01
-        val0 = __PKHBT_LSLn(val0, val3, 16); //a00 a01
-        ch_0_out_0 = __SMLAD(val0, val1, ch_0_out_0);
-        val5 = __SXTB16(val4);
-        val4 = __SXTB16_RORn(val4, 8);
-        val4 = __PKHBT_LSLn(val4, val5, 16); //b10, b11""", indent)
+    out.lines(C1O2_MAC_2_HEAD if is_head else C1O2_MAC_2_NEXT)
+    out.lines(C1O2_MAC_2_BODY)
     assert is_tail, "SIMD MAC non 4 must be tail"
-    mac_tail = indent_lines("""
-        ch_0_out_1 = __SMLAD(val0, val4, ch_1_out_1);""", indent)
+    out.lines(C1O2_MAC_2_TAIL)
 
-    return mac_head + mac_body + mac_tail
 
+C1O1_MAC_1 = template("""
+    val1 = *(ip_b0++);
+    val0 = *(ip_a0++);
+    ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);""")
 
-def c1o1_mac_1(indent: int) -> str:
-    return indent_lines("""
-        val1 = *(ip_b0++);
-        val0 = *(ip_a0++);
-        ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);""", indent)
 
+def c1o1_mac_1(out: CodeEmitter) -> None:
+    out.lines(C1O1_MAC_1)
 
-def c1o2_mac_1(is_head: bool, is_tail: bool, indent: int) -> str:
+
+C1O2_MAC_1_HEAD = template("""
+    val1 = *(ip_b0++);
+    val0 = *(ip_a0++);
+    val4 = *(ip_b1++);""")
+C1O2_MAC_1_NEXT = template("""
+    val1 = *(ip_b0++);
+    ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);
+    val4 = *(ip_b1++);
+    val0 = *(ip_a0++);""")
+C1O2_MAC_1_BODY = template("""
+    ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);""")
+C1O2_MAC_1_TAIL = template("""
+    ch_0_out_1 = __SMLABB(val0, val4, ch_0_out_1);""")
+
+
+def c1o2_mac_1(out: CodeEmitter, is_head: bool, is_tail: bool) -> None:
     # XXX: if not is_head, the previous mac must be mac_4
-    mac_head = indent_lines("""
-        val1 = *(ip_b0++);
-        val0 = *(ip_a0++);
-        val4 = *(ip_b1++);""" if is_head else """
-        val1 = *(ip_b0++);
-        ch_0_out_1 = __SMLAD(val0, val4, ch_0_out_1);
-        val4 = *(ip_b1++);
-        val0 = *(ip_a0++);""", indent)
-    mac_body = indent_lines("""
-        ch_0_out_0 = __SMLABB(val0, val1, ch_0_out_0);""", indent)
+    out.lines(C1O2_MAC_1_HEAD if is_head else C1O2_MAC_1_NEXT)
+    out.lines(C1O2_MAC_1_BODY)
     assert is_tail, "SIMD MAC non 4 must be tail"
-    mac_tail = indent_lines("""
-        ch_0_out_1 = __SMLABB(val0, val4, ch_0_out_1);""", indent)
+    out.lines(C1O2_MAC_1_TAIL)
 
-    return mac_head + mac_body + mac_tail
 
-
-def mac_subloop_16(c: int, o: int, mac: int, indent: int) -> str:
+def mac_subloop_16(out: CodeEmitter, c: int, o: int, mac: int) -> None:
     assert mac % 16 == 0
     loop_count = mac // 16
-    content = indent_lines(f"for(int mac16_count = {loop_count}; mac16_count > 0; mac16_count--){{", indent)
-    indent += 1
-    content += mac_body(c, o, 16, indent)
-    indent -= 1
-    content += indent_lines("}", indent)
-    return content
+    out.line(f"for(int mac16_count = {loop_count}; mac16_count > 0; mac16_count--){{")
+    with out.block():
+        mac_body(out, c, o, 16)
+    out.line("}")
 
 
-def mac_body(c: int, o: int, mac: int, indent: int, head: bool = True) -> str:
+def mac_body(out: CodeEmitter, c: int, o: int, mac: int, head: bool = True) -> None:
     if mac >= 48:
         current_mac = (mac // 16) * 16
-        remain_mac = mac - current_mac
-        this_round = mac_subloop_16(c, o, current_mac, indent)
-        return this_round + mac_body(c, o, remain_mac, indent)
-    if mac == 0:
-        return ""
-    this_round = ""    
-    current_mac = min(mac, 4)
-    remain_mac = mac - current_mac   
-    match c, o, current_mac:
-        case 2, 2, 4: this_round = c2o2_mac_4(head, remain_mac==0, indent)
-        case 2, 2, 3: this_round = c2o2_mac_3(head, remain_mac==0, indent)
-        case 2, 2, 2: this_round = c2o2_mac_2(head, remain_mac==0, indent)
-        case 2, 2, 1: this_round = c2o2_mac_1(head, remain_mac==0, indent)
-        case 1, 2, 4: this_round = c1o2_mac_4(head, remain_mac==0, indent)
-        case 1, 2, 3: this_round = c1o2_mac_3(head, remain_mac==0, indent)
-        case 1, 2, 2: this_round = c1o2_mac_2(head, remain_mac==0, indent)
-        case 1, 2, 1: this_round = c1o2_mac_1(head, remain_mac==0, indent)
-        case 2, 1, 4: this_round = c2o1_mac_4(indent)
-        case 2, 1, 3: this_round = c2o1_mac_3(indent)
-        case 2, 1, 2: this_round = c2o1_mac_2(indent)
-        case 2, 1, 1: this_round = c2o1_mac_1(indent)
-        case 1, 1, 4: this_round = c1o1_mac_4(indent)
-        case 1, 1, 3: this_round = c1o1_mac_3(indent)
-        case 1, 1, 2: this_round = c1o1_mac_2(indent)
-        case 1, 1, 1: this_round = c1o1_mac_1(indent)
-        case _, _, _: raise NotImplementedError(f"{c}, {o}, {current_mac}")
-    next_round = "" if remain_mac == 0 else mac_body(c, o, remain_mac, indent, False)
-    return this_round + next_round
+        mac_subloop_16(out, c, o, current_mac)
+        mac -= current_mac
+        head = True
+    while mac > 0:
+        current_mac = min(mac, 4)
+        mac -= current_mac
+        match c, o, current_mac:
+            case 2, 2, 4: c2o2_mac_4(out, head, mac==0)
+            case 2, 2, 3: c2o2_mac_3(out, head, mac==0)
+            case 2, 2, 2: c2o2_mac_2(out, head, mac==0)
+            case 2, 2, 1: c2o2_mac_1(out, head, mac==0)
+            case 1, 2, 4: c1o2_mac_4(out, head, mac==0)
+            case 1, 2, 3: c1o2_mac_3(out, head, mac==0)
+            case 1, 2, 2: c1o2_mac_2(out, head, mac==0)
+            case 1, 2, 1: c1o2_mac_1(out, head, mac==0)
+            case 2, 1, 4: c2o1_mac_4(out)
+            case 2, 1, 3: c2o1_mac_3(out)
+            case 2, 1, 2: c2o1_mac_2(out)
+            case 2, 1, 1: c2o1_mac_1(out)
+            case 1, 1, 4: c1o1_mac_4(out)
+            case 1, 1, 3: c1o1_mac_3(out)
+            case 1, 1, 2: c1o1_mac_2(out)
+            case 1, 1, 1: c1o1_mac_1(out)
+            case _, _, _: raise NotImplementedError(f"{c}, {o}, {current_mac}")
+        head = False
 
 
 def conv2d_setup(
     idx: int,
     input: Tensor,
     output: Tensor,
+    requant: RequantMode,
     indent: int
 ) -> str:
     match output.layout:
@@ -492,7 +542,7 @@ def conv2d_setup(
         const int8_t input_zero_point = {input.zero_point[0]};
         const int8_t out_offset = {output.zero_point[0]};
         const int8_t *weight = {weight_name(idx)};
-        const float *scales = {scales_name(idx)};
+        const {scales_type(requant)} *scales = {scales_name(idx)};
         const int32_t *contrib = {contrib_name(idx)};
         int8_t *pad_pos = output;
         const int8_t *input_elem;
@@ -507,41 +557,38 @@ def pad_output(offset: int, size: int, indent) -> str:
 
 
 def conv2d_prepad(output: Tensor, indent: int) -> str:
-    content = ""
+    out = CodeEmitter(indent)
     # set prepad
     if output.layout == DataLayout.HWC:
         pad_row_size = output.prepad_h * \
             (output.dim_w + 2 * output.prepad_w) * output.dim_c
         if output.prepad_h != 0:
             # prepad row
-            content += indent_lines(
-                f"memset(&output[0], out_offset, {pad_row_size});\n", indent)
-            content += indent_lines(
-                f"memset(&output[{output.mem_size() - pad_row_size}], out_offset, {pad_row_size});\n", indent)
+            out.line(f"memset(&output[0], out_offset, {pad_row_size});")
+            out.line(f"memset(&output[{output.mem_size() - pad_row_size}], out_offset, {pad_row_size});")
         if output.prepad_w != 0:
             # prepad column
-            content += indent_lines(
-                f"pad_pos = &output[{pad_row_size}];\n", indent)
-            content += indent_lines(f"""for(int i = 0; i < {output.dim_h}; i++){{
+            out.line(f"pad_pos = &output[{pad_row_size}];")
+            out.lines(f"""for(int i = 0; i < {output.dim_h}; i++){{
                 memset(pad_pos, out_offset, {output.prepad_w * output.dim_c});
                 memset(pad_pos + {(output.prepad_w + output.dim_w) * output.dim_c}, out_offset, {output.prepad_w * output.dim_c});
                 pad_pos += {(output.dim_w + 2 * output.prepad_w) * output.dim_c};
-            }}""", indent)
+            }}""")
     elif output.layout == DataLayout.CHW:
         pad_row_size = (output.prepad_h * (output.dim_w + 2 * output.prepad_w))
         if output.prepad_h != 0:
             pad_shift = output.dim_h * \
                 (output.dim_w + 2 * output.prepad_w) + 2 * output.prepad_w
-            content += indent_lines(f"""
+            out.lines(f"""
             pad_pos = output;
             for(int i = 0; i < {output.dim_c}; i++) {{
                 memset(pad_pos, out_offset, {pad_row_size});
                 memset(pad_pos + {(output.dim_h + output.prepad_h) * (output.dim_w + 2 * output.prepad_w)}, out_offset, {pad_row_size});
                 pad_pos += {(output.dim_w + 2 * output.prepad_w) * (output.dim_h + 2 * output.prepad_h)};
             }}
-            """, indent)
+            """)
         if output.prepad_w != 0:
-            content += indent_lines(f"""
+            out.lines(f"""
                 pad_pos = output + {pad_row_size};
                 for (int i = 0; i < {output.dim_c}; i++){{
                     for (int j = 0; j < {output.dim_h}; j++) {{
@@ -551,12 +598,12 @@ def conv2d_prepad(output: Tensor, indent: int) -> str:
                     }}
                     pad_pos += {(output.dim_w + 2 * output.prepad_w) * 2 * output.prepad_h};
                 }}
-            """, indent)
-    return content
+            """)
+    return out.getvalue()
 
 
 def conv2d_1x1_by_row(input: Tensor, output: Tensor, output_code: OutputCode, indent) -> str:
-    content = ""
+    out = CodeEmitter(indent)
     out_start = output.prepad_h * \
         (output.dim_w + 2 * output.prepad_w) + output.prepad_w
     if output.layout == DataLayout.HWC:
@@ -566,39 +613,39 @@ def conv2d_1x1_by_row(input: Tensor, output: Tensor, output_code: OutputCode, in
         "input_elem", "out", "weight",
         str(output.dim_c), "ch_offset", "out_offset", "scales", "contrib"
     )
-    o1_cleanup = ""
+    out.lines(f"""
+        out = output + {out_start};
+        input_elem = input;
+        for(int out_h = 0; out_h < {output.dim_h}; out_h++){{
+            for(int out_w = 0; out_w < {output.dim_w} / 2; out_w++){{
+                {o2_call};
+                out += 2 * out_update;
+                input_elem += 2 * {input.dim_c};
+            }}
+    """)
     if output.dim_w % 2 != 0:
         o1_vec_mul = output_code.add_vec_mul(1, input.dim_c, output.layout)
         o1_call = o1_vec_mul.get_call(
             "input_elem", "out", "weight",
             str(output.dim_c), "ch_offset", "out_offset", "scales", "contrib"
         )
-        o1_cleanup = indent_lines(f"""
+        out.lines(f"""
             {o1_call};
             out += out_update;
             input_elem += {input.dim_c};
-        """, indent)
-    content += indent_lines(f"""
-        out = output + {out_start};
-        input_elem = input;
-        for(int out_h = 0; out_h < {output.dim_h}; out_h++){{
-            for(int out_w = 0; out_w < {output.dim_w} / 2; out_w++){{
-                {o2_call};
-                out += 2 * out_update;
-                input_elem += 2 * {input.dim_c};
-            }}
-            {o1_cleanup}
+        """)
+    out.lines(f"""
             out += 2 * {output.prepad_w} * out_update;
         }}
-    """, indent)
-    return content
+    """)
+    return out.getvalue()
 
 
 def conv2d_1x1_low_to_high(input_start: int, output_start: int, num: int,
                            input: Tensor, output: Tensor, output_code: OutputCode, indent) -> str:
-    content = ""
     if num == 0:
-        return content
+        return ""
+    out = CodeEmitter(indent)
     pad_head = output.prepad_h * output.dim_w
     if output.layout == DataLayout.HWC:
         pad_head *= output.dim_c
@@ -607,36 +654,34 @@ def conv2d_1x1_low_to_high(input_start: int, output_start: int, num: int,
         "input_elem", "out", "weight",
         str(output.dim_c), "ch_offset", "out_offset", "scales", "contrib"
     )
-    o1_cleanup = ""
+    out.lines(f"""
+        out = output + {pad_head + output_start};
+        input_elem = input + {input_start};
+        for(int i = 0; i < {num} / 2; i++){{
+            {o2_call};
+            out += 2 * out_update;
+            input_elem += 2 * {input.dim_c};
+        }}
+    """)
     if num % 2 != 0:
         o1_vec_mul = output_code.add_vec_mul(1, input.dim_c, output.layout)
         o1_call = o1_vec_mul.get_call(
             "input_elem", "out", "weight",
             str(output.dim_c), "ch_offset", "out_offset", "scales", "contrib"
         )
-        o1_cleanup = indent_lines(f"""
+        out.lines(f"""
             {o1_call};
             out += out_update;
             input_elem += {input.dim_c};
-        """, indent)
-    content += indent_lines(f"""
-        out = output + {pad_head + output_start};
-        input_elem = input + {input_start};
-        for(int i = 0; i < {num} / 2; i++){{
-            {o2_call};
-            out += 2 * out_update;
-            input_elem += 2 * {input.dim_c};            
-        }}
-        {o1_cleanup}
-    """, indent)
-    return content
+        """)
+    return out.getvalue()
 
 
 def conv2d_1x1_high_to_low(input_start: int, output_start: int, num: int,
                            input: Tensor, output: Tensor, output_code: OutputCode, indent) -> str:
-    content = ""
     if num == 0:
-        return content
+        return ""
+    out = CodeEmitter(indent)
     pad_head = output.prepad_h * output.dim_w
     if output.layout == DataLayout.HWC:
         pad_head *= output.dim_c
@@ -645,29 +690,27 @@ def conv2d_1x1_high_to_low(input_start: int, output_start: int, num: int,
         "input_elem", "out", "weight",
         str(output.dim_c), "ch_offset", "out_offset", "scales", "contrib"
     )
-    o1_cleanup = ""
+    out.lines(f"""
+        out = output + {pad_head + output_start};
+        input_elem = input + {input_start};
+        for(int i = 0; i < {num} / 2; i++){{
+            out -= 2 * out_update;
+            input_elem -= 2 * {input.dim_c};
+            {o2_call};
+        }}
+    """)
     if num % 2 != 0:
         o1_vec_mul = output_code.add_vec_mul(1, input.dim_c, output.layout)
         o1_call = o1_vec_mul.get_call(
             "input_elem", "out", "weight",
             str(output.dim_c), "ch_offset", "out_offset", "scales", "contrib"
         )
-        o1_cleanup = indent_lines(f"""
+        out.lines(f"""
             out -= out_update;
-            input_elem -= {input.dim_c};            
+            input_elem -= {input.dim_c};
             {o1_call};
-        """, indent)
-    content += indent_lines(f"""
-        out = output + {pad_head + output_start};
-        input_elem = input + {input_start};
-        for(int i = 0; i < {num} / 2; i++){{
-            out -= 2 * out_update;
-            input_elem -= 2 * {input.dim_c}; 
-            {o2_call}; 
-        }}
-        {o1_cleanup}
-    """, indent)
-    return content
+        """)
+    return out.getvalue()
 
 
 def conv2d_1x1_all(input: Tensor, output: Tensor, output_code: OutputCode, indent) -> str:
@@ -676,14 +719,14 @@ def conv2d_1x1_all(input: Tensor, output: Tensor, output_code: OutputCode, inden
 
 
 def conv2d_window_slide(op: Conv2D, input: Tensor, weight: Tensor, output: Tensor, output_code: OutputCode, indent) -> str:
-    content = ""
+    out = CodeEmitter(indent)
     o2_vec_mul = output_code.add_vec_mul(
         2, weight.dim_h * weight.dim_w * input.dim_c, output.layout)
     o2_call = o2_vec_mul.get_call(
         "buffer", "out", "weight",
         str(output.dim_c), "ch_offset", "out_offset", "scales", "contrib"
     )
-    o1_block = ""
+    o1_call = ""
     if output.dim_w % 2 != 0:
         o1_vec_mul = output_code.add_vec_mul(
             2, weight.dim_h * weight.dim_w * input.dim_c, output.layout)
@@ -691,16 +734,11 @@ def conv2d_window_slide(op: Conv2D, input: Tensor, weight: Tensor, output: Tenso
             "buffer", "out", "weight",
             str(output.dim_c), "ch_offset", "out_offset", "scales", "contrib"
         )
-        o1_block = indent_lines(f"""
-            {o1_call};
-            col_buf = buffer;
-            out += out_update;
-        """, indent)
     output_start = output.prepad_h * \
         (2 * output.prepad_w + output.dim_w) + output.prepad_w
     if output.layout == DataLayout.HWC:
         output_start *= output.dim_c
-    content += indent_lines(f"""
+    out.lines(f"""
         out = output + {output_start};
         const int in_window_x_start = -{op.pad_w};
         int in_window_y = -{op.pad_h};
@@ -709,9 +747,10 @@ def conv2d_window_slide(op: Conv2D, input: Tensor, weight: Tensor, output: Tenso
         for(int oy = 0; oy < {output.dim_h}; oy++){{
             int in_window_x = in_window_x_start;
             for(int ox = 0; ox < {output.dim_w}; ox++){{
-    """, indent)
-    indent += 2
-    content += indent_lines(f"""
+    """)
+    with out.block():
+        with out.block():
+            out.lines(f"""
                 int8_t *window_row_buf = col_buf;
                 int cp_y = 0;
                 if(in_window_y < 0) {{
@@ -740,19 +779,21 @@ def conv2d_window_slide(op: Conv2D, input: Tensor, weight: Tensor, output: Tenso
                     col_buf = buffer;
                     out += 2 * out_update;
                 }}
-    """, indent)
-    indent -= 1
-    out_row_update = 2 * output.prepad_w
-    if output.layout == DataLayout.HWC:
-        out_row_update *= output.dim_c
-    content += indent_lines(f"""
-            }}
-            {o1_block}
+            """)
+        out_row_update = 2 * output.prepad_w
+        if output.layout == DataLayout.HWC:
+            out_row_update *= output.dim_c
+        out.line("}")
+        if output.dim_w % 2 != 0:
+            # odd output width, the last window of the row
+            out.lines(f"""
+                {o1_call};
+                col_buf = buffer;
+                out += out_update;
+            """)
+        out.lines(f"""
             out += {out_row_update};
             in_window_y += {op.stride_h};
-    """, indent)
-    indent -= 1
-    content += indent_lines(f"""
-        }}
-    """, indent)
-    return content
+        """)
+    out.line("}")
+    return out.getvalue()
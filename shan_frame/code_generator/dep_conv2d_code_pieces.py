@@ -1,353 +1,357 @@
 from .conv2d_code_pieces import *
 from .output_code import VecMulFunc
-from .utils import indent_lines
+from .utils import CodeEmitter, indent_lines, template
 
 
-def chconv_setup(stride: int, rev: bool, indent: int) -> str:
+def chconv_setup(out: CodeEmitter, stride: int, rev: bool) -> None:
     if rev:
-        return indent_lines(f"""
+        out.lines(f"""
             const int8_t *input_col = input + (out_h - 1) * {stride} * input_w + out_w * {stride};
             int8_t *out = output + (out_h * out_w) * ch_offset;
-        """, indent)        
+        """)
     else:
-        return indent_lines(f"""
+        out.lines(f"""
             const int row_offset = input_w - out_w * {stride};
             const int8_t *input_col = input;
             int8_t *out = output;
-        """, indent)
-        
-def chconv_mac_setup(stride: int, o: int, rev: bool, indent: int) -> str:
-    content = ""
+        """)
+
+def chconv_mac_setup(out: CodeEmitter, stride: int, o: int, rev: bool) -> None:
     if rev:
-        content += indent_lines(f"""input_col -= {o * stride};
-        const int8_t *cols_8b = input_col;""", indent)
+        out.line(f"input_col -= {o * stride};")
+        out.line("const int8_t *cols_8b = input_col;")
     else:
-        content += indent_lines(f"""const int8_t *cols_8b = input_col;
-        input_col += {o * stride};""", indent)
+        out.line("const int8_t *cols_8b = input_col;")
+        out.line(f"input_col += {o * stride};")
     for i in range(0, o):
-        content += indent_lines(f"int32_t sum{i} = contrib;", indent)
-    return content
+        out.line(f"int32_t sum{i} = contrib;")
 
-def chconv_k3x3_mac_setup(indent: int) -> str:
-    return indent_lines(f"""
-        int32_t k3210, k20, k31, c3210, c20, c31, c4;
-        k3210 = read_int8x4(ksrc);
-        k20 = __SXTB16(k3210);
-        k31 = __SXTB16_RORn(k3210, 8);
-        int32_t k7654, k64, k75, ka8;
-        k7654 = read_int8x4(ksrc + 4);
-        k64 = __SXTB16(k7654);
-        k75 = __SXTB16_RORn(k7654, 8);
-        ka8 = ksrc[8];""", indent)
-
-def chconv_mac_output(o: int, rev: bool, indent: int) -> str:
-    content = ""
+CHCONV_K3X3_MAC_SETUP = template("""
+    int32_t k3210, k20, k31, c3210, c20, c31, c4;
+    k3210 = read_int8x4(ksrc);
+    k20 = __SXTB16(k3210);
+    k31 = __SXTB16_RORn(k3210, 8);
+    int32_t k7654, k64, k75, ka8;
+    k7654 = read_int8x4(ksrc + 4);
+    k64 = __SXTB16(k7654);
+    k75 = __SXTB16_RORn(k7654, 8);
+    ka8 = ksrc[8];""")
+
+def chconv_k3x3_mac_setup(out: CodeEmitter) -> None:
+    out.lines(CHCONV_K3X3_MAC_SETUP)
+
+def chconv_requant_line(sum: str, requant: RequantMode) -> str:
+    if requant == RequantMode.FLOAT:
+        return f"{sum} = (float){sum} * scale;"
+    return f"{sum} = shan_requantize({sum}, multiplier, shift);"
+
+
+def chconv_mac_output(out: CodeEmitter, o: int, rev: bool, requant: RequantMode) -> None:
     if rev:
         for i in reversed(range(0, o)):
             sum = f"sum{i}"
-            content += indent_lines(f"""
-            {sum} = (float){sum} * scale;
-            {sum} += out_offset;
-            {sum} = MAX({sum}, -128);
-            {sum} = MIN({sum}, 127);
-            out -= ch_offset;
-            *out = {sum};""", indent)
+            out.line(chconv_requant_line(sum, requant))
+            out.line(f"{sum} += out_offset;")
+            out.line(f"{sum} = MAX({sum}, -128);")
+            out.line(f"{sum} = MIN({sum}, 127);")
+            out.line("out -= ch_offset;")
+            out.line(f"*out = {sum};")
     else:
         for i in (range(0, o)):
             sum = f"sum{i}"
-            content += indent_lines(f"""
-            {sum} = (float){sum} * scale;
-            {sum} += out_offset;
-            {sum} = MAX({sum}, -128);
-            {sum} = MIN({sum}, 127);
-            *out = {sum};
-            out += ch_offset;""", indent)
-    return content
-
-def chconv_k3x3_stride1_o2_mac(rev: bool, indent: int) -> str:
-    content = chconv_mac_setup(1, 2, rev, indent)
-    content += indent_lines(f"""
-        c3210 = read_int8x4(cols_8b);
-        c20 = __SXTB16(c3210);
-        c31 = __SXTB16_RORn(c3210, 8);
-        sum0 = __SMLAD(c20, k20, sum0); // 0*0 + 2*2
-        sum0 = __SMLABB(c31, k31, sum0); // += 1*1
-        sum1 = __SMLAD(c31, k20, sum1); // 1*0 + 3*2
-        sum1 = __SMLATB(c20, k31, sum1); // += 2*1
-        cols_8b += input_w;
-        
-        c3210 = read_int8x4(cols_8b);
-        c20 = __SXTB16(c3210);
-        c31 = __SXTB16_RORn(c3210, 8);
-        sum0 = __SMLABT(c20, k31, sum0); // += 0 * 3
-        sum0 = __SMLABB(c31, k64, sum0); // += 1 * 4
-        sum0 = __SMLATB(c20, k75, sum0); // += 2 * 5
-        sum1 = __SMLABT(c31, k31, sum1); // += 1 * 3
-        sum1 = __SMLATB(c20, k64, sum1); // += 2 * 4
-        sum1 = __SMLATB(c31, k75, sum1); // += 3 * 5
-        cols_8b += input_w;
-
-        c3210 = read_int8x4(cols_8b);
-        c20 = __SXTB16(c3210);
-        c31 = __SXTB16_RORn(c3210, 8);
-        sum0 = __SMLABT(c20, k64, sum0); // += 0 * 6
-        sum0 = __SMLABT(c31, k75, sum0); // += 1 * 7
-        sum0 = __SMLATB(c20, ka8, sum0); // += 2 * 8
-        sum1 = __SMLABT(c31, k64, sum1); // += 1 * 6
-        sum1 = __SMLATT(c20, k75, sum1); // += 2 * 7
-        sum1 = __SMLATB(c31, ka8, sum1); // += 3 * 8""", indent)
-    content += chconv_mac_output(2, rev, indent)
-    return content
-
-
-def chconv_k3x3_stride2_o2_mac(rev: bool, indent: int) -> str:
-    content = chconv_mac_setup(1, 2, rev, indent)
-    content += indent_lines(f"""         
-        c3210 = read_int8x4(cols_8b);
-        c20 = __SXTB16(c3210);
-        c31 = __SXTB16_RORn(c3210, 8);
-        c4 = cols_8b[4];
-        sum0 = __SMLAD(c20, k20, sum0); // 0*0 + 2*2
-        sum0 = __SMLABB(c31, k31, sum0); // += 1*1
-        sum1 = __SMLATB(c20, k20, sum1);
-        sum1 = __SMLATB(c31, k31, sum1);
-        sum1 = __SMLABT(c4, k20, sum1);
-        cols_8b += input_w;
-        
-        c3210 = read_int8x4(cols_8b);
-        c20 = __SXTB16(c3210);
-        c31 = __SXTB16_RORn(c3210, 8);
-        c4 = cols_8b[4];
-        sum0 = __SMLABT(c20, k31, sum0); // += 0 * 3
-        sum0 = __SMLATB(c20, k75, sum0); // += 2 * 5
-        sum0 = __SMLABB(c31, k64, sum0); // += 1 * 4
-        sum1 = __SMLATT(c20, k31, sum1);
-        sum1 = __SMLATB(c31, k64, sum1);
-        sum1 = __SMLABB(c4, k75, sum1);
-        cols_8b += input_w;
-        
-        c3210 = read_int8x4(cols_8b);
-        c20 = __SXTB16(c3210);
-        c31 = __SXTB16_RORn(c3210, 8);
-        c4 = cols_8b[4];
-        sum0 = __SMLABT(c20, k64, sum0); // += 0 * 6
-        sum0 = __SMLATB(c20, ka8, sum0); // += 2 * 8
-        sum0 = __SMLABT(c31, k75, sum0); // += 1 * 7
-        sum1 = __SMLATT(c20, k64, sum1);
-        sum1 = __SMLATT(c31, k75, sum1);
-        sum1 = __SMLABB(c4, ka8, sum1);""", indent)
-    content += chconv_mac_output(2, rev, indent)
-    return content
-
-
-def chconv_k5x5_mac_setup(indent: int) -> str:
-    return indent_lines(f"""
-        int32_t k3210, k20, k31, k4;
-        int32_t c3210, c20, c31, c7654, c75, c64;
-    """, indent)
-
-
-def chconv_k5x5_stride1_o2_mac(indent: int) -> str:
-    content = chconv_mac_setup(1, 2, False, indent)
-    content += indent_lines("const int8_t *k = ksrc;", indent)
+            out.line(chconv_requant_line(sum, requant))
+            out.line(f"{sum} += out_offset;")
+            out.line(f"{sum} = MAX({sum}, -128);")
+            out.line(f"{sum} = MIN({sum}, 127);")
+            out.line(f"*out = {sum};")
+            out.line("out += ch_offset;")
+
+CHCONV_K3X3_STRIDE1_O2_MAC = template("""
+    c3210 = read_int8x4(cols_8b);
+    c20 = __SXTB16(c3210);
+    c31 = __SXTB16_RORn(c3210, 8);
+    sum0 = __SMLAD(c20, k20, sum0); // 0*0 + 2*2
+    sum0 = __SMLABB(c31, k31, sum0); // += 1*1
+    sum1 = __SMLAD(c31, k20, sum1); // 1*0 + 3*2
+    sum1 = __SMLATB(c20, k31, sum1); // += 2*1
+    cols_8b += input_w;
+
+    c3210 = read_int8x4(cols_8b);
+    c20 = __SXTB16(c3210);
+    c31 = __SXTB16_RORn(c3210, 8);
+    sum0 = __SMLABT(c20, k31, sum0); // += 0 * 3
+    sum0 = __SMLABB(c31, k64, sum0); // += 1 * 4
+    sum0 = __SMLATB(c20, k75, sum0); // += 2 * 5
+    sum1 = __SMLABT(c31, k31, sum1); // += 1 * 3
+    sum1 = __SMLATB(c20, k64, sum1); // += 2 * 4
+    sum1 = __SMLATB(c31, k75, sum1); // += 3 * 5
+    cols_8b += input_w;
+
+    c3210 = read_int8x4(cols_8b);
+    c20 = __SXTB16(c3210);
+    c31 = __SXTB16_RORn(c3210, 8);
+    sum0 = __SMLABT(c20, k64, sum0); // += 0 * 6
+    sum0 = __SMLABT(c31, k75, sum0); // += 1 * 7
+    sum0 = __SMLATB(c20, ka8, sum0); // += 2 * 8
+    sum1 = __SMLABT(c31, k64, sum1); // += 1 * 6
+    sum1 = __SMLATT(c20, k75, sum1); // += 2 * 7
+    sum1 = __SMLATB(c31, ka8, sum1); // += 3 * 8""")
+
+def chconv_k3x3_stride1_o2_mac(out: CodeEmitter, rev: bool, requant: RequantMode) -> None:
+    chconv_mac_setup(out, 1, 2, rev)
+    out.lines(CHCONV_K3X3_STRIDE1_O2_MAC)
+    chconv_mac_output(out, 2, rev, requant)
+
+
+CHCONV_K3X3_STRIDE2_O2_MAC = template("""
+    c3210 = read_int8x4(cols_8b);
+    c20 = __SXTB16(c3210);
+    c31 = __SXTB16_RORn(c3210, 8);
+    c4 = cols_8b[4];
+    sum0 = __SMLAD(c20, k20, sum0); // 0*0 + 2*2
+    sum0 = __SMLABB(c31, k31, sum0); // += 1*1
+    sum1 = __SMLATB(c20, k20, sum1);
+    sum1 = __SMLATB(c31, k31, sum1);
+    sum1 = __SMLABT(c4, k20, sum1);
+    cols_8b += input_w;
+
+    c3210 = read_int8x4(cols_8b);
+    c20 = __SXTB16(c3210);
+    c31 = __SXTB16_RORn(c3210, 8);
+    c4 = cols_8b[4];
+    sum0 = __SMLABT(c20, k31, sum0); // += 0 * 3
+    sum0 = __SMLATB(c20, k75, sum0); // += 2 * 5
+    sum0 = __SMLABB(c31, k64, sum0); // += 1 * 4
+    sum1 = __SMLATT(c20, k31, sum1);
+    sum1 = __SMLATB(c31, k64, sum1);
+    sum1 = __SMLABB(c4, k75, sum1);
+    cols_8b += input_w;
+
+    c3210 = read_int8x4(cols_8b);
+    c20 = __SXTB16(c3210);
+    c31 = __SXTB16_RORn(c3210, 8);
+    c4 = cols_8b[4];
+    sum0 = __SMLABT(c20, k64, sum0); // += 0 * 6
+    sum0 = __SMLATB(c20, ka8, sum0); // += 2 * 8
+    sum0 = __SMLABT(c31, k75, sum0); // += 1 * 7
+    sum1 = __SMLATT(c20, k64, sum1);
+    sum1 = __SMLATT(c31, k75, sum1);
+    sum1 = __SMLABB(c4, ka8, sum1);""")
+
+
+def chconv_k3x3_stride2_o2_mac(out: CodeEmitter, rev: bool, requant: RequantMode) -> None:
+    chconv_mac_setup(out, 1, 2, rev)
+    out.lines(CHCONV_K3X3_STRIDE2_O2_MAC)
+    chconv_mac_output(out, 2, rev, requant)
+
+
+CHCONV_K5X5_MAC_SETUP = template("""
+    int32_t k3210, k20, k31, k4;
+    int32_t c3210, c20, c31, c7654, c75, c64;""")
+
+
+def chconv_k5x5_mac_setup(out: CodeEmitter) -> None:
+    out.lines(CHCONV_K5X5_MAC_SETUP)
+
+
+# one kernel row, after a "// row i" comment
+CHCONV_K5X5_STRIDE1_O2_ROW = template("""
+    c3210 = read_int8x4(cols_8b);
+    c20 = __SXTB16(c3210);
+    c31 = __SXTB16_RORn(c3210, 8);
+    memcpy(&c64, cols_8b+4, 2); // c54 actually
+    k3210 = read_int8x4(k);
+    k20 = __SXTB16(k3210);
+    k31 = __SXTB16_RORn(k3210, 8);
+    k4 = k[4];
+    sum0 = __SMLAD(c20, k20, sum0); // 00 22
+    sum0 = __SMLAD(c31, k31, sum0); // 11 33
+    sum0 = __SMLABB(c64, k4, sum0);   // 44
+    sum1 = __SMLAD(c31, k20, sum1); // 10 + 32
+    sum1 = __SMLATB(c20, k31, sum1); // 21
+    sum1 = __SMLABT(c64, k31, sum1); // 43
+    sum1 = __SMLATB(c64, k4, sum1); // 54
+    cols_8b += input_w;
+    k += 5;""")
+
+
+def chconv_k5x5_stride1_o2_mac(out: CodeEmitter, requant: RequantMode) -> None:
+    chconv_mac_setup(out, 1, 2, False)
+    out.line("const int8_t *k = ksrc;")
     for i in range(0, 5):
-        content += indent_lines(f"""
-            // row {i}
-            c3210 = read_int8x4(cols_8b);
-            c20 = __SXTB16(c3210);
-            c31 = __SXTB16_RORn(c3210, 8);
-            memcpy(&c64, cols_8b+4, 2); // c54 actually
-            k3210 = read_int8x4(k);
-            k20 = __SXTB16(k3210);
-            k31 = __SXTB16_RORn(k3210, 8);
-            k4 = k[4];
-            sum0 = __SMLAD(c20, k20, sum0); // 00 22
-            sum0 = __SMLAD(c31, k31, sum0); // 11 33
-            sum0 = __SMLABB(c64, k4, sum0);   // 44
-            sum1 = __SMLAD(c31, k20, sum1); // 10 + 32
-            sum1 = __SMLATB(c20, k31, sum1); // 21
-            sum1 = __SMLABT(c64, k31, sum1); // 43
-            sum1 = __SMLATB(c64, k4, sum1); // 54
-            cols_8b += input_w;
-            k += 5;
-        """, indent)
-    content += chconv_mac_output(2, False, indent)
-    return content
-
-
-def chconv_k5x5_stride2_o2_mac(indent: int) -> str:
-    content = chconv_mac_setup(1, 2, False, indent)
-    content += indent_lines("const int8_t *k = ksrc;", indent)
+        out.line(f"// row {i}")
+        out.lines(CHCONV_K5X5_STRIDE1_O2_ROW)
+    chconv_mac_output(out, 2, False, requant)
+
+
+CHCONV_K5X5_STRIDE2_O2_ROW = template("""
+    c3210 = read_int8x4(cols_8b);
+    c20 = __SXTB16(c3210);
+    c31 = __SXTB16_RORn(c3210, 8);
+    c7654 = read_int8x4(cols_8b);
+    c64 = __SXTB16(c7654);
+    c75 = __SXTB16_RORn(7654, 8);
+    k3210 = read_int8x4(k);
+    k20 = __SXTB16(k3210);
+    k31 = __SXTB16_RORn(k3210, 8);
+    k4 = k[4];
+    sum0 = __SMLAD(c20, k20, sum0); // 00 22
+    sum0 = __SMLAD(c31, k31, sum0); // 11 33
+    sum0 = __SMLABB(c64, k4, sum0);   // 44
+    sum1 = __SMLATB(c20, k20, sum1); // 20
+    sum1 = __SMLATB(c31, k31, sum1); // 31
+    sum1 = __SMLABT(c64, k20, sum1); // 42
+    sum1 = __SMLABT(c75, k31, sum1); // 53
+    sum1 = __SMLATB(c64, k4, sum1); // 64
+    cols_8b += input_w;
+    k += 5;""")
+
+
+def chconv_k5x5_stride2_o2_mac(out: CodeEmitter, requant: RequantMode) -> None:
+    chconv_mac_setup(out, 1, 2, False)
+    out.line("const int8_t *k = ksrc;")
     for i in range(0, 5):
-        content += indent_lines(f"""
-            // row {i}
-            c3210 = read_int8x4(cols_8b);
-            c20 = __SXTB16(c3210);
-            c31 = __SXTB16_RORn(c3210, 8);
-            c7654 = read_int8x4(cols_8b);
-            c64 = __SXTB16(c7654);
-            c75 = __SXTB16_RORn(7654, 8);
-            k3210 = read_int8x4(k);
-            k20 = __SXTB16(k3210);
-            k31 = __SXTB16_RORn(k3210, 8);
-            k4 = k[4];
-            sum0 = __SMLAD(c20, k20, sum0); // 00 22
-            sum0 = __SMLAD(c31, k31, sum0); // 11 33
-            sum0 = __SMLABB(c64, k4, sum0);   // 44
-            sum1 = __SMLATB(c20, k20, sum1); // 20
-            sum1 = __SMLATB(c31, k31, sum1); // 31
-            sum1 = __SMLABT(c64, k20, sum1); // 42
-            sum1 = __SMLABT(c75, k31, sum1); // 53
-            sum1 = __SMLATB(c64, k4, sum1); // 64
-            cols_8b += input_w;
-            k += 5;
-        """, indent)
-    content += chconv_mac_output(2, False, indent)
-    return content
-
-
-def chconv_k7x7_mac_setup(indent: int) -> str:
-    return indent_lines(f"""
-        int32_t k3210, k20, k31, k7654, k64, k75;
-        int32_t c3210, c20, c31, c7654, c75, c64, c8;
-    """, indent)
-
-
-def chconv_k7x7_stride1_o2_mac(indent: int) -> str:
-    content = chconv_mac_setup(1, 2, False, indent)
-    content += indent_lines("const int8_t *k = ksrc;", indent)
+        out.line(f"// row {i}")
+        out.lines(CHCONV_K5X5_STRIDE2_O2_ROW)
+    chconv_mac_output(out, 2, False, requant)
+
+
+CHCONV_K7X7_MAC_SETUP = template("""
+    int32_t k3210, k20, k31, k7654, k64, k75;
+    int32_t c3210, c20, c31, c7654, c75, c64, c8;""")
+
+
+def chconv_k7x7_mac_setup(out: CodeEmitter) -> None:
+    out.lines(CHCONV_K7X7_MAC_SETUP)
+
+
+CHCONV_K7X7_STRIDE1_O2_ROW = template("""
+    c3210 = read_int8x4(cols_8b);
+    c20 = __SXTB16(c3210);
+    c31 = __SXTB16_RORn(c3210, 8);
+    c7654 = read_int8x4(cols_8b);
+    c64 = __SXTB16(c7654);
+    c75 = __SXTB16_RORn(c7654, 8);
+    k3210 = read_int8x4(k);
+    k20 = __SXTB16(k3210);
+    k31 = __SXTB16_RORn(k3210, 8);
+    k7654 = read_int8x4(k);
+    k64 = __SXTB16(k7654);
+    k75 = __SXTB16_RORn(k7654, 8);
+    sum0 = __SMLAD(c20, k20, sum0); // 00 22
+    sum0 = __SMLAD(c31, k31, sum0); // 11 33
+    sum0 = __SMLAD(c64, k64, sum0); // 66 44
+    sum0 = __SMLABB(c75, k75, sum0); // 55
+
+    sum1 = __SMLAD(c31, k20, sum1); // 10 + 32
+    sum1 = __SMLATB(c20, k31, sum1); // 21
+    sum1 = __SMLABT(c64, k31, sum1); // 43
+    sum1 = __SMLAD(c75, k64, sum1); //76, 54
+    sum1 = __SMLATB(c64, k75, sum1); // 65
+    cols_8b += input_w;
+    k += 7;""")
+
+
+def chconv_k7x7_stride1_o2_mac(out: CodeEmitter, requant: RequantMode) -> None:
+    chconv_mac_setup(out, 1, 2, False)
+    out.line("const int8_t *k = ksrc;")
     for i in range(0, 7):
-        content += indent_lines(f"""
-            // row {i}
-            c3210 = read_int8x4(cols_8b);
-            c20 = __SXTB16(c3210);
-            c31 = __SXTB16_RORn(c3210, 8);
-            c7654 = read_int8x4(cols_8b);
-            c64 = __SXTB16(c7654);
-            c75 = __SXTB16_RORn(c7654, 8);
-            k3210 = read_int8x4(k);
-            k20 = __SXTB16(k3210);
-            k31 = __SXTB16_RORn(k3210, 8);
-            k7654 = read_int8x4(k);
-            k64 = __SXTB16(k7654);
-            k75 = __SXTB16_RORn(k7654, 8);
-            sum0 = __SMLAD(c20, k20, sum0); // 00 22
-            sum0 = __SMLAD(c31, k31, sum0); // 11 33
-            sum0 = __SMLAD(c64, k64, sum0); // 66 44
-            sum0 = __SMLABB(c75, k75, sum0); // 55
-            
-            sum1 = __SMLAD(c31, k20, sum1); // 10 + 32
-            sum1 = __SMLATB(c20, k31, sum1); // 21
-            sum1 = __SMLABT(c64, k31, sum1); // 43
-            sum1 = __SMLAD(c75, k64, sum1); //76, 54
-            sum1 = __SMLATB(c64, k75, sum1); // 65
-            cols_8b += input_w;
-            k += 7;
-        """, indent)
-    content += chconv_mac_output(2, False, indent)
-    return content
-
-
-def chconv_k7x7_stride2_o2_mac(indent: int) -> str:
-    content = chconv_mac_setup(1, 2, False, indent)
-    content += indent_lines("const int8_t *k = ksrc;", indent)
+        out.line(f"// row {i}")
+        out.lines(CHCONV_K7X7_STRIDE1_O2_ROW)
+    chconv_mac_output(out, 2, False, requant)
+
+
+CHCONV_K7X7_STRIDE2_O2_ROW = template("""
+    c3210 = read_int8x4(cols_8b);
+    c20 = __SXTB16(c3210);
+    c31 = __SXTB16_RORn(c3210, 8);
+    c7654 = read_int8x4(cols_8b);
+    c64 = __SXTB16(c7654);
+    c75 = __SXTB16_RORn(c7654, 8);
+    c8 = cols_8b[8];
+    k3210 = read_int8x4(k);
+    k20 = __SXTB16(k3210);
+    k31 = __SXTB16_RORn(k3210, 8);
+    k7654 = read_int8x4(k);
+    k64 = __SXTB16(k7654);
+    k75 = __SXTB16_RORn(k7654, 8);
+    sum0 = __SMLAD(c20, k20, sum0); // 00 22
+    sum0 = __SMLAD(c31, k31, sum0); // 11 33
+    sum0 = __SMLAD(c64, k64, sum0); // 66 44
+    sum0 = __SMLABB(c75, k75, sum0); // 55
+
+    sum1 = __SMLATB(c20, k20, sum1); // 20
+    sum1 = __SMLATB(c31, k31, sum1); // 31
+    sum1 = __SMLABT(c64, k20, sum1); // 42
+    sum1 = __SMLATT(c75, k31, sum1); // 53
+    sum1 = __SMLATB(c64, k64, sum1); // 64
+    sum1 = __SMLATB(c75, k75, sum1); // 75
+    sum1 = __SMLABT( c8, k64, sum1); // 86
+    cols_8b += input_w;
+    k += 7;""")
+
+
+def chconv_k7x7_stride2_o2_mac(out: CodeEmitter, requant: RequantMode) -> None:
+    chconv_mac_setup(out, 1, 2, False)
+    out.line("const int8_t *k = ksrc;")
     for i in range(0, 7):
-        content += indent_lines(f"""
-            // row {i}
-            c3210 = read_int8x4(cols_8b);
-            c20 = __SXTB16(c3210);
-            c31 = __SXTB16_RORn(c3210, 8);
-            c7654 = read_int8x4(cols_8b);
-            c64 = __SXTB16(c7654);
-            c75 = __SXTB16_RORn(c7654, 8);
-            c8 = cols_8b[8];
-            k3210 = read_int8x4(k);
-            k20 = __SXTB16(k3210);
-            k31 = __SXTB16_RORn(k3210, 8);
-            k7654 = read_int8x4(k);
-            k64 = __SXTB16(k7654);
-            k75 = __SXTB16_RORn(k7654, 8);
-            sum0 = __SMLAD(c20, k20, sum0); // 00 22
-            sum0 = __SMLAD(c31, k31, sum0); // 11 33
-            sum0 = __SMLAD(c64, k64, sum0); // 66 44
-            sum0 = __SMLABB(c75, k75, sum0); // 55
-            
-            sum1 = __SMLATB(c20, k20, sum1); // 20
-            sum1 = __SMLATB(c31, k31, sum1); // 31
-            sum1 = __SMLABT(c64, k20, sum1); // 42
-            sum1 = __SMLATT(c75, k31, sum1); // 53
-            sum1 = __SMLATB(c64, k64, sum1); // 64
-            sum1 = __SMLATB(c75, k75, sum1); // 75
-            sum1 = __SMLABT( c8, k64, sum1); // 86
-            cols_8b += input_w;
-            k += 7;
-        """, indent)
-    content += chconv_mac_output(2, False, indent)
-    return content
-
-
-def chconv_generic_mac(kernel_size: int, stride: int, rev: bool, indent: int) -> str:
-    content = chconv_mac_setup(stride, 1, rev, indent)
-    for i in range(0, kernel_size * kernel_size):
-        if i % kernel_size == 0 and i != 0:
-            content += indent_lines(f"cols_8b += input_w;", indent)
-        content += indent_lines(
-            f"sum0 += cols_8b[{i%kernel_size}] * ksrc[{i}];", indent)
-    content += chconv_mac_output(1, rev, indent)
-    return content
-
-
-def chconv_generic_content(kernel_size: int, stride: int, rev: bool, indent: int) -> str:
-    content = chconv_setup(stride, rev, indent)
-    content += indent_lines("for(int i = out_h; i > 0; i--){", indent)
-    indent += 1
-    content += indent_lines("for(int j = out_w; j > 0; j--){", indent)
-    indent += 1
-    content += chconv_generic_mac(kernel_size, stride, rev, indent)
-    update_symbol = "-" if rev else "+"
-    content += indent_lines(f"""
-        }}
-        input_col {update_symbol}= row_offset;""", indent)
-    indent -= 1
-    content += indent_lines("}", indent)
-    return content
+        out.line(f"// row {i}")
+        out.lines(CHCONV_K7X7_STRIDE2_O2_ROW)
+    chconv_mac_output(out, 2, False, requant)
 
 
-def chconv_preset_content(kernel_size: int, stride: int, rev: bool, indent: int) -> str:
-    content = chconv_setup(stride, rev, indent)
+def chconv_generic_mac(out: CodeEmitter, kernel_size: int, stride: int, rev: bool, requant: RequantMode) -> None:
+    chconv_mac_setup(out, stride, 1, rev)
+    for i in range(0, kernel_size * kernel_size):
+        if i % kernel_size == 0 and i != 0:
+            out.line("cols_8b += input_w;")
+        out.line(f"sum0 += cols_8b[{i%kernel_size}] * ksrc[{i}];")
+    chconv_mac_output(out, 1, rev, requant)
+
+
+def chconv_generic_content(out: CodeEmitter, kernel_size: int, stride: int, rev: bool, requant: RequantMode) -> None:
+    chconv_setup(out, stride, rev)
+    out.line("for(int i = out_h; i > 0; i--){")
+    with out.block():
+        out.line("for(int j = out_w; j > 0; j--){")
+        with out.block():
+            chconv_generic_mac(out, kernel_size, stride, rev, requant)
+            update_symbol = "-" if rev else "+"
+            out.line("}")
+            out.line(f"input_col {update_symbol}= row_offset;")
+        out.line("}")
+
+
+def chconv_preset_content(out: CodeEmitter, kernel_size: int, stride: int, rev: bool, requant: RequantMode) -> None:
+    chconv_setup(out, stride, rev)
     match kernel_size:
-        case 7: content += chconv_k7x7_mac_setup(indent)
-        case 5: content += chconv_k5x5_mac_setup(indent)
-        case 3: content += chconv_k3x3_mac_setup(indent)
+        case 7: chconv_k7x7_mac_setup(out)
+        case 5: chconv_k5x5_mac_setup(out)
+        case 3: chconv_k3x3_mac_setup(out)
         case _: raise NotImplementedError()
-    content += indent_lines("for(int i = out_h; i > 0; i--){", indent)
-    indent += 1
-    content += indent_lines("for(int j = out_w/2; j > 0; j--){", indent)
-    indent += 1
-    match kernel_size, stride:
-        case 7, 2: content += chconv_k7x7_stride2_o2_mac(indent)
-        case 7, 1: content += chconv_k7x7_stride1_o2_mac(indent)
-        case 5, 2: content += chconv_k5x5_stride2_o2_mac(indent)
-        case 5, 1: content += chconv_k5x5_stride1_o2_mac(indent)
-        case 3, 2: content += chconv_k3x3_stride2_o2_mac(rev, indent)
-        case 3, 1: content += chconv_k3x3_stride1_o2_mac(rev, indent)
-        case _, _: raise NotImplementedError()
-    indent -= 1
-    content += indent_lines("}", indent)
-    content += indent_lines("if(out_w % 2 != 0){", indent)
-    indent += 1
-    content += chconv_generic_mac(kernel_size, 1, rev, indent)
-    indent -= 1
-    update_symbol = "-" if rev else "+"
-    content += indent_lines(f"""
-        }}
-        input_col {update_symbol}= row_offset;""", indent)
-    indent -= 1
-    content += indent_lines("}", indent)
-    return content
-
-
-def depconv_setup(model: Model, op: DepthConv2D, indent: int) -> str:
+    out.line("for(int i = out_h; i > 0; i--){")
+    with out.block():
+        out.line("for(int j = out_w/2; j > 0; j--){")
+        with out.block():
+            match kernel_size, stride:
+                case 7, 2: chconv_k7x7_stride2_o2_mac(out, requant)
+                case 7, 1: chconv_k7x7_stride1_o2_mac(out, requant)
+                case 5, 2: chconv_k5x5_stride2_o2_mac(out, requant)
+                case 5, 1: chconv_k5x5_stride1_o2_mac(out, requant)
+                case 3, 2: chconv_k3x3_stride2_o2_mac(out, rev, requant)
+                case 3, 1: chconv_k3x3_stride1_o2_mac(out, rev, requant)
+                case _, _: raise NotImplementedError()
+        out.line("}")
+        out.line("if(out_w % 2 != 0){")
+        with out.block():
+            chconv_generic_mac(out, kernel_size, 1, rev, requant)
+        update_symbol = "-" if rev else "+"
+        out.line("}")
+        out.line(f"input_col {update_symbol}= row_offset;")
+    out.line("}")
+
+
+def depconv_setup(model: Model, op: DepthConv2D, requant: RequantMode, indent: int) -> str:
     input = model.tensors[op.input_idx]
     weight = model.tensors[op.weight_idx]
     output = model.tensors[op.output_idx]
@@ -358,7 +362,7 @@ def depconv_setup(model: Model, op: DepthConv2D, indent: int) -> str:
         const int8_t pad_value = {-input.zero_point[0]};
         const int8_t out_offset = {output.zero_point[0]};
         const int8_t *weight = {weight_name(op.idx)};
-        const float *scales = {scales_name(op.idx)};
+        const {scales_type(requant)} *scales = {scales_name(op.idx)};
         const int32_t *contrib = {contrib_name(op.idx)};
         const int input_h = {input.dim_h + 2 * input.prepad_h};
         const int input_w = {input.dim_w + 2 * input.prepad_h};
@@ -432,12 +436,15 @@ def depconv_loop_body(input: Tensor, weight: Tensor, op: DepthConv2D, output_cod
     assert weight.dim_h == weight.dim_w
     assert op.stride_h == op.stride_w
     ch_conv =  output_code.add_ch_conv(weight.dim_h, op.stride_h, False)
+    # fixed point scales hold a multiplier and shift pair for each channel
+    fixed = output_code.requant == RequantMode.FIXED_POINT
     ch_conv_call = ch_conv.get_call(
         input_str, "out", "weight", 
-        "*(scales++)", "*(contrib++)", "out_offset", 
+        "scales[0], scales[1]" if fixed else "*(scales++)", "*(contrib++)", "out_offset", 
         "row_size", "ch_offset", "out_w", "out_h")
+    scales_update = "\n        scales += 2;" if fixed else ""
     content += indent_lines(f"""
-        {ch_conv_call};
+        {ch_conv_call};{scales_update}
         weight += {weight.dim_h * weight.dim_w};
         input += input_update;
         out += out_update;""", indent)
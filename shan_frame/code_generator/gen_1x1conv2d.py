@@ -5,11 +5,10 @@ from ..ir import DataLayout, Tensor, Model
 from .output_code import KernelFunc, OutputCode, VecMulFunc
 from .utils import (
     buffer_name,
-    effective_scale,
+    requant_const,
     get_conv2d_contribution,
     indent_lines,
     kernel_name,
-    scales_name,
     contrib_name,
     weight_name,
 )
@@ -37,7 +36,7 @@ class VecMulParam:
 
 def gen_non_overlap_content(idx: int, input: Tensor, output: Tensor, output_code: OutputCode) -> str:
     indent = 1
-    content = conv2d_setup(idx, input, output, indent)
+    content = conv2d_setup(idx, input, output, output_code.requant, indent)
     # prepad output
     content += conv2d_prepad(output, indent)
     out_start = output.prepad_h * \
@@ -50,12 +49,9 @@ def gen_non_overlap_content(idx: int, input: Tensor, output: Tensor, output_code
     return content
 
 
-def gen_overlap_content(idx: int, input: Tensor, output: Tensor, output_code: OutputCode) -> str:
-    indent = 1
-    content = conv2d_setup(idx, input, output, indent)
-    assert output.prepad_h == output.prepad_w == 0
-    assert input.layout == output.layout == DataLayout.HWC
-
+def overlap_1x1_split(input: Tensor, output: Tensor) -> tuple[int, int, int, int, int, int]:
+    '''returns (input_start1, out_start1, l_h_num, input_start2, out_start2, h_l_num)
+    l_h_num pixels are computed low to high from start1, then h_l_num pixels high to low from start2'''
     input_floor = input.addr
     input_ceiling = input.addr + input.mem_size()
     output_floor = output.addr
@@ -95,7 +91,16 @@ def gen_overlap_content(idx: int, input: Tensor, output: Tensor, output_code: Ou
         out_start2 = out_start1
     else:
         raise NotImplementedError(f"input: {input_floor}~{input_ceiling}, output: {output_floor}~{output_ceiling}")
-    
+    return (input_start1, out_start1, l_h_num, input_start2, out_start2, h_l_num)
+
+
+def gen_overlap_content(idx: int, input: Tensor, output: Tensor, output_code: OutputCode) -> str:
+    indent = 1
+    content = conv2d_setup(idx, input, output, output_code.requant, indent)
+    assert output.prepad_h == output.prepad_w == 0
+    assert input.layout == output.layout == DataLayout.HWC
+
+    (input_start1, out_start1, l_h_num, input_start2, out_start2, h_l_num) = overlap_1x1_split(input, output)
     content += conv2d_1x1_low_to_high(input_start1, out_start1, l_h_num, input, output, output_code, indent)
     content += conv2d_1x1_high_to_low(input_start2, out_start2, h_l_num, input, output, output_code, indent)
     return content
@@ -107,7 +112,6 @@ def generate_1x1conv2d(op: Conv2D, model: Model, output_code: OutputCode) -> Non
     weight = model.tensors[op.weight_idx]
     bias = model.tensors[op.bias_idx]
     contribution = get_conv2d_contribution(weight, bias, input.zero_point[0])
-    scales = effective_scale(input.scales, weight.scales, output.scales)
     
     assert op.stride_h == op.stride_w == 1
     
@@ -134,7 +138,7 @@ def generate_1x1conv2d(op: Conv2D, model: Model, output_code: OutputCode) -> Non
     func.const = [
         (f"const int8_t {weight_name(op.idx)}[]", weight.data),
         (f"const int32_t {contrib_name(op.idx)}[]", contribution),
-        (f"const float {scales_name(op.idx)}[]", scales)
+        requant_const(op.idx, input, weight, output, output_code.requant)
     ]
     func_name = kernel_name(op.idx, "conv2d_1x1")
     input_addr = f"&{buffer_name()}[{input.addr}]"
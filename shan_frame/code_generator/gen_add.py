@@ -1,31 +1,82 @@
-from .utils import buffer_name
+import numpy as np
+from .utils import buffer_name, indent_lines, kernel_name, add_requant_params, ADD_LEFT_SHIFT
 from ..ir import Model, Tensor
 from ..ir.operator import Add
 from .output_code import OutputCode, KernelFunc
 
+
+class AddParam:
+    multiplier: np.ndarray
+    shift: np.ndarray
+    # -zero_point * 2^20 of each input
+    offset1: int
+    offset2: int
+    out_offset: int
+
+    def __init__(self, input1: Tensor, input2: Tensor, output: Tensor) -> None:
+        (self.multiplier, self.shift) = add_requant_params(input1, input2, output)
+        self.offset1 = -int(input1.zero_point[0]) * (1 << ADD_LEFT_SHIFT)
+        self.offset2 = -int(input2.zero_point[0]) * (1 << ADD_LEFT_SHIFT)
+        self.out_offset = int(output.zero_point[0])
+
+
+def add_lane(a: str, b: str, out: str, param: AddParam, indent: int) -> str:
+    '''one int8 element of a tflite add, with all quantization params folded into literals'''
+    (multiplier, shift) = (param.multiplier, param.shift)
+    return indent_lines(f"""
+        {out} = shan_requantize((int32_t){a} * {1 << ADD_LEFT_SHIFT} + ({param.offset1}), {multiplier[0]}, {shift[0]})
+            + shan_requantize((int32_t){b} * {1 << ADD_LEFT_SHIFT} + ({param.offset2}), {multiplier[1]}, {shift[1]});
+        {out} = shan_requantize({out}, {multiplier[2]}, {shift[2]}) + {param.out_offset};
+        {out} = MAX({out}, -128);
+        {out} = MIN({out}, 127);""", indent)
+
+
+def generate_content(input1: Tensor, input2: Tensor, output: Tensor) -> str:
+    size = input1.mem_size()
+    param = AddParam(input1, input2, output)
+    indent = 1
+    content = indent_lines(f"""
+        int i = 0;
+        for (; i + 4 <= {size}; i += 4) {{
+            const uint32_t in1 = read_int8x4(input1 + i);
+            const uint32_t in2 = read_int8x4(input2 + i);
+            uint32_t out = 0;""", indent)
+    indent += 1
+    # four lanes of a word, packed back into one store
+    for lane in range(4):
+        content += indent_lines("{", indent)
+        content += indent_lines("int32_t sum;", indent + 1)
+        content += add_lane(f"(int8_t)(in1 >> {8 * lane})", f"(int8_t)(in2 >> {8 * lane})", "sum", param, indent + 1)
+        content += indent_lines(f"out |= (uint32_t)(uint8_t)sum << {8 * lane};", indent + 1)
+        content += indent_lines("}", indent)
+    content += indent_lines("write_int8x4(output + i, out);", indent)
+    indent -= 1
+    content += indent_lines("}", indent)
+    content += indent_lines(f"for (; i < {size}; i++) {{", indent)
+    content += indent_lines("int32_t sum;", indent + 1)
+    content += add_lane("input1[i]", "input2[i]", "sum", param, indent + 1)
+    content += indent_lines("output[i] = sum;", indent + 1)
+    content += indent_lines("}", indent)
+    return content
+
+
 def generate_add(model: Model, op: Add, output_code: OutputCode):
     input1 = model.tensors[op.input_idx_list[0]]
     input2 = model.tensors[op.input_idx_list[1]]
     output = model.tensors[op.output_idx]
-    
+
     assert input1.mem_size() == input2.mem_size() == output.mem_size()
     assert input1.layout == input2.layout == output.layout
-    
+
     input1_addr = f"&{buffer_name()}[{input1.addr}]"
     input2_addr = f"&{buffer_name()}[{input2.addr}]"
     output_addr = f"&{buffer_name()}[{output.addr}]"
-    
+
     func = KernelFunc()
-    func_name = "elementwise_add"
-    args = ", ".join([
-        f"{input1.mem_size()}", 
-        input1_addr, str(input1.scales[0]), str(input1.zero_point[0]),
-        input2_addr, str(input2.scales[0]), str(input2.zero_point[0]),
-        output_addr, str(output.scales[0]), str(output.zero_point[0]),
-    ])
-    func.call = f"{func_name}({args})"
-    func.definition = ""
-    func.content = ""
-    
+    func_name = kernel_name(op.idx, "add")
+    func.call = f"{func_name}({input1_addr}, {input2_addr}, {output_addr})"
+    func.definition = f"void {func_name}(const int8_t *input1, const int8_t *input2, int8_t *output)"
+    func.content = generate_content(input1, input2, output)
+
     output_code.kernels[op.idx] = func
-    
\ No newline at end of file
+
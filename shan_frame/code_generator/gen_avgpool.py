@@ -1,30 +1,92 @@
-from .utils import buffer_name
-from ..ir import DataLayout, Model
+from .utils import buffer_name, indent_lines, kernel_name, div_magic
+from ..ir import DataLayout, Model, Tensor
 from ..ir.operator import AvgPool2D
 from .output_code import OutputCode, KernelFunc
 
+# channels accumulated per pass of a global pool, bounds the int32 sums on the stack
+global_pool_block = 64
+
+
+def is_global_pool(input: Tensor, output: Tensor, op: AvgPool2D) -> bool:
+    return output.dim_h == output.dim_w == 1 and op.filter_h == input.dim_h and op.filter_w == input.dim_w
+
+
+def rounded_div_magic(divisor: int) -> tuple[int, int]:
+    # rounded division adds divisor / 2 to the absolute sum of int8 values
+    return div_magic(divisor, 128 * divisor + divisor // 2)
+
+
+def generate_global_pool_content(input: Tensor) -> str:
+    pixel_num = input.dim_h * input.dim_w
+    channel = input.dim_c
+    block = min(channel, global_pool_block)
+    (multiplier, shift) = rounded_div_magic(pixel_num)
+    return indent_lines(f"""
+        // sums a block of channels over all pixels, input is read in order within a block
+        int32_t sum[{block}];
+        for (int c0 = 0; c0 < {channel}; c0 += {block}) {{
+            const int block_size = MIN({block}, {channel} - c0);
+            const int8_t *pixel = input + c0;
+            int c;
+            for (c = 0; c < block_size; c++) {{
+                sum[c] = 0;
+            }}
+            for (int p = 0; p < {pixel_num}; p++) {{
+                for (c = 0; c + 4 <= block_size; c += 4) {{
+                    const uint32_t in = read_int8x4(pixel + c);
+                    sum[c] += (int8_t)in;
+                    sum[c + 1] += (int8_t)(in >> 8);
+                    sum[c + 2] += (int8_t)(in >> 16);
+                    sum[c + 3] += (int8_t)(in >> 24);
+                }}
+                for (; c < block_size; c++) {{
+                    sum[c] += pixel[c];
+                }}
+                pixel += {channel};
+            }}
+            for (c = 0; c < block_size; c++) {{
+                // rounded division by {pixel_num} as a multiply
+                const uint32_t abs_sum = (uint32_t)(sum[c] > 0 ? sum[c] : -sum[c]) + {pixel_num // 2};
+                int32_t out = (int32_t)((abs_sum * {multiplier}u) >> {shift});
+                if (sum[c] < 0) {{
+                    out = -out;
+                }}
+                out = MAX(out, -128);
+                out = MIN(out, 127);
+                output[c0 + c] = out;
+            }}
+        }}""", 1)
+
+
 def generate_avgpool(input_var: str, model: Model, op: AvgPool2D, output_code: OutputCode) -> None:
     input = model.tensors[op.input_idx]
     output = model.tensors[op.output_idx]
-    
+
     assert input.layout == output.layout == DataLayout.HWC
-    
+
     if input.addr >= 0:
         input_addr = f"&{buffer_name()}[{input.addr}]"
     else:
         input_addr = input_var
     output_addr = f"&{buffer_name()}[{output.addr}]"
-    
-    func_name = "avg_pooling"
-    args = ", ".join([
-        input_addr, str(input.dim_h), str(input.dim_w), str(input.dim_c),
-        output_addr, str(output.dim_h), str(output.dim_w),
-        str(op.filter_h), str(op.filter_w)
-    ])
+
     func = KernelFunc()
-    func.call = f"{func_name}({args})"
-    func.definition = ""
-    func.content = ""
-    
+    if is_global_pool(input, output, op):
+        func_name = kernel_name(op.idx, "global_avg_pooling")
+        func.call = f"{func_name}({input_addr}, {output_addr})"
+        func.definition = f"void {func_name}(const int8_t *input, int8_t *output)"
+        func.content = generate_global_pool_content(input)
+    else:
+        (multiplier, shift) = rounded_div_magic(op.filter_h * op.filter_w)
+        func_name = "avg_pooling"
+        args = ", ".join([
+            input_addr, str(input.dim_h), str(input.dim_w), str(input.dim_c),
+            output_addr, str(output.dim_h), str(output.dim_w),
+            str(op.filter_h), str(op.filter_w), str(op.stride_h), str(op.stride_w),
+            f"{multiplier}u", str(shift)
+        ])
+        func.call = f"{func_name}({args})"
+        func.definition = ""
+        func.content = ""
+
     output_code.kernels[op.idx] = func
-    
\ No newline at end of file
@@ -1,12 +1,14 @@
 from .output_code import ChConvFunc
 from .dep_conv2d_code_pieces import *
-from .utils import indent_lines
+from .utils import CodeEmitter
 
 
 def generate_ch_conv_def(func: ChConvFunc) -> str:
+    out = CodeEmitter(1)
     match func.kernel_size, func.stride, func.rev:
-        case 7 | 5| 3, 1 | 2, _: return chconv_preset_content(func.kernel_size, func.stride, func.rev, 1)
-        case _, _, _: return chconv_generic_content(func.kernel_size, func.stride, func.rev, 1)
+        case 7 | 5| 3, 1 | 2, _: chconv_preset_content(out, func.kernel_size, func.stride, func.rev, func.requant)
+        case _, _, _: chconv_generic_content(out, func.kernel_size, func.stride, func.rev, func.requant)
+    return out.getvalue()
 
 
 def test():
@@ -1,6 +1,6 @@
 import numpy as np
 
-from .utils import effective_scale, get_conv2d_contribution
+from .utils import requant_const, get_conv2d_contribution
 from ..ir.operator import Conv2D
 from ..ir import Tensor, Model
 from .output_code import OutputCode, KernelFunc
@@ -14,7 +14,7 @@ def gen_content(model: Model, op: Conv2D, output_code: OutputCode) -> str:
     output = model.tensors[op.output_idx]
 
     indent = 1
-    content = conv2d_setup(op.idx, input, output, indent)
+    content = conv2d_setup(op.idx, input, output, output_code.requant, indent)
     content += conv2d_prepad(output, indent)    
     content += conv2d_window_slide(op, input, weight, output, output_code, indent)
     return content
@@ -34,7 +34,6 @@ def generate_conv2d(input_var: str, model: Model, op: Conv2D, output_code: Outpu
     input = model.tensors[op.input_idx]
     weight = model.tensors[op.weight_idx]
     output = model.tensors[op.output_idx]
-    scales = effective_scale(input.scales, weight.scales, output.scales)
     contribution = get_conv2d_contribution(weight, bias, input.zero_point[0])
     
     func = KernelFunc()
@@ -42,7 +41,7 @@ def generate_conv2d(input_var: str, model: Model, op: Conv2D, output_code: Outpu
     func.const = [
         (f"const int8_t {weight_name(op.idx)}[]", weight.data),
         (f"const int32_t {contrib_name(op.idx)}[]", contribution),
-        (f"const float {scales_name(op.idx)}[]", scales)
+        requant_const(op.idx, input, weight, output, output_code.requant)
     ]
     func_name = kernel_name(op.idx, "conv2d")
     if input.addr >= 0:
@@ -2,7 +2,7 @@ import numpy as np
 from ..ir.operator import DepthConv2D
 from .output_code import ChConvFunc, OutputCode, KernelFunc
 from .dep_conv2d_code_pieces import *
-from .utils import indent_lines
+from .utils import indent_lines, chw_data
 
 def generate_content(model: Model, op: DepthConv2D, output_code: OutputCode) -> str:
     input = model.tensors[op.input_idx]
@@ -22,7 +22,7 @@ def generate_content(model: Model, op: DepthConv2D, output_code: OutputCode) ->
     
     indent = 1
     content = ""
-    content += depconv_setup(model, op, indent)
+    content += depconv_setup(model, op, output_code.requant, indent)
     if pad_input:
         content += depconv_pad_buffer(op.pad_h, op.pad_w, indent)
     content += depconv_loop_setup(indent)
@@ -41,9 +41,8 @@ def generate_depthwise_conv2d(input_var: str, model: Model, op: DepthConv2D, out
     weight = model.tensors[op.weight_idx]
     output = model.tensors[op.output_idx]
     contribution = get_depthwise_conv2d_contribution(weight, bias, input.zero_point[0])
-    scales = effective_scale(input.scales, weight.scales, output.scales)
+    scales = requant_const(op.idx, input, weight, output, output_code.requant)
     
-    hwc_to_chw(weight)
     func_name = f"layer{op.idx}_depthwise_conv2d"
     if input.addr >= 0:
         input_addr = f"&{buffer_name()}[{input.addr}]"
@@ -57,9 +56,9 @@ def generate_depthwise_conv2d(input_var: str, model: Model, op: DepthConv2D, out
     func.definition = f"void {func_name}(const int8_t *input, int8_t *output, int8_t *buffer)"
     func.content = generate_content(model, op, output_code)
     func.const = [
-        (f"const int8_t {weight_name(op.idx)}[]", weight.data),
+        (f"const int8_t {weight_name(op.idx)}[]", chw_data(weight)),
         (f"const int32_t {contrib_name(op.idx)}[]", contribution),
-        (f"const float {scales_name(op.idx)}[]", scales)
+        scales
     ]
     
     output_code.kernels[op.idx] = func
@@ -0,0 +1,53 @@
+def generate_host_main() -> str:
+    return """
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include "inference.h"
+#if __has_include("profile.h")
+#include "profile.h"
+#define SHAN_HOST_PROFILE
+#endif
+
+// reads inputs of INFERENCE_INPUT_SIZE bytes from stdin until EOF
+// writes every output to stdout and the mean latency of each input in ns to stderr
+// with a profiling build, the mean ticks of every layer follow as "profile" lines
+int main(int argc, char **argv) {
+    int repeat = argc > 1 ? atoi(argv[1]) : 1;
+    static int8_t input[INFERENCE_INPUT_SIZE];
+    static int8_t work[INFERENCE_INPUT_SIZE];
+    long long runs = 0;
+    if (repeat < 1) {
+        repeat = 1;
+    }
+#ifdef SHAN_HOST_PROFILE
+    shan_profile_init();
+    shan_profile_reset();
+#endif
+    while (fread(input, 1, INFERENCE_INPUT_SIZE, stdin) == INFERENCE_INPUT_SIZE) {
+        int8_t *output = NULL;
+        int64_t total_ns = 0;
+        for (int i = 0; i < repeat; i++) {
+            struct timespec start, end;
+            memcpy(work, input, INFERENCE_INPUT_SIZE);
+            clock_gettime(CLOCK_MONOTONIC, &start);
+            output = inference(work);
+            clock_gettime(CLOCK_MONOTONIC, &end);
+            total_ns += (int64_t)(end.tv_sec - start.tv_sec) * 1000000000 + (end.tv_nsec - start.tv_nsec);
+        }
+        runs += repeat;
+        fwrite(output, 1, INFERENCE_OUTPUT_SIZE, stdout);
+        fprintf(stderr, "%lld\\n", (long long)(total_ns / repeat));
+    }
+#ifdef SHAN_HOST_PROFILE
+    for (int i = 0; runs > 0 && i < SHAN_LAYER_NUM; i++) {
+        const shan_layer_info_t *info = &shan_layer_info[i];
+        fprintf(stderr, "profile %d %s %u %u %u %u %lld\\n", info->op_idx, info->name, info->macs,
+                info->input_bytes, info->output_bytes, info->buffer_bytes, (long long)(shan_layer_ticks[i] / runs));
+    }
+#endif
+    return 0;
+}
+"""
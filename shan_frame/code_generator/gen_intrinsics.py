@@ -21,6 +21,33 @@ __attribute__((always_inline)) static __inline  int32_t read_int8x4_ia(const int
     return result;
 }
 
+__attribute__((always_inline)) static __inline  void write_int8x4(int8_t *dst, uint32_t value) {
+    memcpy(dst, &value, 4);
+}
+
+// tflite MultiplyByQuantizedMultiplier: acc * multiplier * 2^(shift - 31), rounded
+__attribute__((always_inline)) static __inline  int32_t shan_requantize(int32_t acc, int32_t multiplier, int32_t shift) {
+    const int32_t left_shift = shift > 0 ? shift : 0;
+    const int32_t right_shift = shift > 0 ? 0 : -shift;
+    const int32_t x = (int32_t)((uint32_t)acc << left_shift);
+    // saturating rounding doubling high multiply
+    int32_t high;
+    if (x == INT32_MIN && multiplier == INT32_MIN) {
+        high = INT32_MAX;
+    } else {
+        const int64_t product = (int64_t)x * (int64_t)multiplier;
+        const int32_t nudge = product >= 0 ? (1 << 30) : (1 - (1 << 30));
+        high = (int32_t)((product + nudge) / (1ll << 31));
+    }
+    // rounding divide by power of two, ties away from zero
+    const int32_t mask = (int32_t)((1ll << right_shift) - 1);
+    const int32_t remainder = high & mask;
+    const int32_t threshold = (mask >> 1) + (high < 0 ? 1 : 0);
+    return (high >> right_shift) + (remainder > threshold ? 1 : 0);
+}
+
+// DSP extension instructions, portable C below for hosts and cores without them
+#if defined(__ARM_FEATURE_DSP) && __ARM_FEATURE_DSP == 1 && !defined(SHAN_PORTABLE_INTRIN)
 __attribute__((always_inline)) static __inline  uint32_t __SMLAD (uint32_t op1, uint32_t op2, uint32_t op3){
   uint32_t result;
 
@@ -69,5 +96,53 @@ __attribute__((always_inline)) static __inline  uint32_t __SXTB16_RORn(uint32_t
     __asm__ volatile ("sxtb16 %0, %1, ROR %2" : "=r" (result) : "r" (op1), "i" (rotate) );
     return(result);
 }
+
+__attribute__((always_inline)) static __inline  uint32_t __PKHBT_LSLn(uint32_t op1, uint32_t op2, const int shift){
+    uint32_t result;
+
+    __asm__ ("pkhbt %0, %1, %2, lsl %3" : "=r" (result) : "r" (op1), "r" (op2), "i" (shift) );
+    return(result);
+}
+#else
+// products of signed halfwords, accumulation wraps around like the instructions
+#define SHAN_LO16(x) ((int32_t)(int16_t)((x) & 0xFFFF))
+#define SHAN_HI16(x) ((int32_t)(int16_t)((x) >> 16))
+
+__attribute__((always_inline)) static __inline  uint32_t __SMLAD (uint32_t op1, uint32_t op2, uint32_t op3){
+    return op3 + (uint32_t)(SHAN_LO16(op1) * SHAN_LO16(op2)) + (uint32_t)(SHAN_HI16(op1) * SHAN_HI16(op2));
+}
+
+__attribute__((always_inline)) static __inline  uint32_t __SMLABB(uint32_t op1, uint32_t op2, uint32_t op3) {
+    return op3 + (uint32_t)(SHAN_LO16(op1) * SHAN_LO16(op2));
+}
+
+__attribute__((always_inline)) static __inline  uint32_t __SMLATB(uint32_t op1, uint32_t op2, uint32_t op3) {
+    return op3 + (uint32_t)(SHAN_HI16(op1) * SHAN_LO16(op2));
+}
+
+__attribute__((always_inline)) static __inline  uint32_t __SMLABT(uint32_t op1, uint32_t op2, uint32_t op3) {
+    return op3 + (uint32_t)(SHAN_LO16(op1) * SHAN_HI16(op2));
+}
+
+__attribute__((always_inline)) static __inline  uint32_t __SMLATT(uint32_t op1, uint32_t op2, uint32_t op3) {
+    return op3 + (uint32_t)(SHAN_HI16(op1) * SHAN_HI16(op2));
+}
+
+__attribute__((always_inline)) static __inline  uint32_t __SXTB16(uint32_t op1){
+    // sign extend bytes 0 and 2 into the two halfwords
+    uint32_t low = (uint32_t)(int32_t)(int8_t)(op1 & 0xFF) & 0xFFFF;
+    uint32_t high = (uint32_t)(int32_t)(int8_t)((op1 >> 16) & 0xFF) << 16;
+    return high | low;
+}
+
+__attribute__((always_inline)) static __inline  uint32_t __SXTB16_RORn(uint32_t op1, const int rotate){
+    uint32_t rotated = (rotate & 31) == 0 ? op1 : (op1 >> (rotate & 31)) | (op1 << (32 - (rotate & 31)));
+    return __SXTB16(rotated);
+}
+
+__attribute__((always_inline)) static __inline  uint32_t __PKHBT_LSLn(uint32_t op1, uint32_t op2, const int shift){
+    return (op1 & 0xFFFF) | ((op2 << shift) & 0xFFFF0000);
+}
+#endif
 #endif
 """
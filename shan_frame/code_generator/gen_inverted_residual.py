@@ -0,0 +1,217 @@
+import numpy as np
+from ..ir import DataLayout, Model, Tensor
+from ..ir.operator import Conv2D, DepthConv2D, InvertedResidual
+from .output_code import KernelFunc, OutputCode, RequantMode, scales_type
+from .dep_conv2d_code_pieces import chconv_requant_line
+from .utils import (
+    buffer_name,
+    requant_const,
+    get_conv2d_contribution,
+    get_depthwise_conv2d_contribution,
+    indent_lines,
+    kernel_name,
+    contrib_name,
+    scales_name,
+    weight_name,
+)
+
+
+def stage_consts(idx: int, stage: str, model: Model, op: Conv2D | DepthConv2D, requant: RequantMode) -> list[tuple[str, np.ndarray]]:
+    '''weight, contribution and requantization table of one stage of a fused block'''
+    input = model.tensors[op.input_idx]
+    weight = model.tensors[op.weight_idx]
+    bias = model.tensors[op.bias_idx]
+    output = model.tensors[op.output_idx]
+    if isinstance(op, DepthConv2D):
+        # weights stay HWC, the kernel walks channels innermost like the row buffer
+        contribution = get_depthwise_conv2d_contribution(weight, bias, input.zero_point[0])
+    else:
+        contribution = get_conv2d_contribution(weight, bias, input.zero_point[0])
+    (_, scales) = requant_const(op.idx, input, weight, output, requant)
+    return [
+        (f"const int8_t {weight_name(idx)}_{stage}[]", weight.data),
+        (f"const int32_t {contrib_name(idx)}_{stage}[]", contribution),
+        (f"const {scales_type(requant)} {scales_name(idx)}_{stage}[]", scales),
+    ]
+
+
+def scale_setup(scales: str, requant: RequantMode) -> str:
+    # scale of channel c in the names chconv_requant_line expects
+    if requant == RequantMode.FLOAT:
+        return f"const float scale = {scales}[c];"
+    return f"""
+        const int32_t multiplier = {scales}[2 * c];
+        const int32_t shift = {scales}[2 * c + 1];"""
+
+
+def pointwise_scalar(idx: int, stage: str, pixel_num: int, in_c: int, out_c: int, out_offset: int,
+                     ch_offset: int, out_update: int, requant: RequantMode, indent: int) -> str:
+    return indent_lines(f"""
+        for (int i = 0; i < {pixel_num}; i++) {{
+            for (int c = 0; c < {out_c}; c++) {{
+                int32_t sum = {contrib_name(idx)}_{stage}[c];
+                const int8_t *ksrc = {weight_name(idx)}_{stage} + c * {in_c};
+                for (int k = 0; k < {in_c}; k++) {{
+                    sum += input_elem[k] * ksrc[k];
+                }}
+                {scale_setup(f"{scales_name(idx)}_{stage}", requant)}
+                {chconv_requant_line("sum", requant)}
+                sum += {out_offset};
+                sum = MAX(sum, -128);
+                sum = MIN(sum, 127);
+                out[c * {ch_offset}] = sum;
+            }}
+            out += {out_update};
+            input_elem += {in_c};
+        }}""", indent)
+
+
+def pointwise_row(idx: int, stage: str, input: str, output: str, pixel_num: int, in_c: int,
+                  out_c: int, out_offset: int, layout: DataLayout, ch_offset: int, out_update: int,
+                  output_code: OutputCode, indent: int) -> str:
+    '''1x1 conv of pixel_num consecutive HWC pixels, two at a time like conv2d_1x1_by_row'''
+    requant = output_code.requant
+    content = indent_lines(f"""
+        input_elem = {input};
+        out = {output};""", indent)
+    # vec_mul works on pixel and channel pairs, the rest is left to a plain loop
+    if out_c % 2 != 0:
+        return content + pointwise_scalar(idx, stage, pixel_num, in_c, out_c, out_offset, ch_offset, out_update, requant, indent)
+    o2_call = output_code.add_vec_mul(2, in_c, layout).get_call(
+        "input_elem", "out", f"{weight_name(idx)}_{stage}", str(out_c), str(ch_offset), str(out_offset),
+        f"{scales_name(idx)}_{stage}", f"{contrib_name(idx)}_{stage}")
+    content += indent_lines(f"""
+        for (int i = 0; i < {pixel_num} / 2; i++) {{
+            {o2_call};
+            out += {2 * out_update};
+            input_elem += {2 * in_c};
+        }}""", indent)
+    if pixel_num % 2 != 0:
+        content += pointwise_scalar(idx, stage, 1, in_c, out_c, out_offset, ch_offset, out_update, requant, indent)
+    return content
+
+
+def depthwise_row(idx: int, op: DepthConv2D, weight: Tensor, output: Tensor, requant: RequantMode, indent: int) -> str:
+    '''one depthwise output row from the kernel_h buffered input rows in rows[], HWC'''
+    channel = output.dim_c
+    content = indent_lines(f"""
+        out = dw_row;
+        for (int out_w = 0; out_w < {output.dim_w}; out_w++) {{
+            for (int c = 0; c < {channel}; c++) {{
+                int32_t sum = dw_contrib[c];
+                const int8_t *ksrc = dw_weight + c;""", indent)
+    indent += 2
+    for i in range(weight.dim_h):
+        content += indent_lines(f"col = rows[{i}] + out_w * {op.stride_w * channel} + c;", indent)
+        for j in range(weight.dim_w):
+            content += indent_lines(f"sum += col[{j * channel}] * ksrc[{(i * weight.dim_w + j) * channel}];", indent)
+    content += indent_lines(f"""
+        {scale_setup("dw_scales", requant)}
+        {chconv_requant_line("sum", requant)}
+        sum += dw_offset;
+        sum = MAX(sum, -128);
+        sum = MIN(sum, 127);
+        *(out++) = sum;""", indent)
+    indent -= 2
+    content += indent_lines("""
+            }
+        }""", indent)
+    return content
+
+
+def generate_content(model: Model, op: InvertedResidual, output_code: OutputCode) -> str:
+    input = model.tensors[op.input_idx]
+    dw = op.depthwise
+    mid = model.tensors[dw.input_idx]
+    dw_weight = model.tensors[dw.weight_idx]
+    dw_output = model.tensors[dw.output_idx]
+    output = model.tensors[op.output_idx]
+    assert input.layout == DataLayout.HWC and input.prepad_h == input.prepad_w == 0
+    if output.prepad_h != 0 or output.prepad_w != 0:
+        raise NotImplementedError("prepad output for inverted residual block")
+    match output.layout:
+        case DataLayout.HWC:
+            (ch_offset, out_update) = (1, output.dim_c)
+        case DataLayout.CHW:
+            (ch_offset, out_update) = (output.dim_h * output.dim_w, 1)
+        case _: raise RuntimeError(f"unsupported data layout: {output.layout}")
+
+    kernel_h = dw_weight.dim_h
+    row_size = op.row_size(model)
+    pad_size = dw.pad_w * mid.dim_c
+    requant = output_code.requant
+    idx = op.idx
+    indent = 1
+    content = indent_lines(f"""
+        const int8_t mid_zero = {mid.zero_point[0]};
+        const int8_t dw_offset = {dw_output.zero_point[0]};
+        const int8_t *dw_weight = {weight_name(idx)}_depthwise;
+        const {scales_type(requant)} *dw_scales = {scales_name(idx)}_depthwise;
+        const int32_t *dw_contrib = {contrib_name(idx)}_depthwise;
+        int8_t *dw_row = buffer + {kernel_h * row_size};
+        const int8_t *rows[{kernel_h}];
+        const int8_t *input_elem;
+        const int8_t *col;
+        int8_t *out;
+        int next_row = 0;
+        for (int out_h = 0; out_h < {output.dim_h}; out_h++) {{""", indent)
+    indent += 1
+    # fill the ring with the padded depthwise input rows the window reaches
+    content += indent_lines(f"""
+        for (; next_row < out_h * {dw.stride_h} + {kernel_h}; next_row++) {{
+            int8_t *row = buffer + (next_row % {kernel_h}) * {row_size};
+            const int in_h = next_row - {dw.pad_h};
+            if (in_h < 0 || in_h >= {mid.dim_h}) {{
+                memset(row, mid_zero, {row_size});
+                continue;
+            }}""", indent)
+    indent += 1
+    if pad_size > 0:
+        content += indent_lines(f"""
+            memset(row, mid_zero, {pad_size});
+            memset(row + {row_size - pad_size}, mid_zero, {pad_size});""", indent)
+    input_row = f"input + in_h * {input.dim_w * input.dim_c}"
+    if op.expand is None:
+        content += indent_lines(f"memcpy(row + {pad_size}, {input_row}, {mid.dim_w * mid.dim_c});", indent)
+    else:
+        content += pointwise_row(idx, "expand", input_row, f"row + {pad_size}", input.dim_w, input.dim_c,
+                                 mid.dim_c, int(mid.zero_point[0]), DataLayout.HWC, 1, mid.dim_c,
+                                 output_code, indent)
+    indent -= 1
+    content += indent_lines("}", indent)
+    content += indent_lines(f"""
+        for (int i = 0; i < {kernel_h}; i++) {{
+            rows[i] = buffer + ((out_h * {dw.stride_h} + i) % {kernel_h}) * {row_size};
+        }}""", indent)
+    content += depthwise_row(idx, dw, dw_weight, dw_output, requant, indent)
+    row_step = output.dim_w * out_update
+    content += pointwise_row(idx, "project", "dw_row", f"output + out_h * {row_step}", output.dim_w, mid.dim_c,
+                             output.dim_c, int(output.zero_point[0]), output.layout, ch_offset, out_update,
+                             output_code, indent)
+    indent -= 1
+    content += indent_lines("}", indent)
+    return content
+
+
+def generate_inverted_residual(input_var: str, model: Model, op: InvertedResidual, output_code: OutputCode) -> None:
+    input = model.tensors[op.input_idx]
+    output = model.tensors[op.output_idx]
+
+    func_name = kernel_name(op.idx, "inverted_residual")
+    if input.addr >= 0:
+        input_addr = f"&{buffer_name()}[{input.addr}]"
+    else:
+        input_addr = input_var
+    output_addr = f"&{buffer_name()}[{output.addr}]"
+    buffer_addr = f"&{buffer_name()}[{op.buffer_addr}]"
+
+    func = KernelFunc()
+    func.call = f"{func_name}({input_addr}, {output_addr}, {buffer_addr})"
+    func.definition = f"void {func_name}(const int8_t *input, int8_t *output, int8_t *buffer)"
+    func.content = generate_content(model, op, output_code)
+    if op.expand is not None:
+        func.const.extend(stage_consts(op.idx, "expand", model, op.expand, output_code.requant))
+    func.const.extend(stage_consts(op.idx, "depthwise", model, op.depthwise, output_code.requant))
+    func.const.extend(stage_consts(op.idx, "project", model, op.project, output_code.requant))
+
+    output_code.kernels[op.idx] = func
@@ -1,14 +1,11 @@
 def generate_minor_declare() -> str:
     return """
 #include <stdint.h>
-void elementwise_add(int size, 
-        const int8_t* input1_data, const float input1_scale, const float input1_zero,
-        const int8_t* input2_data, const float input2_scale, const float input2_zero, 
-        int8_t* output_data, const float output_scale, const float zero_y);
 void avg_pooling(
         const int8_t* input, const uint16_t input_h, const uint16_t input_w, const uint16_t input_c,
         int8_t* output, const uint16_t output_h, const uint16_t output_w,
-        const uint16_t sample_h, const uint16_t sample_w);
+        const uint16_t sample_h, const uint16_t sample_w, const uint16_t stride_h, const uint16_t stride_w,
+        const uint32_t div_multiplier, const int div_shift);
 """
 
 def generate_minor_def() -> str:
@@ -16,54 +13,39 @@ def generate_minor_def() -> str:
 #include <stdint.h>
 #include <math.h>
 
-void elementwise_add(int size, 
-        const int8_t* input1_data, const float input1_scale, const float input1_zero,
-        const int8_t* input2_data, const float input2_scale, const float input2_zero, 
-        int8_t* output_data, const float output_scale, const float zero_y) 
-{
-  for (int i = 0; i < size; ++i) {
-	  float input1_fp = ((float)*input1_data++ - input1_zero) * input1_scale;
-	  float input2_fp = ((float)*input2_data++ - input2_zero) * input2_scale;
-      int clamped_output = (int)round((input1_fp + input2_fp) / output_scale + zero_y); // to align with tvm implementation
-      clamped_output = MAX(clamped_output, -128);
-      clamped_output = MIN(clamped_output, 127);
-      output_data[i] = (int8_t)(clamped_output);
-  }
-}
-
 void avg_pooling(
         const int8_t* input, const uint16_t input_h, const uint16_t input_w, const uint16_t input_c,
         int8_t* output, const uint16_t output_h, const uint16_t output_w,
-        const uint16_t sample_h, const uint16_t sample_w)
+        const uint16_t sample_h, const uint16_t sample_w, const uint16_t stride_h, const uint16_t stride_w,
+        const uint32_t div_multiplier, const int div_shift)
 {
 	int h, w, c;
 	int sh, sw;
 	const int divider_half = ((sample_h * sample_w) / 2);
-	for(c = 0; c < input_c; c++){
-		for(h = 0; h < output_h; h++){
-			for(w = 0; w < output_w; w++){
+	// output pixels in HWC order, channels innermost so input rows are read sequentially
+	for(h = 0; h < output_h; h++){
+		for(w = 0; w < output_w; w++){
+			const int8_t *window = input + (h * stride_h * input_w + w * stride_w) * input_c;
+			for(c = 0; c < input_c; c++){
 				int avg = 0;
 
 				for(sh = 0; sh < sample_h; sh++){
-					int height = sh + h * sample_h;
+					const int8_t *row = window + sh * input_w * input_c + c;
 					for(sw = 0; sw < sample_w; sw++){
-						int width = sw + w * sample_w;
-						avg += input[(width + height * input_w) * input_c + c];
+						avg += row[sw * input_c];
 					}
 				}
 
-				// for rounded div
-				if (avg > 0)
-					avg += divider_half;
-				else
-					avg -= divider_half;
-
-				int out = avg / (sample_h * sample_w);
+				// rounded div, the division is a multiply by a precomputed reciprocal
+				uint32_t abs_avg = (uint32_t)(avg > 0 ? avg : -avg) + divider_half;
+				int out = (int)((abs_avg * div_multiplier) >> div_shift);
+				if (avg < 0)
+					out = -out;
 				out = MAX(out, -128);
 				out = MIN(out, 127);
-				output[(w + h * output_w) * input_c + c] = out;
+				*output++ = out;
 			}
 		}
 	}
 }
-"""
\ No newline at end of file
+"""
@@ -0,0 +1,188 @@
+import numpy as np
+from ..ir import DataLayout, Model, Tensor
+from ..ir.operator import Conv2D, DepthConv2D, Add, PatchStage
+from .output_code import KernelFunc, OutputCode, RequantMode, scales_type
+from .dep_conv2d_code_pieces import chconv_requant_line
+from .gen_inverted_residual import scale_setup
+from .gen_add import AddParam, add_lane
+from .utils import (
+    buffer_name,
+    requant_const,
+    indent_lines,
+    kernel_name,
+    contrib_name,
+    scales_name,
+    weight_name,
+)
+
+# every tile argument is a pointer, the (y, x) origin of the tile and its width
+TILE_ARGS = "const int {0}_y, const int {0}_x, const int {0}_w"
+REGION_ARGS = "const int y0, const int x0, const int h, const int w"
+
+
+def sub_op_name(idx: int, pos: int) -> str:
+    return f"{kernel_name(idx, 'patch')}_{pos}"
+
+
+def sub_op_consts(idx: int, pos: int, model: Model, op: Conv2D | DepthConv2D, requant: RequantMode) -> list[tuple[str, np.ndarray]]:
+    input = model.tensors[op.input_idx]
+    weight = model.tensors[op.weight_idx]
+    bias = model.tensors[op.bias_idx]
+    output = model.tensors[op.output_idx]
+    (_, scales) = requant_const(op.idx, input, weight, output, requant)
+    # padding is skipped instead of read, so the zero point is taken off every input and the bias goes alone
+    return [
+        (f"const int8_t {weight_name(idx)}_{pos}[]", weight.data),
+        (f"const int32_t {contrib_name(idx)}_{pos}[]", bias.data.astype(np.int32)),
+        (f"const {scales_type(requant)} {scales_name(idx)}_{pos}[]", scales),
+    ]
+
+
+def output_index(output: Tensor, is_stage_output: bool) -> str:
+    # tiles are HWC, only the stage output can be CHW
+    if is_stage_output and output.layout == DataLayout.CHW:
+        return f"c * {output.dim_h * output.dim_w} + pixel"
+    assert output.layout == DataLayout.HWC or not is_stage_output
+    return f"pixel * {output.dim_c} + c"
+
+
+def requant_store(idx: int, pos: int, output: Tensor, index: str, requant: RequantMode, indent: int) -> str:
+    return indent_lines(f"""
+        {scale_setup(f"{scales_name(idx)}_{pos}", requant)}
+        {chconv_requant_line("sum", requant)}
+        sum += {output.zero_point[0]};
+        sum = MAX(sum, -128);
+        sum = MIN(sum, 127);
+        output[{index}] = sum;""", indent)
+
+
+def window_loops(op: Conv2D | DepthConv2D, input: Tensor, weight: Tensor) -> str:
+    '''loop heads over output rows and columns, with the kernel taps clipped to the input'''
+    content = indent_lines("for (int y = y0; y < y0 + h; y++) {", 1)
+    content += indent_lines(f"""
+        const int iy = y * {op.stride_h} - {op.pad_h};
+        const int ky_start = iy < 0 ? -iy : 0;
+        const int ky_end = iy + {weight.dim_h} > {input.dim_h} ? {input.dim_h} - iy : {weight.dim_h};
+        for (int x = x0; x < x0 + w; x++) {{""", 2)
+    content += indent_lines(f"""
+        const int ix = x * {op.stride_w} - {op.pad_w};
+        const int kx_start = ix < 0 ? -ix : 0;
+        const int kx_end = ix + {weight.dim_w} > {input.dim_w} ? {input.dim_w} - ix : {weight.dim_w};
+        const int pixel = (y - out_y) * out_w + (x - out_x);""", 3)
+    return content
+
+
+def close_loops(depth: int) -> str:
+    return "".join(indent_lines("}", indent) for indent in reversed(range(depth)))
+
+
+def conv_helper(idx: int, pos: int, model: Model, op: Conv2D | DepthConv2D, is_stage_output: bool, requant: RequantMode) -> str:
+    input = model.tensors[op.input_idx]
+    weight = model.tensors[op.weight_idx]
+    output = model.tensors[op.output_idx]
+    in_c = input.dim_c
+    weight_var = f"{weight_name(idx)}_{pos}"
+    content = f"static void {sub_op_name(idx, pos)}(const int8_t *input, {TILE_ARGS.format('in')}, " \
+              f"int8_t *output, {TILE_ARGS.format('out')}, {REGION_ARGS}) {{\n"
+    content += indent_lines(f"const int32_t input_zero = {input.zero_point[0]};", 1)
+    content += window_loops(op, input, weight)
+    if isinstance(op, DepthConv2D):
+        content += indent_lines(f"for (int c = 0; c < {in_c}; c++) {{", 3)
+        content += indent_lines(f"""
+            int32_t sum = {contrib_name(idx)}_{pos}[c];
+            for (int ky = ky_start; ky < ky_end; ky++) {{""", 4)
+        content += indent_lines(f"""
+            const int8_t *in = input + ((iy + ky - in_y) * in_w + (ix - in_x)) * {in_c} + c;
+            const int8_t *ksrc = {weight_var} + ky * {weight.dim_w * in_c} + c;
+            for (int kx = kx_start; kx < kx_end; kx++) {{""", 5)
+        content += indent_lines(f"sum += (in[kx * {in_c}] - input_zero) * ksrc[kx * {in_c}];", 6)
+    else:
+        # taps of a kernel row are contiguous in both the input row and the weight
+        content += indent_lines(f"for (int c = 0; c < {output.dim_c}; c++) {{", 3)
+        content += indent_lines(f"""
+            int32_t sum = {contrib_name(idx)}_{pos}[c];
+            for (int ky = ky_start; ky < ky_end; ky++) {{""", 4)
+        content += indent_lines(f"""
+            const int8_t *in = input + ((iy + ky - in_y) * in_w + (ix - in_x)) * {in_c};
+            const int8_t *ksrc = {weight_var} + (c * {weight.dim_h} + ky) * {weight.dim_w * in_c};
+            for (int k = kx_start * {in_c}; k < kx_end * {in_c}; k++) {{""", 5)
+        content += indent_lines("sum += (in[k] - input_zero) * ksrc[k];", 6)
+    content += indent_lines("}", 5) + indent_lines("}", 4)
+    content += requant_store(idx, pos, output, output_index(output, is_stage_output), requant, 4)
+    content += close_loops(4)
+    return content
+
+
+def add_helper(idx: int, pos: int, model: Model, op: Add, is_stage_output: bool) -> str:
+    input1 = model.tensors[op.input_idx[0]]
+    input2 = model.tensors[op.input_idx[1]]
+    output = model.tensors[op.output_idx]
+    channel = output.dim_c
+    content = f"static void {sub_op_name(idx, pos)}(const int8_t *input1, {TILE_ARGS.format('in1')}, " \
+              f"const int8_t *input2, {TILE_ARGS.format('in2')}, int8_t *output, {TILE_ARGS.format('out')}, {REGION_ARGS}) {{\n"
+    content += indent_lines("for (int y = y0; y < y0 + h; y++) {", 1)
+    content += indent_lines("for (int x = x0; x < x0 + w; x++) {", 2)
+    content += indent_lines(f"""
+        const int8_t *a = input1 + ((y - in1_y) * in1_w + (x - in1_x)) * {channel};
+        const int8_t *b = input2 + ((y - in2_y) * in2_w + (x - in2_x)) * {channel};
+        const int pixel = (y - out_y) * out_w + (x - out_x);
+        for (int c = 0; c < {channel}; c++) {{""", 3)
+    content += indent_lines("int32_t sum;", 4)
+    content += add_lane("a[c]", "b[c]", "sum", AddParam(input1, input2, output), 4)
+    content += indent_lines(f"output[{output_index(output, is_stage_output)}] = sum;", 4)
+    content += close_loops(4)
+    return content
+
+
+def tile_args(op: PatchStage, model: Model, region: dict, tensor_idx) -> str:
+    '''pointer, origin and width of the tile of tensor_idx in one patch'''
+    if tensor_idx in op.tile_offsets:
+        (y, x, _, w) = region[tensor_idx]
+        return f"buffer + {op.tile_offsets[tensor_idx]}, {y}, {x}, {w}"
+    # stage input and output are whole tensors
+    tensor = model.tensors[tensor_idx]
+    pointer = "input" if tensor_idx == op.input_idx else "output"
+    return f"{pointer}, 0, 0, {tensor.dim_w}"
+
+
+def generate_content(model: Model, op: PatchStage) -> str:
+    content = ""
+    for patch, region in enumerate(op.regions):
+        (y, x, h, w) = region[op.output_idx]
+        content += indent_lines(f"// patch {patch}: rows {y}-{y + h - 1}, cols {x}-{x + w - 1}", 1)
+        for pos, sub_op in enumerate(op.ops):
+            inputs = list(sub_op.input_idx) if isinstance(sub_op, Add) else [sub_op.input_idx]
+            args = [tile_args(op, model, region, idx) for idx in inputs + [sub_op.output_idx]]
+            args.append(", ".join(str(v) for v in region[sub_op.output_idx]))
+            content += indent_lines(f"{sub_op_name(op.idx, pos)}({', '.join(args)});", 1)
+    return content
+
+
+def generate_patch_stage(input_var: str, model: Model, op: PatchStage, output_code: OutputCode) -> None:
+    input = model.tensors[op.input_idx]
+    output = model.tensors[op.output_idx]
+    assert input.layout == DataLayout.HWC and input.prepad_h == input.prepad_w == 0
+    if output.prepad_h != 0 or output.prepad_w != 0:
+        raise NotImplementedError("prepad output for patch stage")
+
+    func_name = kernel_name(op.idx, "patch_stage")
+    if input.addr >= 0:
+        input_addr = f"&{buffer_name()}[{input.addr}]"
+    else:
+        input_addr = input_var
+    output_addr = f"&{buffer_name()}[{output.addr}]"
+    buffer_addr = f"&{buffer_name()}[{op.buffer_addr}]"
+
+    func = KernelFunc()
+    func.call = f"{func_name}({input_addr}, {output_addr}, {buffer_addr})"
+    func.definition = f"void {func_name}(const int8_t *input, int8_t *output, int8_t *buffer)"
+    for pos, sub_op in enumerate(op.ops):
+        is_stage_output = pos == len(op.ops) - 1
+        if isinstance(sub_op, Add):
+            func.helpers += add_helper(op.idx, pos, model, sub_op, is_stage_output)
+        else:
+            func.helpers += conv_helper(op.idx, pos, model, sub_op, is_stage_output, output_code.requant)
+            func.const.extend(sub_op_consts(op.idx, pos, model, sub_op, output_code.requant))
+    func.content = generate_content(model, op)
+
+    output_code.kernels[op.idx] = func
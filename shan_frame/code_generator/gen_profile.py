@@ -0,0 +1,90 @@
+from ..ir import Model, Operator
+from ..ir.operator import activation_inputs, has_buffer
+
+
+def layer_name(call: str, op_idx: int) -> str:
+    func_name = call[:call.index("(")]
+    if func_name.startswith("layer"):
+        return func_name
+    return f"layer{op_idx}_{func_name}"
+
+
+def layer_row(model: Model, op: Operator, name: str) -> str:
+    input_bytes = sum(model.tensors[idx].mem_size() for idx in activation_inputs(op))
+    output_bytes = model.tensors[op.output_idx].mem_size()
+    buffer_bytes = op.buffer_size if has_buffer(op) else 0
+    return f"{{{op.idx}, \"{name}\", {op.mac_count(model)}u, {input_bytes}u, {output_bytes}u, {buffer_bytes}u}}"
+
+
+def generate_profile_declare(layer_num: int) -> str:
+    return f"""
+#include <stdint.h>
+
+typedef struct {{
+    int op_idx;
+    const char *name;
+    uint32_t macs;
+    uint32_t input_bytes;
+    uint32_t output_bytes;
+    uint32_t buffer_bytes;
+}} shan_layer_info_t;
+
+#define SHAN_LAYER_NUM {layer_num}
+extern const shan_layer_info_t shan_layer_info[SHAN_LAYER_NUM];
+// ticks spent in each layer, summed over inference() calls until shan_profile_reset()
+extern uint64_t shan_layer_ticks[SHAN_LAYER_NUM];
+extern uint32_t shan_profile_start;
+void shan_profile_reset(void);
+
+// ticks are cpu cycles on cortex-m with a DWT unit and nanoseconds on hosts
+#if defined(__ARM_ARCH_7M__) || defined(__ARM_ARCH_7EM__) || defined(__ARM_ARCH_8M_MAIN__) || defined(__ARM_ARCH_8_1M_MAIN__)
+#define SHAN_DEMCR (*(volatile uint32_t *)0xE000EDFC)
+#define SHAN_DWT_CTRL (*(volatile uint32_t *)0xE0001000)
+#define SHAN_DWT_CYCCNT (*(volatile uint32_t *)0xE0001004)
+static inline void shan_profile_init(void) {{
+    SHAN_DEMCR |= (1u << 24);
+    SHAN_DWT_CYCCNT = 0;
+    SHAN_DWT_CTRL |= 1u;
+}}
+static inline uint32_t shan_profile_now(void) {{
+    return SHAN_DWT_CYCCNT;
+}}
+#elif defined(__ARM_ARCH_6M__) || defined(__ARM_ARCH_8M_BASE__) || (defined(__ARM_ARCH_PROFILE) && __ARM_ARCH_PROFILE == 'M')
+// cortex-m0/m0+/m23 have no DWT cycle counter, and bare-metal toolchains usually lack clock_gettime
+#ifndef SHAN_PROFILE_BEGIN
+#error "no cycle counter on this core, define SHAN_PROFILE_BEGIN and SHAN_PROFILE_END before including profile.h"
+#endif
+static inline void shan_profile_init(void) {{}}
+#else
+#include <time.h>
+static inline void shan_profile_init(void) {{}}
+static inline uint32_t shan_profile_now(void) {{
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (uint32_t)((uint64_t)now.tv_sec * 1000000000u + (uint64_t)now.tv_nsec);
+}}
+#endif
+
+// define both before including this header to use another timer
+#ifndef SHAN_PROFILE_BEGIN
+#define SHAN_PROFILE_BEGIN(layer, name) (shan_profile_start = shan_profile_now())
+#define SHAN_PROFILE_END(layer, name) (shan_layer_ticks[layer] += (uint32_t)(shan_profile_now() - shan_profile_start))
+#endif
+"""
+
+
+def generate_profile_def(rows: list[str]) -> str:
+    table = ",\n".join(f"    {row}" for row in rows)
+    return f"""
+const shan_layer_info_t shan_layer_info[SHAN_LAYER_NUM] = {{
+{table}
+}};
+uint64_t shan_layer_ticks[SHAN_LAYER_NUM];
+uint32_t shan_profile_start;
+
+void shan_profile_reset(void) {{
+    for (int i = 0; i < SHAN_LAYER_NUM; i++) {{
+        shan_layer_ticks[i] = 0;
+    }}
+}}
+"""
@@ -0,0 +1,27 @@
+from .utils import buffer_name
+from ..ir import Model
+from ..ir.operator import Reshape
+from .output_code import OutputCode, KernelFunc
+
+def generate_reshape(input_var: str, model: Model, op: Reshape, output_code: OutputCode) -> None:
+    input = model.tensors[op.input_idx_list[0]]
+    output = model.tensors[op.output_idx]
+    
+    assert input.mem_size() == output.mem_size()
+    assert input.layout == output.layout
+    
+    # reshape only moves data when the scheduler placed the output elsewhere
+    if input.addr == output.addr:
+        return
+    if input.addr >= 0:
+        input_addr = f"&{buffer_name()}[{input.addr}]"
+    else:
+        input_addr = input_var
+    output_addr = f"&{buffer_name()}[{output.addr}]"
+    
+    func = KernelFunc()
+    func.call = f"memmove({output_addr}, {input_addr}, {output.mem_size()})"
+    func.definition = ""
+    func.content = ""
+    
+    output_code.kernels[op.idx] = func
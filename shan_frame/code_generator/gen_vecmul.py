@@ -1,36 +1,29 @@
 from .conv2d_code_pieces import *
 from .output_code import VecMulFunc
-from .utils import indent_lines
+from .utils import CodeEmitter
 
 
 def generate_vec_mul_content(func: VecMulFunc) -> str:
+    out = CodeEmitter(1)
     # setup needed pointers
-    indent = 1
-    setup = c2o2_setup(func.col_size, func.output_layout, indent)
+    c2o2_setup(out, func.col_size, func.output_layout, func.requant)
     # build c2o2 loop
-    loop_start = indent_lines("""
-        for (int c2o2_loop_count = row_count / 2; c2o2_loop_count > 0; c2o2_loop_count--){""", indent)
-    indent += 1
-    loop_body = mac_setup(func.col_num, 2, func.col_size, indent)
-    loop_body += mac_body(func.col_num, 2, func.col_size, indent)
-    loop_body += indent_lines(f"""
-        ip_a0 += {func.col_size};
-        ip_a1 += {func.col_size};
-    """, indent)
-    loop_body += mac_output(func.col_num, 2, func.output_layout, indent)
-    indent -= 1
-    loop_end = indent_lines("}", indent)
+    out.line("for (int c2o2_loop_count = row_count / 2; c2o2_loop_count > 0; c2o2_loop_count--){")
+    with out.block():
+        mac_setup(out, func.col_num, 2, func.col_size, func.requant)
+        mac_body(out, func.col_num, 2, func.col_size)
+        out.line(f"ip_a0 += {func.col_size};")
+        out.line(f"ip_a1 += {func.col_size};")
+        mac_output(out, func.col_num, 2, func.output_layout, func.requant)
+    out.line("}")
     # add c1o2 block if row count is odd
-    c1_block_start = indent_lines("""
-        if (row_count %2) {
-    """, indent)
-    indent += 1
-    c1_block_body = mac_setup(func.col_num, 1, func.col_size, indent)
-    c1_block_body += mac_body(func.col_num, 1, func.col_size, indent)
-    c1_block_body += mac_output(func.col_num, 1, func.output_layout, indent)
-    indent -= 1
-    c1_block_end = indent_lines("}", indent)
-    return setup + loop_start + loop_body + loop_end + c1_block_start + c1_block_body + c1_block_end
+    out.line("if (row_count %2) {")
+    with out.block():
+        mac_setup(out, func.col_num, 1, func.col_size, func.requant)
+        mac_body(out, func.col_num, 1, func.col_size)
+        mac_output(out, func.col_num, 1, func.output_layout, func.requant)
+    out.line("}")
+    return out.getvalue()
 
 
 def generate_vec_mul_def(func: VecMulFunc) -> str:
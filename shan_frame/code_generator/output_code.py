@@ -1,18 +1,45 @@
+from enum import Enum
+import numpy as np
 from numpy import ndarray
 from ..ir import DataLayout, Tensor
 
+
+class ConstMode(Enum):
+    # C array initializers in the layerN.c of each layer, model_const.h only holds extern declarations
+    HEADER = 0
+    # one binary blob, model_const.h only holds offsets
+    BLOB = 1
+
+
+class RequantMode(Enum):
+    # (int32_t)((float)acc * scale) with a float scale per channel
+    FLOAT = 0
+    # integer only, an int32 (multiplier, shift) pair per channel as in tflite
+    FIXED_POINT = 1
+
+
+def scales_type(requant: RequantMode) -> str:
+    return "float" if requant == RequantMode.FLOAT else "int32_t"
+
+
 class KernelFunc:
     include: str
     definition: str
     const: list[tuple[str, ndarray]]
+    # byte offset of each const in the blob, only set in ConstMode.BLOB
+    const_offset: list[int]
     content: str
+    # static functions only the kernel calls, emitted ahead of its definition
+    helpers: str
     call: str
     
     def __init__(self) -> None:
         self.include = ""
         self.definition = ""
         self.const = []
+        self.const_offset = []
         self.content = ""
+        self.helpers = ""
         
     def print_def(self) -> str:
         ret = self.definition
@@ -25,11 +52,13 @@ class VecMulFunc:
     col_num: int
     col_size: int
     output_layout: DataLayout
+    requant: RequantMode
     
-    def __init__(self, col_num: int, col_size: int, output_layout: DataLayout) -> None:
+    def __init__(self, col_num: int, col_size: int, output_layout: DataLayout, requant: RequantMode = RequantMode.FLOAT) -> None:
         self.col_num = col_num
         self.col_size = col_size
         self.output_layout = output_layout
+        self.requant = requant
         
     def get_name(self) -> str:
         return f"vec_mul_1x{self.col_size}_{self.col_num}_{self.output_layout}"
@@ -40,7 +69,7 @@ class VecMulFunc:
         args = ", ".join([
             "const int8_t *input", "int8_t *output", "const int8_t *weight", 
             "const int row_count", "const int ch_offset", "const int out_offset", 
-            "const float *scales", "const int32_t *contrib"
+            f"const {scales_type(self.requant)} *scales", "const int32_t *contrib"
         ])
         return f"{ret}{name}({args})"
     
@@ -55,11 +84,13 @@ class ChConvFunc:
     kernel_size: int
     stride: int
     rev: bool
+    requant: RequantMode
 
-    def __init__(self, kernel_size: int, stride: int, rev: bool) -> None:
+    def __init__(self, kernel_size: int, stride: int, rev: bool, requant: RequantMode = RequantMode.FLOAT) -> None:
         self.kernel_size = kernel_size
         self.stride = stride
         self.rev = rev
+        self.requant = requant
 
     def get_name(self) -> str:
         name = f"ch_conv_{self.kernel_size}x{self.kernel_size}_stride{self.stride}"
@@ -70,9 +101,10 @@ class ChConvFunc:
     def get_def(self) -> str:
         ret = "void "
         name = self.get_name()
+        scale = "const float scale" if self.requant == RequantMode.FLOAT else "const int32_t multiplier, const int32_t shift"
         args = ", ".join([
             "const int8_t *input", "int8_t *output", "const int8_t *ksrc",
-            "const float scale", "const int32_t contrib", "const int8_t out_offset",
+            scale, "const int32_t contrib", "const int8_t out_offset",
             "const int input_w", "const int ch_offset", "const int out_w", "const int out_h"
         ])
         return f"{ret}{name}({args})"
@@ -91,26 +123,75 @@ class OutputCode:
     vec_mul: dict[tuple[int, int, DataLayout], VecMulFunc]
     ch_conv: dict[tuple[int, int, bool], ChConvFunc]
     const_tensors: list[Tensor]
+    requant: RequantMode
     
-    def __init__(self, root_dir: str, mem_size: int) -> None:
+    def __init__(self, root_dir: str, mem_size: int, requant: RequantMode = RequantMode.FLOAT) -> None:
         self.root_dir = root_dir
         self.mem_size = mem_size
+        self.requant = requant
         self.kernels = {}
         self.vec_mul = {}
         self.ch_conv = {}
         self.const_tensors = []
     
+    def merge(self, other: "OutputCode") -> None:
+        '''add the kernels of other, helpers both use are kept once, in first use order'''
+        self.kernels.update(other.kernels)
+        for key, vec_mul in other.vec_mul.items():
+            self.vec_mul.setdefault(key, vec_mul)
+        for key, ch_conv in other.ch_conv.items():
+            self.ch_conv.setdefault(key, ch_conv)
+
     def add_vec_mul(self, col_num: int, col_size: int, output_layout: DataLayout) -> VecMulFunc:
         vec_mul = self.vec_mul.get((col_num, col_size, output_layout))
         if vec_mul is not None:
             return vec_mul
         vec_mul = self.vec_mul[(col_num, col_size, output_layout)] = VecMulFunc(
-            col_num, col_size, output_layout)
+            col_num, col_size, output_layout, self.requant)
         return vec_mul
     
     def add_ch_conv(self, kernel_size: int, stride: int, rev: bool) -> ChConvFunc:
         ch_conv = self.ch_conv.get((kernel_size, stride, rev))
         if ch_conv is not None:
             return ch_conv
-        ch_conv = self.ch_conv[(kernel_size, stride, rev)] = ChConvFunc(kernel_size, stride, rev)
-        return ch_conv
\ No newline at end of file
+        ch_conv = self.ch_conv[(kernel_size, stride, rev)] = ChConvFunc(kernel_size, stride, rev, self.requant)
+        return ch_conv
+
+    def layout_blob(self, align: int) -> int:
+        '''assign blob offsets to all consts, returns blob size'''
+        # layers are laid out in execution order with their consts back to back,
+        # so each layer reads one contiguous flash region
+        offset = 0
+        for kernel in self.kernels.values():
+            kernel.const_offset = []
+            for declare, data in kernel.const:
+                offset = (offset + align - 1) // align * align
+                kernel.const_offset.append(offset)
+                (ctype, _) = parse_const_declare(declare)
+                offset += data.size * C_TYPE_DTYPE[ctype].itemsize
+        return offset
+
+
+class LayerCode:
+    '''one layer generated on its own, with the helpers it registered in code, merged in op order'''
+    op_idx: int
+    code: OutputCode
+    # layer source file, empty for kernels called inline
+    source: str
+
+    def __init__(self, op_idx: int, code: OutputCode, source: str) -> None:
+        self.op_idx = op_idx
+        self.code = code
+        self.source = source
+
+
+# little-endian numpy dtype of C types used for consts
+C_TYPE_DTYPE: dict[str, np.dtype] = {
+    "int8_t": np.dtype("<i1"), "int32_t": np.dtype("<i4"), "float": np.dtype("<f4")}
+
+
+def parse_const_declare(declare: str) -> tuple[str, str]:
+    '''"const int8_t weight0[]" -> ("int8_t", "weight0")'''
+    tokens = declare.split()
+    assert len(tokens) == 3 and tokens[0] == "const" and tokens[2].endswith("[]"), f"unexpected const declare: {declare}"
+    return (tokens[1], tokens[2][:-2])
\ No newline at end of file
@@ -1,6 +1,13 @@
+import functools
+import hashlib
+import os
+from contextlib import contextmanager
+from typing import Iterator
 import numpy as np
 from ..ir import Operator, Model, Tensor
 from ..ir.operator import *
+from ..utils import getMultiplierShift
+from .output_code import RequantMode, scales_type
 
 
 def gen_copy_int8(src: str, dst: str, size: str) -> list[str]:
@@ -18,10 +25,121 @@ def indent_lines(input: str, indent: int) -> str:
     lines = [indent_str * indent + line + "\n" for line in lines]
     return "".join(lines)
 
+def template(fragment: str) -> tuple[str, ...]:
+    '''stripped non-empty lines of a code fragment, done once at import for the fixed fragments of the generators'''
+    return tuple(line for line in (line.strip() for line in fragment.splitlines()) if len(line) > 0)
+
+@functools.cache
+def indented_template(lines: tuple[str, ...], indent: int) -> str:
+    indent_str = "    " * indent
+    return "".join(f"{indent_str}{line}\n" for line in lines)
+
+class CodeEmitter:
+    '''appends code to a list at the current indent and joins it once, same lines as indent_lines'''
+    parts: list[str]
+    indent: int
+
+    def __init__(self, indent: int = 0) -> None:
+        self.parts = []
+        self.indent = indent
+
+    def line(self, line: str) -> None:
+        line = line.strip()
+        if len(line) > 0:
+            self.parts.append(f"{'    ' * self.indent}{line}\n")
+
+    def lines(self, fragment: str | tuple[str, ...]) -> None:
+        '''fragment: a template, or text to strip line by line like indent_lines'''
+        if isinstance(fragment, str):
+            self.parts.append(indent_lines(fragment, self.indent))
+        else:
+            self.parts.append(indented_template(fragment, self.indent))
+
+    @contextmanager
+    def block(self) -> Iterator[None]:
+        self.indent += 1
+        try:
+            yield
+        finally:
+            self.indent -= 1
+
+    def getvalue(self) -> str:
+        return "".join(self.parts)
+
+def write_if_changed(path: str, data: bytes) -> bool:
+    '''write data unless the file already holds it, so make does not rebuild an unchanged file
+    returns whether the file was written'''
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, "rb") as f:
+            if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+# str() of every int8 value, indexed by value + 128
+_INT8_STR = np.array([str(v) for v in range(-128, 128)], dtype=object)
+
+
+def format_const(data: np.ndarray, chunk_size: int = 1 << 16) -> Iterator[str]:
+    '''yields chunks of ", ".join(str(e) for e in data.flatten())'''
+    flat = data.reshape(-1)
+    for begin in range(0, flat.size, chunk_size):
+        chunk = flat[begin:begin + chunk_size]
+        if chunk.dtype == np.int8:
+            elements = _INT8_STR[chunk.astype(np.int16) + 128].tolist()
+        else:
+            # astype(str) matches numpy scalar str() for ints and floats
+            elements = chunk.astype(str).tolist()
+        if begin > 0:
+            yield ", "
+        yield ", ".join(elements)
+
 def effective_scale(input_scales: np.ndarray, weight_scales: np.ndarray, output_scales: np.ndarray) -> np.ndarray:
     return input_scales * weight_scales / output_scales
 
 
+def requant_const(idx: int, input: Tensor, weight: Tensor, output: Tensor, requant: RequantMode) -> tuple[str, np.ndarray]:
+    '''per channel requantization table of a conv, float scales or (multiplier, shift) pairs'''
+    if requant == RequantMode.FLOAT:
+        scales = effective_scale(input.scales, weight.scales, output.scales)
+    else:
+        # tflite derives the multiplier from the double precision scale
+        scales = effective_scale(input.scales.astype(np.float64), weight.scales.astype(np.float64), output.scales.astype(np.float64))
+        (multiplier, shift) = getMultiplierShift(scales)
+        scales = np.stack([multiplier, shift], axis=1).reshape(-1)
+    return (f"const {scales_type(requant)} {scales_name(idx)}[]", scales)
+
+
+# tflite int8 add scales both inputs up by 2^20 before aligning them
+ADD_LEFT_SHIFT = 20
+
+
+def add_requant_params(input1: Tensor, input2: Tensor, output: Tensor) -> tuple[np.ndarray, np.ndarray]:
+    '''(multiplier, shift) of input1, input2 and the output for an int8 add, as tflite computes them'''
+    twice_max_scale = 2 * max(float(input1.scales[0]), float(input2.scales[0]))
+    scales = np.array([
+        float(input1.scales[0]) / twice_max_scale,
+        float(input2.scales[0]) / twice_max_scale,
+        twice_max_scale / ((1 << ADD_LEFT_SHIFT) * float(output.scales[0])),
+    ])
+    return getMultiplierShift(scales)
+
+
+def div_magic(divisor: int, max_dividend: int) -> tuple[int, int]:
+    '''(multiplier, shift) with x * multiplier >> shift == x // divisor for 0 <= x <= max_dividend
+    and x * multiplier below 2^32'''
+    dividends = np.arange(max_dividend + 1, dtype=np.uint64)
+    for shift in range(32):
+        multiplier = -(-(1 << shift) // divisor)
+        if max_dividend * multiplier >= 1 << 32:
+            break
+        if np.array_equal((dividends * np.uint64(multiplier)) >> np.uint64(shift), dividends // np.uint64(divisor)):
+            return (multiplier, shift)
+    raise RuntimeError(f"no 32 bit multiplier divides {max_dividend} by {divisor}")
+
+
 def get_conv2d_contribution(weight: Tensor, bias: Tensor, input_zero: int) -> np.ndarray:
     weight_shaped = np.reshape(
         weight.data, (weight.dim_n, weight.dim_h, weight.dim_w, weight.dim_c))
@@ -66,9 +184,9 @@ def buffer_name() -> str:
 def kernel_name(idx: int, op_type: str) -> str:
     return f"layer{idx}_{op_type}"
 
-def hwc_to_chw(tensor: Tensor):
+def chw_data(tensor: Tensor) -> np.ndarray:
+    '''data of an HWC tensor in CHW order, the tensor is left as it is'''
     assert tensor.layout == DataLayout.HWC
-    tensor.data = np.reshape(tensor.data, (tensor.dim_n, tensor.dim_h, tensor.dim_w, tensor.dim_c))
-    tensor.data = np.transpose(tensor.data, (0, 3, 1, 2))
-    tensor.layout = DataLayout.CHW
+    data = np.reshape(tensor.data, (tensor.dim_n, tensor.dim_h, tensor.dim_w, tensor.dim_c))
+    return np.transpose(data, (0, 3, 1, 2))
     
\ No newline at end of file
@@ -0,0 +1,224 @@
+import numpy as np
+
+from ..ir import DataLayout, Model, Tensor
+from ..ir.operator import Conv2D, DepthConv2D, Add, AvgPool2D, Reshape, InvertedResidual, PatchStage
+from ..code_generator.utils import effective_scale, requant_const, add_requant_params, ADD_LEFT_SHIFT
+from ..code_generator.output_code import RequantMode
+from .arena import ArenaViolation, check_arena, read_tensor, write_tensor
+from .kernels import conv2d, depthwise_conv2d, avg_pooling, elementwise_add, wrap_int8
+
+
+def canonical_weight(weight: Tensor) -> np.ndarray:
+    '''weight as (n, h, w, c) regardless of the layout code generation converted it to'''
+    if weight.layout == DataLayout.CHW:
+        data = np.reshape(weight.data, (weight.dim_n, weight.dim_c, weight.dim_h, weight.dim_w))
+        return data.transpose(0, 2, 3, 1)
+    return np.reshape(weight.data, (weight.dim_n, weight.dim_h, weight.dim_w, weight.dim_c))
+
+
+class ConvParam:
+    weight: np.ndarray
+    contrib: np.ndarray
+    # float32 (c,) or int32 (c, 2) multiplier and shift pairs
+    scales: np.ndarray
+    input_zero: int
+    out_offset: int
+
+    def __init__(self, model: Model, op: Conv2D | DepthConv2D, requant: RequantMode = RequantMode.FLOAT) -> None:
+        input = model.tensors[op.input_idx]
+        weight = model.tensors[op.weight_idx]
+        bias = model.tensors[op.bias_idx]
+        output = model.tensors[op.output_idx]
+        self.weight = canonical_weight(weight)
+        # same contribution as the generated const, stored as int32_t
+        if isinstance(op, DepthConv2D):
+            weight_sum = np.sum(self.weight, axis=(0, 1, 2))
+            self.weight = self.weight[0]
+        else:
+            weight_sum = np.sum(self.weight, axis=(1, 2, 3))
+        self.contrib = (bias.data + weight_sum * -input.zero_point[0]).astype(np.int32)
+        if requant == RequantMode.FLOAT:
+            self.scales = effective_scale(input.scales, weight.scales, output.scales).astype(np.float32)
+        else:
+            (_, scales) = requant_const(op.idx, input, weight, output, requant)
+            self.scales = scales.astype(np.int32).reshape(-1, 2)
+        self.input_zero = int(input.zero_point[0])
+        self.out_offset = int(output.zero_point[0])
+
+
+class ReferenceExecutor:
+    '''runs the IR with the arithmetic of the generated C code on a simulated arena'''
+    model: Model
+    mem_size: int
+    input_tensor: Tensor
+    output_tensor: Tensor
+    violations: list[ArenaViolation]
+    conv_params: dict[int, ConvParam]
+    # params of the sub ops of each fused block, in execution order
+    block_params: dict[int, list[ConvParam]]
+    # params of the sub ops of each patch stage, None for adds
+    stage_params: dict[int, list[ConvParam | None]]
+    requant: RequantMode
+
+    def __init__(self, model: Model, mem_size: int, requant: RequantMode = RequantMode.FLOAT) -> None:
+        '''requant: the mode the code is generated with'''
+        self.model = model
+        self.mem_size = mem_size
+        self.requant = requant
+        self.ops = [model.operators[idx] for idx in sorted(model.operators.keys())]
+        self.input_tensor = model.tensors[self.ops[0].input_idx_list[0]]
+        self.output_tensor = model.tensors[self.ops[-1].output_idx]
+        self.conv_params = {}
+        self.block_params = {}
+        self.stage_params = {}
+        for op in self.ops:
+            if isinstance(op, Conv2D) or isinstance(op, DepthConv2D):
+                self.conv_params[op.idx] = ConvParam(model, op, requant)
+            elif isinstance(op, InvertedResidual):
+                self.block_params[op.idx] = [ConvParam(model, sub_op, requant) for sub_op in op.sub_ops()]
+            elif isinstance(op, PatchStage):
+                self.stage_params[op.idx] = [None if isinstance(sub_op, Add) else ConvParam(model, sub_op, requant)
+                                             for sub_op in op.ops]
+        # arena accesses only depend on the schedule, check them once
+        self.violations = check_arena(model, mem_size)
+
+    def run(self, inputs: np.ndarray, batch_size: int = 64, strict: bool = True) -> np.ndarray:
+        '''inputs: (batch, h, w, c) or (h, w, c) int8 in HWC, returns output tensor as (batch, h, w, c)
+        strict: refuse to run a schedule with arena violations'''
+        if strict and len(self.violations) > 0:
+            raise RuntimeError("arena violations:\n" + "\n".join(str(v) for v in self.violations))
+        single = inputs.ndim == 3
+        if single:
+            inputs = inputs[None]
+        tensor = self.input_tensor
+        assert inputs.shape[1:] == (tensor.dim_h, tensor.dim_w, tensor.dim_c), f"input shape {inputs.shape[1:]} does not match model"
+        outputs = [self.run_batch(inputs[i:i + batch_size].astype(np.int8)) for i in range(0, inputs.shape[0], batch_size)]
+        output = np.concatenate(outputs)
+        return output[0] if single else output
+
+    def run_batch(self, inputs: np.ndarray) -> np.ndarray:
+        arena = np.zeros((inputs.shape[0], self.mem_size), np.int8)
+        for op in self.ops:
+            match op:
+                case Conv2D(): self.run_conv2d(arena, inputs, op)
+                case DepthConv2D(): self.run_depthwise_conv2d(arena, inputs, op)
+                case Add(): self.run_add(arena, inputs, op)
+                case AvgPool2D(): self.run_avgpool(arena, inputs, op)
+                case Reshape(): self.run_reshape(arena, inputs, op)
+                case InvertedResidual(): self.run_inverted_residual(arena, inputs, op)
+                case PatchStage(): self.run_patch_stage(arena, inputs, op)
+                case _: raise NotImplementedError(op.op_type)
+        return read_tensor(arena, self.output_tensor)
+
+    def read(self, arena: np.ndarray, inputs: np.ndarray, tensor_idx) -> np.ndarray:
+        tensor = self.model.tensors[tensor_idx]
+        if tensor.addr >= 0:
+            return read_tensor(arena, tensor)
+        # generated code reads tensors without address from the inference() argument
+        assert tensor is self.input_tensor, f"tensor {int(tensor_idx)} has no address"
+        return inputs
+
+    def read_flat(self, arena: np.ndarray, inputs: np.ndarray, tensor_idx) -> np.ndarray:
+        tensor = self.model.tensors[tensor_idx]
+        if tensor.addr >= 0:
+            return arena[:, tensor.addr:tensor.addr + tensor.mem_size()].copy()
+        return self.read(arena, inputs, tensor_idx).reshape(inputs.shape[0], -1)
+
+    def run_conv2d(self, arena: np.ndarray, inputs: np.ndarray, op: Conv2D) -> None:
+        param = self.conv_params[op.idx]
+        input_tensor = self.model.tensors[op.input_idx]
+        output = self.model.tensors[op.output_idx]
+        if input_tensor.prepad_h != 0 or input_tensor.prepad_w != 0:
+            raise NotImplementedError("conv2d input pre-padding")
+        input = self.read(arena, inputs, op.input_idx)
+        if op.pad_h != 0 or op.pad_w != 0:
+            pad = ((0, 0), (op.pad_h, op.pad_h), (op.pad_w, op.pad_w), (0, 0))
+            input = np.pad(input, pad, constant_values=wrap_int8(param.input_zero))
+        out = conv2d(input, param.weight, param.contrib, param.scales,
+                     op.stride_h, op.stride_w, output.dim_h, output.dim_w, param.out_offset)
+        write_tensor(arena, output, out, param.out_offset)
+
+    def run_depthwise_conv2d(self, arena: np.ndarray, inputs: np.ndarray, op: DepthConv2D) -> None:
+        param = self.conv_params[op.idx]
+        output = self.model.tensors[op.output_idx]
+        if output.prepad_h != 0 or output.prepad_w != 0:
+            raise NotImplementedError("prepad output for depthwise conv2d")
+        # pre-padded input comes with its padding from the arena
+        input = self.read(arena, inputs, op.input_idx)
+        if op.pad_h != 0 or op.pad_w != 0:
+            # the kernel pads with -zero_point
+            pad = ((0, 0), (op.pad_h, op.pad_h), (op.pad_w, op.pad_w), (0, 0))
+            input = np.pad(input, pad, constant_values=wrap_int8(-param.input_zero))
+        out = depthwise_conv2d(input, param.weight, param.contrib, param.scales,
+                               op.stride_h, op.stride_w, output.dim_h, output.dim_w, param.out_offset)
+        write_tensor(arena, output, out, param.out_offset)
+
+    def run_add(self, arena: np.ndarray, inputs: np.ndarray, op: Add) -> None:
+        input1 = self.model.tensors[op.input_idx[0]]
+        input2 = self.model.tensors[op.input_idx[1]]
+        output = self.model.tensors[op.output_idx]
+        (multiplier, shift) = add_requant_params(input1, input2, output)
+        # whole tensor memory is added element by element, padding included
+        out = elementwise_add(
+            self.read_flat(arena, inputs, op.input_idx[0]), int(input1.zero_point[0]),
+            self.read_flat(arena, inputs, op.input_idx[1]), int(input2.zero_point[0]),
+            int(output.zero_point[0]), multiplier, shift, ADD_LEFT_SHIFT)
+        arena[:, output.addr:output.addr + output.mem_size()] = out
+
+    def run_avgpool(self, arena: np.ndarray, inputs: np.ndarray, op: AvgPool2D) -> None:
+        input_tensor = self.model.tensors[op.input_idx]
+        output = self.model.tensors[op.output_idx]
+        assert input_tensor.layout == output.layout == DataLayout.HWC
+        if input_tensor.prepad_h != 0 or input_tensor.prepad_w != 0 or output.prepad_h != 0 or output.prepad_w != 0:
+            raise NotImplementedError("avgpool with pre-padding")
+        input = self.read(arena, inputs, op.input_idx)
+        out = avg_pooling(input, op.filter_h, op.filter_w, op.stride_h, op.stride_w, output.dim_h, output.dim_w)
+        write_tensor(arena, output, out, 0)
+
+    def run_reshape(self, arena: np.ndarray, inputs: np.ndarray, op: Reshape) -> None:
+        output = self.model.tensors[op.output_idx]
+        arena[:, output.addr:output.addr + output.mem_size()] = self.read_flat(arena, inputs, op.input_idx_list[0])
+
+    def run_inverted_residual(self, arena: np.ndarray, inputs: np.ndarray, op: InvertedResidual) -> None:
+        output = self.model.tensors[op.output_idx]
+        if output.prepad_h != 0 or output.prepad_w != 0:
+            raise NotImplementedError("prepad output for inverted residual block")
+        # intermediate tensors only exist inside the kernel
+        out = self.read(arena, inputs, op.input_idx)
+        for sub_op, param in zip(op.sub_ops(), self.block_params[op.idx]):
+            # the row buffer is padded with the input zero point
+            out = self.padded_conv(sub_op, param, out)
+        write_tensor(arena, output, out, 0)
+
+    def run_patch_stage(self, arena: np.ndarray, inputs: np.ndarray, op: PatchStage) -> None:
+        output = self.model.tensors[op.output_idx]
+        if output.prepad_h != 0 or output.prepad_w != 0:
+            raise NotImplementedError("prepad output for patch stage")
+        # patches recompute their halos, so the whole tensors come out the same
+        values = {op.input_idx: self.read(arena, inputs, op.input_idx)}
+        for sub_op, param in zip(op.ops, self.stage_params[op.idx]):
+            if isinstance(sub_op, Add):
+                input1 = self.model.tensors[sub_op.input_idx[0]]
+                input2 = self.model.tensors[sub_op.input_idx[1]]
+                sub_output = self.model.tensors[sub_op.output_idx]
+                (multiplier, shift) = add_requant_params(input1, input2, sub_output)
+                out = elementwise_add(
+                    values[sub_op.input_idx[0]], int(input1.zero_point[0]),
+                    values[sub_op.input_idx[1]], int(input2.zero_point[0]),
+                    int(sub_output.zero_point[0]), multiplier, shift, ADD_LEFT_SHIFT)
+            else:
+                # taps over the padding are skipped, same as padding with the input zero point
+                assert param is not None
+                out = self.padded_conv(sub_op, param, values[sub_op.input_idx])
+            values[sub_op.output_idx] = out
+        write_tensor(arena, output, values[op.output_idx], 0)
+
+    def padded_conv(self, op: Conv2D | DepthConv2D, param: ConvParam, input: np.ndarray) -> np.ndarray:
+        '''(depthwise) conv of an HWC batch padded with the input zero point'''
+        output = self.model.tensors[op.output_idx]
+        if op.pad_h != 0 or op.pad_w != 0:
+            pad = ((0, 0), (op.pad_h, op.pad_h), (op.pad_w, op.pad_w), (0, 0))
+            input = np.pad(input, pad, constant_values=wrap_int8(param.input_zero))
+        kernel = depthwise_conv2d if isinstance(op, DepthConv2D) else conv2d
+        return kernel(input, param.weight, param.contrib, param.scales,
+                      op.stride_h, op.stride_w, output.dim_h, output.dim_w, param.out_offset)
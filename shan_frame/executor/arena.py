@@ -0,0 +1,217 @@
+import numpy as np
+
+from ..ir import DataLayout, Model, Tensor
+from ..ir.operator import Conv2D, DepthConv2D, Add, AvgPool2D, Reshape, InvertedResidual, PatchStage, activation_inputs
+from ..code_generator.gen_1x1conv2d import overlap_1x1_split
+
+
+class ArenaViolation:
+    op_idx: int
+    kind: str
+    tensor_idx: int
+    num_bytes: int
+
+    def __init__(self, op_idx: int, kind: str, tensor_idx: int, num_bytes: int) -> None:
+        self.op_idx = op_idx
+        self.kind = kind
+        self.tensor_idx = tensor_idx
+        self.num_bytes = num_bytes
+
+    def __str__(self) -> str:
+        target = "buffer" if self.tensor_idx < 0 else f"tensor {self.tensor_idx}"
+        match self.kind:
+            case "clobber":
+                return f"op {self.op_idx} overwrites {self.num_bytes} bytes of live {target}"
+            case "hazard":
+                return f"op {self.op_idx} overwrites {self.num_bytes} bytes of {target} before reading them"
+            case "uninitialized":
+                return f"op {self.op_idx} reads {target} which is never written"
+            case "out_of_bounds":
+                return f"op {self.op_idx} accesses {self.num_bytes} bytes of {target} outside the arena"
+            case _:
+                return f"op {self.op_idx} {self.kind} {target}"
+
+
+# every access of an op is a list of (arena byte idx, step)
+# a byte written at a step earlier than a step reading it is read after being overwritten
+Access = list[tuple[np.ndarray, np.ndarray]]
+
+
+def padded_shape(tensor: Tensor) -> tuple[int, int, int]:
+    return (tensor.dim_h + 2 * tensor.prepad_h, tensor.dim_w + 2 * tensor.prepad_w, tensor.dim_c)
+
+
+def region(tensor: Tensor) -> np.ndarray:
+    return np.arange(tensor.addr, tensor.addr + tensor.mem_size())
+
+
+def read_tensor(arena: np.ndarray, tensor: Tensor) -> np.ndarray:
+    '''returns (batch, h, w, c) including pre-padding'''
+    (h, w, c) = padded_shape(tensor)
+    data = arena[:, tensor.addr:tensor.addr + tensor.mem_size()]
+    if tensor.layout == DataLayout.CHW:
+        return data.reshape(-1, c, h, w).transpose(0, 2, 3, 1)
+    return data.reshape(-1, h, w, c)
+
+
+def write_tensor(arena: np.ndarray, tensor: Tensor, data: np.ndarray, pad_value: int) -> None:
+    '''data: (batch, dim_h, dim_w, dim_c), pre-padding is filled with pad_value'''
+    (h, w, c) = padded_shape(tensor)
+    padded = np.full((data.shape[0], h, w, c), pad_value, np.int8)
+    padded[:, tensor.prepad_h:tensor.prepad_h + tensor.dim_h, tensor.prepad_w:tensor.prepad_w + tensor.dim_w] = data
+    if tensor.layout == DataLayout.CHW:
+        padded = padded.transpose(0, 3, 1, 2)
+    arena[:, tensor.addr:tensor.addr + tensor.mem_size()] = padded.reshape(data.shape[0], -1)
+
+
+def _unordered(reads: list[np.ndarray], writes: list[np.ndarray]) -> tuple[Access, Access]:
+    # no ordering guarantee inside the kernel, every write must miss every read
+    read_access = [(idx, np.ones_like(idx)) for idx in reads]
+    write_access = [(idx, np.zeros_like(idx)) for idx in writes]
+    return (read_access, write_access)
+
+
+def _1x1_overlap_access(input: Tensor, output: Tensor) -> tuple[Access, Access]:
+    (input_start1, out_start1, l_h_num, input_start2, out_start2, h_l_num) = overlap_1x1_split(input, output)
+    in_c = input.dim_c
+    out_c = output.dim_c
+    # vec_mul rereads both input pixels for every output channel pair
+    ch_pairs = (out_c + 1) // 2
+    # pixel order: low to high from start1, then high to low below start2
+    pixels = np.concatenate([
+        input_start1 // in_c + np.arange(l_h_num),
+        input_start2 // in_c - 1 - np.arange(h_l_num),
+    ])
+    out_pixels = np.concatenate([
+        out_start1 // out_c + np.arange(l_h_num),
+        out_start2 // out_c - 1 - np.arange(h_l_num),
+    ])
+    # pixels are processed in pairs, the odd one of a segment alone
+    pairs = np.concatenate([np.arange(l_h_num) // 2, (l_h_num + 1) // 2 + np.arange(h_l_num) // 2])
+    read_idx = input.addr + pixels[:, None] * in_c + np.arange(in_c)[None, :]
+    read_step = np.broadcast_to((pairs * ch_pairs + ch_pairs - 1)[:, None], read_idx.shape)
+    write_idx = output.addr + out_pixels[:, None] * out_c + np.arange(out_c)[None, :]
+    write_step = pairs[:, None] * ch_pairs + np.arange(out_c)[None, :] // 2
+    return ([(read_idx.reshape(-1), read_step.reshape(-1))], [(write_idx.reshape(-1), write_step.reshape(-1))])
+
+
+def _depthwise_access(model: Model, op: DepthConv2D) -> tuple[Access, Access]:
+    input = model.tensors[op.input_idx]
+    output = model.tensors[op.output_idx]
+    (in_h, in_w, c) = padded_shape(input)
+    (out_h, out_w, _) = padded_shape(output)
+    # channels are processed one by one, a channel is fully read before its output is written
+    channel = np.arange(c)
+    if input.layout == DataLayout.HWC:
+        read_idx = input.addr + np.arange(in_h * in_w)[None, :] * c + channel[:, None]
+    else:
+        read_idx = input.addr + channel[:, None] * (in_h * in_w) + np.arange(in_h * in_w)[None, :]
+    if output.layout == DataLayout.HWC:
+        write_idx = output.addr + np.arange(out_h * out_w)[None, :] * c + channel[:, None]
+    else:
+        write_idx = output.addr + channel[:, None] * (out_h * out_w) + np.arange(out_h * out_w)[None, :]
+    reads = [(read_idx.reshape(-1), np.repeat(channel, in_h * in_w))]
+    writes = [(write_idx.reshape(-1), np.repeat(channel, out_h * out_w))]
+    buffer_size = op.min_buffer_size(model)
+    if buffer_size > 0:
+        # the channel buffer is refilled for every channel, padding is set once before
+        buffer_idx = op.buffer_addr + np.arange(buffer_size)
+        writes.append((np.tile(buffer_idx, c), np.repeat(channel, buffer_size)))
+    return (reads, writes)
+
+
+def op_access(model: Model, op) -> tuple[Access, Access]:
+    '''arena bytes read and written by the generated kernel of op'''
+    output = model.tensors[op.output_idx]
+    inputs = [model.tensors[idx] for idx in activation_inputs(op)]
+    reads = [region(tensor) for tensor in inputs if tensor.addr >= 0]
+    match op:
+        case Conv2D():
+            input = inputs[0]
+            weight = model.tensors[op.weight_idx]
+            if weight.dim_h == weight.dim_w == 1:
+                overlapped = input.addr >= 0 and not (
+                    input.addr >= output.addr + output.mem_size() or output.addr >= input.addr + input.mem_size())
+                if overlapped:
+                    return _1x1_overlap_access(input, output)
+                return _unordered(reads, [region(output)])
+            # im2col fills two columns before each vec_mul call
+            col_size = weight.dim_h * weight.dim_w * input.dim_c
+            buffer_idx = op.buffer_addr + np.arange(min(2, output.dim_w) * col_size)
+            return _unordered(reads, [region(output), buffer_idx])
+        case DepthConv2D():
+            return _depthwise_access(model, op)
+        case Add():
+            # elementwise, each byte is read right before the same byte is written
+            size = output.mem_size()
+            steps = np.arange(size)
+            read_access = [(tensor.addr + steps, steps) for tensor in inputs]
+            return (read_access, [(region(output), steps)])
+        case AvgPool2D():
+            return _unordered(reads, [region(output)])
+        case InvertedResidual() | PatchStage():
+            # input rows or patches are reread until the last output row or patch,
+            # the buffer is rewritten all along
+            buffer_idx = op.buffer_addr + np.arange(op.min_buffer_size(model))
+            return _unordered(reads, [region(output), buffer_idx])
+        case Reshape():
+            # memmove handles overlap
+            return ([(idx, np.zeros_like(idx)) for idx in reads], [(region(output), np.zeros(output.mem_size(), np.int64))])
+        case _:
+            raise NotImplementedError(op.op_type)
+
+
+def check_arena(model: Model, mem_size: int) -> list[ArenaViolation]:
+    violations: list[ArenaViolation] = []
+    op_idx_list = sorted(model.operators.keys())
+    last_op = model.operators[op_idx_list[-1]]
+    # last op reading each tensor, model output lives until the end
+    last_use: dict = {}
+    for tensor_idx, tensor in model.tensors.items():
+        last_use[tensor_idx] = max(tensor.dst_op) if len(tensor.dst_op) > 0 else -1
+    last_use[last_op.output_idx] = len(op_idx_list)
+    produced: set = set()
+
+    for op_idx in op_idx_list:
+        op = model.operators[op_idx]
+        for tensor_idx in activation_inputs(op):
+            tensor = model.tensors[tensor_idx]
+            if tensor.addr >= 0 and tensor_idx not in produced:
+                violations.append(ArenaViolation(op_idx, "uninitialized", int(tensor_idx), tensor.mem_size()))
+        (reads, writes) = op_access(model, op)
+
+        # accesses outside the arena
+        for idx, _ in reads + writes:
+            outside = int(np.count_nonzero((idx < 0) | (idx >= mem_size)))
+            if outside > 0:
+                violations.append(ArenaViolation(op_idx, "out_of_bounds", int(op.output_idx), outside))
+        reads = [(np.clip(idx, 0, mem_size - 1), step) for idx, step in reads]
+        writes = [(np.clip(idx, 0, mem_size - 1), step) for idx, step in writes]
+
+        # bytes overwritten inside the op before being read
+        last_read = np.full(mem_size, -1, np.int64)
+        for idx, step in reads:
+            np.maximum.at(last_read, idx, step)
+        first_write = np.full(mem_size, np.iinfo(np.int64).max, np.int64)
+        for idx, step in writes:
+            np.minimum.at(first_write, idx, step)
+        hazard = first_write < last_read
+        for tensor_idx in activation_inputs(op):
+            tensor = model.tensors[tensor_idx]
+            if tensor.addr < 0:
+                continue
+            count = int(np.count_nonzero(hazard[tensor.addr:tensor.addr + tensor.mem_size()]))
+            if count > 0:
+                violations.append(ArenaViolation(op_idx, "hazard", int(tensor_idx), count))
+
+        # live tensors of other ops that are overwritten
+        written = first_write < np.iinfo(np.int64).max
+        for tensor_idx in produced:
+            if last_use[tensor_idx] <= op_idx:
+                continue
+            tensor = model.tensors[tensor_idx]
+            count = int(np.count_nonzero(written[tensor.addr:tensor.addr + tensor.mem_size()]))
+            if count > 0:
+                violations.append(ArenaViolation(op_idx, "clobber", int(tensor_idx), count))
+        produced.add(op.output_idx)
+    return violations
@@ -0,0 +1,91 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def wrap_int8(value: int) -> int:
+    # value as stored in a C int8_t
+    return (int(value) + 128) % 256 - 128
+
+
+def requantize_fixed(acc: np.ndarray, multiplier: np.ndarray, shift: np.ndarray) -> np.ndarray:
+    '''shan_requantize() in intrinsics.h, tflite MultiplyByQuantizedMultiplier in int64'''
+    left_shift = np.maximum(shift, 0).astype(np.int64)
+    right_shift = np.maximum(-shift, 0).astype(np.int64)
+    x = (acc.astype(np.int64) << left_shift).astype(np.int32).astype(np.int64)
+    multiplier = multiplier.astype(np.int64)
+    product = x * multiplier
+    nudge = np.where(product >= 0, 1 << 30, 1 - (1 << 30))
+    # C division truncates toward zero
+    total = product + nudge
+    high = np.sign(total) * (np.abs(total) >> 31)
+    high = np.where((x == -2**31) & (multiplier == -2**31), 2**31 - 1, high)
+    mask = (np.int64(1) << right_shift) - 1
+    remainder = high & mask
+    threshold = (mask >> 1) + (high < 0)
+    return (high >> right_shift) + (remainder > threshold)
+
+
+def requantize(acc: np.ndarray, scales: np.ndarray, out_offset: int) -> np.ndarray:
+    '''(int32_t)((float)acc * scale) + out_offset, clamped to int8
+    int32 scales are (multiplier, shift) pairs of each channel as in the fixed point const'''
+    if scales.dtype == np.int32:
+        out = requantize_fixed(acc, scales[:, 0], scales[:, 1]) + out_offset
+        return np.clip(out, -128, 127).astype(np.int8)
+    scaled = acc.astype(np.float32) * scales.astype(np.float32)
+    # anything beyond +-2^16 is clamped after the offset anyway, saturating here keeps
+    # the truncating float to int conversion defined
+    scaled = np.clip(scaled, -65536, 65536, out=scaled)
+    out = scaled.astype(np.int32) + np.int32(out_offset)
+    return np.clip(out, -128, 127).astype(np.int8)
+
+
+def conv2d(input: np.ndarray, weight: np.ndarray, contrib: np.ndarray, scales: np.ndarray,
+           stride_h: int, stride_w: int, out_h: int, out_w: int, out_offset: int) -> np.ndarray:
+    '''input: (batch, h, w, c) already padded, weight: (out_c, kh, kw, c)'''
+    batch = input.shape[0]
+    (out_c, kernel_h, kernel_w, in_c) = weight.shape
+    windows = sliding_window_view(input, (kernel_h, kernel_w), axis=(1, 2))
+    windows = windows[:, ::stride_h, ::stride_w][:, :out_h, :out_w]
+    assert windows.shape[1:3] == (out_h, out_w), "padded input is too small for the output"
+    # (batch, out_h, out_w, c, kh, kw) -> im2col rows in weight order
+    cols = windows.transpose(0, 1, 2, 4, 5, 3).reshape(batch * out_h * out_w, kernel_h * kernel_w * in_c)
+    # int8 products summed in float64 are exact, far below 2^53
+    acc = cols.astype(np.float64) @ weight.reshape(out_c, -1).T.astype(np.float64)
+    acc = acc.astype(np.int32) + contrib.astype(np.int32)
+    out = requantize(acc, scales, out_offset)
+    return out.reshape(batch, out_h, out_w, out_c)
+
+
+def depthwise_conv2d(input: np.ndarray, weight: np.ndarray, contrib: np.ndarray, scales: np.ndarray,
+                     stride_h: int, stride_w: int, out_h: int, out_w: int, out_offset: int) -> np.ndarray:
+    '''input: (batch, h, w, c) already padded, weight: (kh, kw, c)'''
+    windows = sliding_window_view(input.astype(np.float32), weight.shape[:2], axis=(1, 2))
+    windows = windows[:, ::stride_h, ::stride_w][:, :out_h, :out_w]
+    assert windows.shape[1:3] == (out_h, out_w), "padded input is too small for the output"
+    # a window sums at most kh * kw int8 products, exact in float32 up to 16x16 kernels
+    acc = np.einsum("bhwcij,ijc->bhwc", windows, weight.astype(np.float32))
+    # int32 wrap of the contribution like the C accumulators
+    return requantize(acc.astype(np.int32) + contrib.astype(np.int32), scales, out_offset)
+
+
+def avg_pooling(input: np.ndarray, filter_h: int, filter_w: int, stride_h: int, stride_w: int,
+                out_h: int, out_w: int) -> np.ndarray:
+    '''mirrors the avg pooling kernels, valid windows with rounded division'''
+    windows = sliding_window_view(input.astype(np.int64), (filter_h, filter_w), axis=(1, 2))
+    windows = windows[:, ::stride_h, ::stride_w][:, :out_h, :out_w]
+    assert windows.shape[1:3] == (out_h, out_w), "pooling window out of input"
+    total = windows.sum(axis=(4, 5))
+    divider = filter_h * filter_w
+    # rounded division, C integer division truncates toward zero
+    total = np.where(total > 0, total + divider // 2, total - divider // 2)
+    out = np.sign(total) * (np.abs(total) // divider)
+    return np.clip(out, -128, 127).astype(np.int8)
+
+
+def elementwise_add(input1: np.ndarray, zero1: int, input2: np.ndarray, zero2: int, out_zero: int,
+                    multiplier: np.ndarray, shift: np.ndarray, left_shift: int) -> np.ndarray:
+    '''mirrors the layer add kernels, tflite int8 add with (multiplier, shift) of input1, input2 and output'''
+    scaled1 = requantize_fixed((input1.astype(np.int64) - zero1) << left_shift, multiplier[0], shift[0])
+    scaled2 = requantize_fixed((input2.astype(np.int64) - zero2) << left_shift, multiplier[1], shift[1])
+    out = requantize_fixed(scaled1 + scaled2, multiplier[2], shift[2]) + out_zero
+    return np.clip(out, -128, 127).astype(np.int8)
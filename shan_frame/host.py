@@ -0,0 +1,162 @@
+import argparse
+import glob
+import os
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .code_generator.gen_host_main import generate_host_main
+
+
+host_dir = "host"
+host_main_name = "host_main"
+host_cflags = ["-O2", "-std=gnu11"]
+
+
+class HostBuild:
+    output_dir: str
+    executable: str
+    input_size: int
+    output_size: int
+    build_time: float
+
+    def __init__(self, output_dir: str, executable: str, input_size: int, output_size: int, build_time: float) -> None:
+        self.output_dir = output_dir
+        self.executable = executable
+        self.input_size = input_size
+        self.output_size = output_size
+        self.build_time = build_time
+
+
+class LayerProfile:
+    op_idx: int
+    name: str
+    macs: int
+    input_bytes: int
+    output_bytes: int
+    buffer_bytes: int
+    # mean per inference, cycles on cortex-m and ns on hosts
+    ticks: int
+
+    def __init__(self, fields: list[str]) -> None:
+        self.op_idx = int(fields[0])
+        self.name = fields[1]
+        (self.macs, self.input_bytes, self.output_bytes, self.buffer_bytes, self.ticks) = [int(field) for field in fields[2:7]]
+
+    @property
+    def ticks_per_mac(self) -> float:
+        return self.ticks / self.macs if self.macs > 0 else float("nan")
+
+
+def _inference_sizes(output_dir: str) -> tuple[int, int]:
+    with open(os.path.join(output_dir, "include", "inference.h")) as f:
+        header = f.read()
+    sizes = dict(re.findall(r"#define (INFERENCE_\w+_SIZE) (\d+)", header))
+    return (int(sizes["INFERENCE_INPUT_SIZE"]), int(sizes["INFERENCE_OUTPUT_SIZE"]))
+
+
+def build_host(output_dir: str, cc: str = "gcc", cflags: list[str] | None = None, jobs: int | None = None) -> HostBuild:
+    '''compile generated code in output_dir with a host compiler into <output_dir>/host/host_main
+    intrinsics fall back to portable C when the compiler target has no ARM DSP extension'''
+    start = time.perf_counter()
+    if not os.path.exists(os.path.join(output_dir, "include", "inference.h")):
+        raise RuntimeError(f"no generated code in {output_dir}")
+    build_dir = os.path.join(output_dir, host_dir)
+    os.makedirs(build_dir, exist_ok=True)
+    main_path = os.path.join(build_dir, f"{host_main_name}.c")
+    with open(main_path, "w") as f:
+        f.write(generate_host_main())
+    sources = sorted(glob.glob(os.path.join(output_dir, "src", "*.c")) + glob.glob(os.path.join(output_dir, "src", "*.S")))
+    sources.append(main_path)
+    flags = host_cflags if cflags is None else cflags
+    # .incbin in blob mode is relative to the source directory
+    includes = ["-I", os.path.join(output_dir, "include"), "-I", os.path.join(output_dir, "src")]
+
+    def compile_source(source: str) -> str:
+        obj = os.path.join(build_dir, os.path.basename(source) + ".o")
+        process = subprocess.run([cc] + flags + includes + ["-c", source, "-o", obj], capture_output=True, text=True)
+        if process.returncode != 0:
+            raise RuntimeError(f"host build of {source} failed:\n{process.stderr}")
+        return obj
+
+    # layer files are independent, compile them in parallel
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        objects = list(pool.map(compile_source, sources))
+    executable = os.path.join(build_dir, host_main_name)
+    process = subprocess.run([cc] + flags + ["-o", executable] + objects + ["-lm"], capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"host link of {output_dir} failed:\n{process.stderr}")
+    (input_size, output_size) = _inference_sizes(output_dir)
+    return HostBuild(output_dir, executable, input_size, output_size, time.perf_counter() - start)
+
+
+def _run(build: HostBuild, inputs: np.ndarray, repeat: int) -> tuple[bytes, list[list[str]]]:
+    batch = inputs.shape[0]
+    data = np.ascontiguousarray(inputs, np.int8).reshape(batch, -1)
+    assert data.shape[1] == build.input_size, f"input has {data.shape[1]} bytes, model takes {build.input_size}"
+    process = subprocess.run([build.executable, str(repeat)], input=data.tobytes(), capture_output=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"{build.executable} exited with {process.returncode}")
+    return (process.stdout, [line.split() for line in process.stderr.decode().splitlines()])
+
+
+def run_host(build: HostBuild, inputs: np.ndarray, repeat: int = 1) -> tuple[np.ndarray, np.ndarray]:
+    '''inputs: (batch, ...) int8 with INFERENCE_INPUT_SIZE bytes per input
+    returns outputs as (batch, INFERENCE_OUTPUT_SIZE) and mean latency of each input in ns'''
+    (stdout, lines) = _run(build, inputs, repeat)
+    outputs = np.frombuffer(stdout, np.int8).reshape(inputs.shape[0], build.output_size)
+    latency = np.array([line[0] for line in lines if len(line) == 1], np.int64)
+    return (outputs, latency)
+
+
+def profile_host(build: HostBuild, inputs: np.ndarray, repeat: int = 1) -> list[LayerProfile]:
+    '''mean ticks of every layer, code must be generated with CodeGenerator(profile=True)'''
+    (_, lines) = _run(build, inputs, repeat)
+    layers = [LayerProfile(line[1:]) for line in lines if len(line) > 0 and line[0] == "profile"]
+    if len(layers) == 0:
+        raise RuntimeError(f"{build.output_dir} is not generated with profiling")
+    return layers
+
+
+def format_profile(layers: list[LayerProfile]) -> str:
+    header = ("layer", "macs", "in", "out", "buffer", "ticks", "ticks/mac", "share")
+    total = sum(layer.ticks for layer in layers)
+    rows = [header]
+    for layer in layers:
+        rows.append((
+            layer.name, str(layer.macs), str(layer.input_bytes), str(layer.output_bytes), str(layer.buffer_bytes),
+            str(layer.ticks), f"{layer.ticks_per_mac:.3f}", f"{100 * layer.ticks / max(total, 1):.1f}%",
+        ))
+    widths = [max(len(row[col]) for row in rows) for col in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="shan_frame.host", description="build generated code with a host compiler and time it")
+    parser.add_argument("output_dirs", nargs="+", help="directories generated by shan_frame")
+    parser.add_argument("-n", "--num-inputs", type=int, default=8, help="number of random inputs")
+    parser.add_argument("-r", "--repeat", type=int, default=10, help="inference runs per input")
+    parser.add_argument("--cc", default="gcc", help="host C compiler")
+    parser.add_argument("--profile", action="store_true",
+                        help="print per layer ticks, needs code generated with --profile")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for output_dir in args.output_dirs:
+        try:
+            build = build_host(output_dir, args.cc)
+            inputs = rng.integers(-128, 128, (args.num_inputs, build.input_size), np.int8)
+            (_, latency) = run_host(build, inputs, args.repeat)
+            print(f"{output_dir}: build {build.build_time:.2f}s, inference {np.mean(latency) / 1e6:.3f}ms")
+            if args.profile:
+                print(format_profile(profile_host(build, inputs, args.repeat)))
+        except RuntimeError as e:
+            print(f"{output_dir}: {e}")
+
+
+if __name__ == "__main__":
+    main()
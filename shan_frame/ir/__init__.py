@@ -11,6 +11,8 @@ class OperatorType(Enum):
     AVG_POOL_2D = 4
     PAD = 5
     RESHAPE = 6
+    INVERTED_RESIDUAL = 7
+    PATCH_STAGE = 8
     # To be added
 
 
@@ -26,6 +28,9 @@ class Operator:
         self.output_idx = output_idx
         self.op_type = op_type
 
+    def mac_count(self, model: "Model") -> int:
+        return 0
+
 
 class DataLayout(Enum):
     UNKNOWN = 0
@@ -111,21 +116,20 @@ class Model:
         op.idx = op_idx
 
     def trim_operator(self):
-        op_idx_list = list(self.operators.keys())
-        op_idx_list.sort()
-        op_new_idx_dict = {}
+        self.reorder_operators(sorted(self.operators.keys()))
 
-        for new_idx in range(0, len(op_idx_list)):
-            old_idx = op_idx_list[new_idx]
-            op_new_idx_dict[old_idx] = new_idx
+    def reorder_operators(self, order: list[int]):
+        '''renumber operators so that order[i] becomes operator i, operator index is execution order'''
+        op_new_idx_dict = {old_idx: new_idx for new_idx, old_idx in enumerate(order)}
 
         for tensor in self.tensors.values():
             if tensor.src_op >= 0:
                 tensor.src_op = op_new_idx_dict[tensor.src_op]
             tensor.dst_op = {op_new_idx_dict[idx] for idx in tensor.dst_op}
 
-        for old_idx, new_idx in op_new_idx_dict.items():
-            op = self.operators.pop(old_idx)
+        ops = [self.operators[old_idx] for old_idx in order]
+        self.operators.clear()
+        for new_idx, op in enumerate(ops):
             op.idx = new_idx
             self.operators[new_idx] = op
 
@@ -0,0 +1,97 @@
+import json
+from numpy import float64
+from . import DataLayout, Model
+from .operator import Conv2D, DepthConv2D, activation_inputs, has_buffer
+
+
+class Decisions:
+    '''optimizer decisions and memory schedule of a model, enough to generate its code without optimizing it again'''
+    # input and output overlap of every conv and depthwise conv
+    io_overlap: dict[int, bool]
+    # depthwise convs whose padding moved into their input
+    prepad: list[int]
+    layout: dict[float64, DataLayout]
+    addr: dict[float64, int]
+    # (addr, size) of the buffer of every op with one
+    buffers: dict[int, tuple[int, int]]
+    peak_mem: int
+
+    def __init__(self, io_overlap: dict[int, bool], prepad: list[int], layout: dict[float64, DataLayout],
+                 addr: dict[float64, int], buffers: dict[int, tuple[int, int]], peak_mem: int) -> None:
+        self.io_overlap = io_overlap
+        self.prepad = prepad
+        self.layout = layout
+        self.addr = addr
+        self.buffers = buffers
+        self.peak_mem = peak_mem
+
+    @staticmethod
+    def capture(model: Model, peak_mem: int) -> "Decisions":
+        io_overlap: dict[int, bool] = {}
+        prepad: list[int] = []
+        layout: dict[float64, DataLayout] = {}
+        addr: dict[float64, int] = {}
+        buffers: dict[int, tuple[int, int]] = {}
+        for op in model.operators.values():
+            if isinstance(op, Conv2D) or isinstance(op, DepthConv2D):
+                io_overlap[op.idx] = op.io_overlap
+                input = model.tensors[op.input_idx]
+                if isinstance(op, DepthConv2D) and (input.prepad_h != 0 or input.prepad_w != 0):
+                    prepad.append(op.idx)
+            for idx in [*activation_inputs(op), op.output_idx]:
+                layout[idx] = model.tensors[idx].layout
+                addr[idx] = model.tensors[idx].addr
+            if has_buffer(op):
+                buffers[op.idx] = (op.buffer_addr, op.buffer_size)
+        return Decisions(io_overlap, prepad, layout, addr, buffers, peak_mem)
+
+    def apply(self, model: Model) -> None:
+        '''set the decisions on model, the ops of the model the decisions were captured from'''
+        # take back the padding moved by other decisions first
+        for op in model.operators.values():
+            if isinstance(op, DepthConv2D):
+                input = model.tensors[op.input_idx]
+                if input.prepad_h != 0 or input.prepad_w != 0:
+                    op.pad_h, op.pad_w = input.prepad_h, input.prepad_w
+                    input.prepad_h, input.prepad_w = 0, 0
+        for op_idx, io_overlap in self.io_overlap.items():
+            op = model.operators[op_idx]
+            assert isinstance(op, Conv2D) or isinstance(op, DepthConv2D), f"op {op_idx} is not a conv"
+            op.io_overlap = io_overlap
+        for op_idx in self.prepad:
+            op = model.operators[op_idx]
+            assert isinstance(op, DepthConv2D), f"op {op_idx} is not a depthwise conv"
+            input = model.tensors[op.input_idx]
+            input.prepad_h, input.prepad_w = op.pad_h, op.pad_w
+            op.pad_h, op.pad_w = 0, 0
+        for idx, layout in self.layout.items():
+            model.tensors[idx].layout = layout
+        for idx, addr in self.addr.items():
+            model.tensors[idx].addr = addr
+        for op_idx, (buffer_addr, buffer_size) in self.buffers.items():
+            op = model.operators[op_idx]
+            assert has_buffer(op), f"op {op_idx} has no buffer"
+            op.buffer_addr = buffer_addr
+            op.buffer_size = buffer_size
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "io_overlap": {str(op_idx): bool(io_overlap) for op_idx, io_overlap in self.io_overlap.items()},
+            "prepad": self.prepad,
+            "layout": {str(float(idx)): layout.name for idx, layout in self.layout.items()},
+            "addr": {str(float(idx)): int(addr) for idx, addr in self.addr.items()},
+            "buffers": {str(op_idx): [int(buffer[0]), int(buffer[1])] for op_idx, buffer in self.buffers.items()},
+            "peak_mem": int(self.peak_mem),
+        })
+
+    @staticmethod
+    def from_json(text: str) -> "Decisions":
+        data = json.loads(text)
+        return Decisions(
+            {int(op_idx): io_overlap for op_idx, io_overlap in data["io_overlap"].items()},
+            list(data["prepad"]),
+            {float64(idx): DataLayout[layout] for idx, layout in data["layout"].items()},
+            {float64(idx): addr for idx, addr in data["addr"].items()},
+            {int(op_idx): (buffer[0], buffer[1]) for op_idx, buffer in data["buffers"].items()},
+            data["peak_mem"],
+        )
@@ -1,5 +1,6 @@
 from . import DataLayout, Operator, OperatorType, Model
 from numpy import float64
+from typing import TypeGuard
 
 
 class Conv2D(Operator):
@@ -32,9 +33,15 @@ class Conv2D(Operator):
         # if is pointwise, no buffer needed
         if weight_tensor.dim_h == weight_tensor.dim_w == 1:
             return 0
-        # minimum im2col buffer is one column (input channel number)
+        # the kernel fills two im2col columns (one for a single output column) before each vec_mul call
         input_tensor = model.tensors[self.input_idx]
-        return weight_tensor.dim_h * weight_tensor.dim_w * input_tensor.dim_c
+        output_tensor = model.tensors[self.output_idx]
+        return min(2, output_tensor.dim_w) * weight_tensor.dim_h * weight_tensor.dim_w * input_tensor.dim_c
+
+    def mac_count(self, model: Model) -> int:
+        weight_tensor = model.tensors[self.weight_idx]
+        output_tensor = model.tensors[self.output_idx]
+        return output_tensor.dim_h * output_tensor.dim_w * output_tensor.dim_c * weight_tensor.dim_h * weight_tensor.dim_w * weight_tensor.dim_c
     
 class DepthConv2D(Operator):
     input_idx: float64 = float64(-1)
@@ -74,6 +81,11 @@ class DepthConv2D(Operator):
             return 0
         return channel_size
 
+    def mac_count(self, model: Model) -> int:
+        weight_tensor = model.tensors[self.weight_idx]
+        output_tensor = model.tensors[self.output_idx]
+        return output_tensor.dim_h * output_tensor.dim_w * output_tensor.dim_c * weight_tensor.dim_h * weight_tensor.dim_w
+
 class Add(Operator):
     input_idx: tuple[float64, float64]
     def __init__(self, input1_idx: float64, input2_idx: float64, output_idx: float64) -> None:
@@ -81,6 +93,11 @@ class Add(Operator):
         super().__init__(input_idx_list, output_idx, OperatorType.ADD)
         self.input_idx = (input1_idx, input2_idx)
 
+    def mac_count(self, model: Model) -> int:
+        # one rescale and add per element
+        output_tensor = model.tensors[self.output_idx]
+        return output_tensor.dim_h * output_tensor.dim_w * output_tensor.dim_c
+
 class Mul(Operator):
     input_idx: tuple[float64, float64]
     
@@ -101,6 +118,10 @@ class AvgPool2D(Operator):
         self.filter_h = filter_h
         self.filter_w = filter_w
 
+    def mac_count(self, model: Model) -> int:
+        output_tensor = model.tensors[self.output_idx]
+        return output_tensor.dim_h * output_tensor.dim_w * output_tensor.dim_c * self.filter_h * self.filter_w
+
 
 class Pad(Operator):
     def __init__(self, input_idx: float64, output_idx: float64) -> None:
@@ -110,4 +131,112 @@ class Pad(Operator):
 class Reshape(Operator):
     def __init__(self, input_idx: float64, output_idx: float64) -> None:
         input_idx_list = [input_idx]
-        super().__init__(input_idx_list, output_idx, OperatorType.RESHAPE)
\ No newline at end of file
+        super().__init__(input_idx_list, output_idx, OperatorType.RESHAPE)
+
+
+class InvertedResidual(Operator):
+    '''expand 1x1 conv (optional) -> depthwise conv -> project 1x1 conv, executed row by row
+    the intermediate tensors never live in the arena, the kernel keeps the depthwise input rows
+    it needs in a rolling buffer'''
+    input_idx: float64 = float64(-1)
+    expand: Conv2D | None
+    depthwise: DepthConv2D
+    project: Conv2D
+    # input and output never overlap, rows of the input are still needed after an output row is written
+    io_overlap: bool = False
+    buffer_size: int = 0
+    buffer_addr: int = 0
+
+    def __init__(self, expand: Conv2D | None, depthwise: DepthConv2D, project: Conv2D) -> None:
+        sub_ops: list[Conv2D | DepthConv2D] = [depthwise, project] if expand is None else [expand, depthwise, project]
+        inner = {op.output_idx for op in sub_ops[:-1]}
+        input_idx_list = [idx for op in sub_ops for idx in op.input_idx_list if idx not in inner]
+        super().__init__(input_idx_list, project.output_idx, OperatorType.INVERTED_RESIDUAL)
+        self.input_idx = sub_ops[0].input_idx
+        self.expand = expand
+        self.depthwise = depthwise
+        self.project = project
+
+    def sub_ops(self) -> list[Conv2D | DepthConv2D]:
+        if self.expand is None:
+            return [self.depthwise, self.project]
+        return [self.expand, self.depthwise, self.project]
+
+    def row_size(self, model: Model) -> int:
+        # one padded depthwise input row, HWC
+        mid = model.tensors[self.depthwise.input_idx]
+        return (mid.dim_w + 2 * self.depthwise.pad_w) * mid.dim_c
+
+    def min_buffer_size(self, model: Model) -> int:
+        # kernel_h rolling depthwise input rows, and one depthwise output row for the projection
+        weight = model.tensors[self.depthwise.weight_idx]
+        dw_output = model.tensors[self.depthwise.output_idx]
+        return weight.dim_h * self.row_size(model) + dw_output.dim_w * dw_output.dim_c
+
+    def mac_count(self, model: Model) -> int:
+        # every depthwise input row is expanded exactly once
+        return sum(op.mac_count(model) for op in self.sub_ops())
+
+
+class PatchStage(Operator):
+    '''the first ops of the model, executed patch by patch over a grid of the stage output
+    each patch recomputes the halo of its receptive field shared with the neighbouring patches,
+    so intermediate tensors only live in the buffer as one patch tile at a time'''
+    input_idx: float64 = float64(-1)
+    # flattened sub ops in execution order, fused blocks are split back into their convs
+    ops: list[Conv2D | DepthConv2D | Add]
+    grid: tuple[int, int]
+    # region (y, x, h, w) of every stage tensor each patch computes or reads
+    regions: list[dict[float64, tuple[int, int, int, int]]]
+    # offset of the tile of every intermediate tensor in the buffer
+    tile_offsets: dict[float64, int]
+    tile_size: int
+    # halos included
+    macs: int
+    io_overlap: bool = False
+    buffer_size: int = 0
+    buffer_addr: int = 0
+
+    def __init__(self, ops: list[Conv2D | DepthConv2D | Add], grid: tuple[int, int],
+                 regions: list[dict[float64, tuple[int, int, int, int]]], tile_offsets: dict[float64, int],
+                 tile_size: int, macs: int) -> None:
+        inner = {op.output_idx for op in ops[:-1]}
+        input_idx_list = list(dict.fromkeys(idx for op in ops for idx in op.input_idx_list if idx not in inner))
+        super().__init__(input_idx_list, ops[-1].output_idx, OperatorType.PATCH_STAGE)
+        self.input_idx = input_idx_list[0]
+        self.ops = ops
+        self.grid = grid
+        self.regions = regions
+        self.tile_offsets = tile_offsets
+        self.tile_size = tile_size
+        self.macs = macs
+
+    def min_buffer_size(self, model: Model) -> int:
+        return self.tile_size
+
+    def mac_count(self, model: Model) -> int:
+        return self.macs
+
+
+def has_buffer(op: Operator) -> TypeGuard[Conv2D | DepthConv2D | InvertedResidual | PatchStage]:
+    '''op gets a scratch buffer from the memory scheduler'''
+    return isinstance(op, (Conv2D, DepthConv2D, InvertedResidual, PatchStage))
+
+
+def preferred_buffer_size(op: Conv2D | DepthConv2D | InvertedResidual | PatchStage, model: Model) -> int:
+    '''buffer size past which the kernel of op gets no faster, the scheduler grows buffers up to it into free space
+    the current kernels work in a fixed amount of buffer'''
+    return op.min_buffer_size(model)
+
+
+def activation_inputs(op: Operator) -> list[float64]:
+    '''input tensors of op that live in sram, weights and biases excluded'''
+    match op:
+        case Conv2D() | DepthConv2D() | AvgPool2D() | InvertedResidual() | PatchStage():
+            return [op.input_idx]
+        case Add():
+            return list(op.input_idx)
+        case Reshape():
+            return [op.input_idx_list[0]]
+        case _:
+            raise NotImplementedError(op.op_type)
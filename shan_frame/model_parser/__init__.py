@@ -1,8 +1,9 @@
 
 from tflite import Model as TFliteModel
 from tflite import Operator as TFliteOP
-from tflite import SubGraph, BuiltinOperator
+from tflite import SubGraph
 from ..ir import Model as IRModel
+from ..utils import TFLiteLoader
 
 from .parse_conv2d import parse_conv2d
 from .parse_avgpool import parse_avgpool2d
@@ -10,20 +11,21 @@ from .parse_pad import parse_pad
 from .parse_add import parse_add
 from .parse_reshape import parse_reshape
 from .fuse_pad import fuse_pad
+from .fuse_inverted_residual import fuse_inverted_residual
 
 class ModelParser:
     model_path: str
+    loader: TFLiteLoader
     tflite_model: TFliteModel
 
     def __init__(self, model_path: str) -> None:
         self.model_path = model_path
-        buf = open(model_path, "rb").read()
-        self.tflite_model = TFliteModel.GetRootAs(buf)
+        self.loader = TFLiteLoader(model_path)
+        self.tflite_model = self.loader.tflite_model
 
-    def parse_model(self) -> IRModel:
-        subgraph = self.tflite_model.Subgraphs(0)
-        if subgraph is None:
-            raise RuntimeError("subgraph 0 not exist")
+    def parse_model(self, fuse_blocks: bool = False) -> IRModel:
+        '''fuse_blocks: run expand -> depthwise -> project chains as one row-buffered op'''
+        subgraph = self.loader.subgraph
         model: IRModel = IRModel()
         operators_len: int = subgraph.OperatorsLength()
         skip_next_ops = 0
@@ -49,43 +51,28 @@ class ModelParser:
 
             self._handleOperator(op, model)
         fuse_pad(model)
+        if fuse_blocks:
+            fuse_inverted_residual(model)
         return model
 
     def _handleOperator(self, op: TFliteOP, model: IRModel):
         op_code = self._getOpCodeStr(op)
         match op_code:
             case "PAD":
-                parse_pad(op, self.tflite_model, model)
+                parse_pad(op, self.loader, model)
             case "CONV_2D" | "DEPTHWISE_CONV_2D":
-                parse_conv2d(op, self.tflite_model, model)
+                parse_conv2d(op, self.loader, model)
             case "AVERAGE_POOL_2D":
-                parse_avgpool2d(op, self.tflite_model, model)
+                parse_avgpool2d(op, self.loader, model)
             case "ADD":
-                parse_add(op, self.tflite_model, model)
+                parse_add(op, self.loader, model)
             case "RESHAPE":
-                parse_reshape(op, self.tflite_model, model)
+                parse_reshape(op, self.loader, model)
             case _:
                 raise NotImplementedError(f"Unsupported op: {op_code}")
 
     def _getOpCodeStr(self, op: TFliteOP) -> str:
-        op_code_list_idx = op.OpcodeIndex()
-        op_codes = self.tflite_model.OperatorCodes(op_code_list_idx)
-        if op_codes is None:
-            raise RuntimeError("mdoel op codes is none")
-        op_code_id = op_codes.DeprecatedBuiltinCode()
-
-        def _build_str_map(obj):
-            ret = {}
-            for field_name in dir(obj):
-                if not field_name.startswith("_"):
-                    field_value = getattr(obj, field_name)
-                    if isinstance(field_value, int):
-                        ret[field_value] = field_name
-            return ret
-
-        builtin_op_code = _build_str_map(BuiltinOperator())
-
-        return builtin_op_code[op_code_id]
+        return self.loader.op_code_str(op)
 
     def _checkIfRequireSElementmult(self, three_op_sequence: list[TFliteOP]) -> bool:
         if (
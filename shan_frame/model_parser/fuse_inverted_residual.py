@@ -0,0 +1,98 @@
+from ..ir import Model, Operator, Tensor
+from ..ir.operator import Conv2D, DepthConv2D, InvertedResidual, activation_inputs, has_buffer
+
+
+def is_pointwise(model: Model, op) -> bool:
+    if not isinstance(op, Conv2D):
+        return False
+    weight = model.tensors[op.weight_idx]
+    return weight.dim_h == weight.dim_w == 1 and op.stride_h == op.stride_w == 1 and op.pad_h == op.pad_w == 0
+
+
+def only_consumer(tensor: Tensor) -> int:
+    return next(iter(tensor.dst_op)) if len(tensor.dst_op) == 1 else -1
+
+
+def starts_overlapped(model: Model, op: Operator) -> bool:
+    '''the optimizer starts 1x1 convs and depthwise convs overlapping their input and output'''
+    if isinstance(op, Conv2D):
+        weight = model.tensors[op.weight_idx]
+        return weight.dim_h == weight.dim_w == 1
+    return isinstance(op, DepthConv2D)
+
+
+def column_bytes(model: Model, ops: list[Operator]) -> list[int]:
+    '''live tensor bytes plus the largest minimum buffer at every op of ops run in that order,
+    counted like get_rect and get_buf_rect with the overlaps the optimizer starts from'''
+    column = {op.output_idx: pos for pos, op in enumerate(ops)}
+    # column after the last one every tensor is live in
+    end = {op.output_idx: pos + 1 for pos, op in enumerate(ops)}
+    for pos, op in enumerate(ops):
+        for idx in activation_inputs(op):
+            if idx in end:
+                end[idx] = max(end[idx], pos if starts_overlapped(model, op) else pos + 1)
+    tensor_delta = [0] * (len(ops) + 1)
+    for idx, start in column.items():
+        tensor_delta[start] += model.tensors[idx].mem_size()
+        tensor_delta[max(end[idx], start + 1)] -= model.tensors[idx].mem_size()
+    buffer_live = [0] * len(ops)
+    for pos, op in enumerate(ops):
+        if has_buffer(op):
+            for buffer_column in range(max(pos - 1, 0), pos + 1):
+                buffer_live[buffer_column] = max(buffer_live[buffer_column], op.min_buffer_size(model))
+    live = 0
+    result = []
+    for pos in range(len(ops)):
+        live += tensor_delta[pos]
+        result.append(live + buffer_live[pos])
+    return result
+
+
+def lowers_peak(model: Model, block: InvertedResidual) -> bool:
+    '''whether the block needs fewer bytes over its columns and their neighbours than its sub ops,
+    the fused op keeps its input and output live together, next to the row buffer'''
+    ops = [model.operators[idx] for idx in sorted(model.operators.keys())]
+    sub_ops = block.sub_ops()
+    first = ops.index(sub_ops[0])
+    fused = ops[:first] + [block] + ops[first + len(sub_ops):]
+    before = column_bytes(model, ops)[max(first - 1, 0):first + len(sub_ops) + 1]
+    after = column_bytes(model, fused)[max(first - 1, 0):first + 2]
+    return max(after) < max(before)
+
+
+def fuse_inverted_residual(model: Model):
+    '''merge expand 1x1 -> depthwise -> project 1x1 chains into one InvertedResidual op, where that lowers the peak
+    the expand conv is optional, blocks with expand ratio 1 start at the depthwise conv'''
+    for op_idx in sorted(model.operators.keys()):
+        op = model.operators.get(op_idx)
+        if not isinstance(op, DepthConv2D):
+            continue
+        # intermediate tensors must be consumed by the next op of the chain only
+        dw_input = model.tensors[op.input_idx]
+        dw_output = model.tensors[op.output_idx]
+        project = model.operators.get(only_consumer(dw_output))
+        if not (isinstance(project, Conv2D) and is_pointwise(model, project)):
+            continue
+        expand = model.operators.get(dw_input.src_op)
+        if not (isinstance(expand, Conv2D) and is_pointwise(model, expand) and only_consumer(dw_input) == op_idx):
+            expand = None
+
+        block = InvertedResidual(expand, op, project)
+        if not lowers_peak(model, block):
+            continue
+        sub_ops = block.sub_ops()
+        # detach the sub ops, the block takes the place of the first one
+        for sub_op in sub_ops:
+            model.operators.pop(sub_op.idx)
+            for input_idx in sub_op.input_idx_list:
+                model.tensors[input_idx].dst_op.discard(sub_op.idx)
+        for sub_op in sub_ops[:-1]:
+            # intermediate tensors stay in the model for their quantization only
+            model.tensors[sub_op.output_idx].src_op = -1
+        block.idx = sub_ops[0].idx
+        model.operators[block.idx] = block
+        for input_idx in block.input_idx_list:
+            model.tensors[input_idx].dst_op.add(block.idx)
+        model.tensors[block.output_idx].src_op = block.idx
+
+    model.trim_operator()
@@ -2,7 +2,6 @@ import math
 
 import numpy as np
 
-from tflite import Model as TFliteModel
 from tflite import Operator as TFliteOP
 
 from ..ir import Tensor as IRTensor
@@ -11,28 +10,28 @@ from ..ir.operator import Add
 from ..utils import (
     get_input_tensors,
     get_output_tensors,
-    getOpCodeStr,
+    TFLiteLoader,
 )
 
 from ..ir import Model as IRModel
 
 
-def parse_add(op: TFliteOP, tflite_model: TFliteModel, ir_model: IRModel):
+def parse_add(op: TFliteOP, loader: TFLiteLoader, ir_model: IRModel):
     # operator
-    op_code_str = getOpCodeStr(op, tflite_model)
+    op_code_str = loader.op_code_str(op)
     assert op_code_str == "ADD"
 
     new_tensors: list[IRTensor] = []
 
     # get input, weight, and output tensors
-    input_tensors = get_input_tensors(op, tflite_model)
+    input_tensors = get_input_tensors(op, loader)
     new_tensors.extend(input_tensors)
     assert len(input_tensors) == 2, "input should be 2 tensors"
 
     input1_tensor = input_tensors[0]
     input2_tensor = input_tensors[1]
 
-    output_tensors = get_output_tensors(op, tflite_model)
+    output_tensors = get_output_tensors(op, loader)
     new_tensors.extend(output_tensors)
     assert len(output_tensors) == 1, "output tensors length should be 1"
     output_tensor = output_tensors[0]
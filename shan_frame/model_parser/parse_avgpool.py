@@ -2,7 +2,6 @@ import math
 
 import numpy as np
 
-from tflite import Model as TFliteModel
 from tflite import Operator as TFliteOP
 from tflite.BuiltinOptions import BuiltinOptions
 from tflite.Pool2DOptions import Pool2DOptions
@@ -13,27 +12,27 @@ from ..ir.operator import AvgPool2D
 from ..utils import (
     get_input_tensors,
     get_output_tensors,
-    getOpCodeStr,
+    TFLiteLoader,
 )
 
 from ..ir import Model as IRModel
 
 
-def parse_avgpool2d(op: TFliteOP, tflite_model: TFliteModel, ir_model: IRModel):
+def parse_avgpool2d(op: TFliteOP, loader: TFLiteLoader, ir_model: IRModel):
     # operator
-    op_code_str = getOpCodeStr(op, tflite_model)
+    op_code_str = loader.op_code_str(op)
     assert op_code_str == "AVERAGE_POOL_2D"
 
     new_tensors: list[IRTensor] = []
 
     # get input, weight, and output tensors
-    input_tensors = get_input_tensors(op, tflite_model)
+    input_tensors = get_input_tensors(op, loader)
     new_tensors.extend(input_tensors)
     input_tensor_count = len(input_tensors)
     assert input_tensor_count == 1, "input tensors length should be 1"
     input_tensor = input_tensors[0]
 
-    output_tensors = get_output_tensors(op, tflite_model)
+    output_tensors = get_output_tensors(op, loader)
     new_tensors.extend(output_tensors)
     output_tensor_count = len(output_tensors)
     assert output_tensor_count == 1, "output tensors length should be 1"
@@ -2,7 +2,6 @@ import math
 
 import numpy as np 
 
-from tflite import Model as TFliteModel
 from tflite import Operator as TFliteOP
 from tflite.BuiltinOptions import BuiltinOptions
 from tflite.Conv2DOptions import Conv2DOptions
@@ -14,21 +13,21 @@ from ..ir import Tensor as IRTensor
 from ..utils import (
     get_input_tensors,
     get_output_tensors,
-    getOpCodeStr,
+    TFLiteLoader,
 )
 
 from ..ir import Model as IRModel
 
-def parse_conv2d(op: TFliteOP, tflite_model: TFliteModel, ir_model: IRModel):
+def parse_conv2d(op: TFliteOP, loader: TFLiteLoader, ir_model: IRModel):
     # operator
-    op_code_str = getOpCodeStr(op, tflite_model)
+    op_code_str = loader.op_code_str(op)
     assert op_code_str == "CONV_2D" or op_code_str == "DEPTHWISE_CONV_2D", f"unsupported input op to parse_conv2d(): {op_code_str}"
     is_conv2d = (op_code_str == "CONV_2D")
     
     new_tensors: list[IRTensor] = []
     
     # get input, weight, and output tensors
-    input_tensors = get_input_tensors(op, tflite_model)
+    input_tensors = get_input_tensors(op, loader)
     new_tensors.extend(input_tensors)
     input_tensor_count = len(input_tensors)
     assert input_tensor_count >= 2, "input tensors length should be >= 2"
@@ -36,7 +35,7 @@ def parse_conv2d(op: TFliteOP, tflite_model: TFliteModel, ir_model: IRModel):
     input_tensor = input_tensors[0]
     weight_tensor = input_tensors[1]
     
-    output_tensors = get_output_tensors(op, tflite_model)
+    output_tensors = get_output_tensors(op, loader)
     assert len(output_tensors) == 1, "output tensors length should be 1"
     new_tensors.extend(output_tensors)
     output_tensor = output_tensors[0]
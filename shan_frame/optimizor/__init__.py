@@ -1,16 +1,58 @@
-
+import copy
+import heapq
 from ..ir import DataLayout, Model
-from ..ir.operator import Conv2D, DepthConv2D, Add, Mul
-from .mem_scheduler import MemoryScheduler
+from ..ir.operator import Conv2D, DepthConv2D, Add, Mul, InvertedResidual, PatchStage
+from .mem_scheduler import MemoryScheduler, ScheduleReport, live_bytes
+from .latency import LatencyModel
+from ..ir.decisions import Decisions
+from .pareto import ParetoPoint, const_bytes, pareto_front
+from .patch import PATCH_GRIDS, PatchPlan, patch_splits, make_patch_stage, apply_patch_stage
+from .reorder import best_order
 from .visualizer import visualize_memory
 
+# an optimizer move: ("overlap", convs that stop overlapping input and output) or ("prepad", (depthwise conv,))
+Move = tuple[str, tuple[int, ...]]
+# (decisions key, (layout, pre-padding) of every tensor, estimated cycles of every op, live bytes) of a state
+BaseCost = tuple[tuple, dict, dict[int, float], list[int]]
+
 class Optimizer:
     mem_scheduler: MemoryScheduler
     model: Model
     min_peak_mem_usage: int
-    def __init__(self, model: Model) -> None:
+    # seconds of placement search for the base schedule of optimize() and pareto(), None for the greedy placement only
+    time_budget: float | None
+    # worker processes of the placement search, None for one per core
+    jobs: int | None
+    # whether the base schedule got its placement search
+    searched: bool
+    # gap of the final schedule to the lower bound, set by optimize()
+    schedule_report: ScheduleReport | None
+    # ranks the moves of optimize()
+    latency: LatencyModel
+    # cost of the current decisions that moves are scored against, see base()
+    base_cost: BaseCost | None
+    # live bytes of every state of the decisions seen, by decisions key
+    live_cache: dict[tuple, list[int]]
+    # whether the committed schedule peaks at its lower bound, moves within the limit are then accepted on their bound
+    tight: bool
+    # moves accepted on their bound since the last committed schedule, see flush()
+    pending: list[Move]
+    # whether moves may be accepted on their bound, off for the rest of a pass once such moves did not fit together
+    lazy: bool
+    def __init__(self, model: Model, time_budget: float | None = None, latency: LatencyModel | None = None,
+                 jobs: int | None = None) -> None:
         self.mem_scheduler = MemoryScheduler()
         self.model = model
+        self.time_budget = time_budget
+        self.jobs = jobs
+        self.searched = False
+        self.latency = LatencyModel() if latency is None else latency
+        self.base_cost = None
+        self.live_cache = {}
+        self.tight = False
+        self.pending = []
+        self.lazy = True
+        self.schedule_report = None
         for op in self.model.operators.values():
             if isinstance(op, Conv2D):
                 weight = self.model.tensors[op.weight_idx]
@@ -21,45 +63,366 @@ class Optimizer:
         self.min_peak_mem_usage = self.mem_scheduler.schedule(model)
         pass
 
-    def optimize(self, sram_scale: float = 1) -> tuple[Model, int]:
-        '''sram_scale: allowed peak sram usage against minimum usage'''
+    def plan_patches(self, grids: list[tuple[int, int]] = PATCH_GRIDS) -> list[PatchPlan]:
+        '''minimum peak sram and macs of running the first stage patch by patch, for every split point and grid
+        the first plan is the layer by layer baseline, call before optimize()'''
+        macs = sum(int(op.mac_count(self.model)) for op in self.model.operators.values())
+        plans = [PatchPlan(0, (1, 1), self.min_peak_mem_usage, macs, 0)]
+        for split in patch_splits(self.model):
+            output = self.model.tensors[self.model.operators[split - 1].output_idx]
+            stage_macs = sum(int(self.model.operators[idx].mac_count(self.model)) for idx in range(split))
+            for grid in grids:
+                if output.dim_h < grid[0] or output.dim_w < grid[1]:
+                    continue
+                stage = make_patch_stage(self.model, split, grid)
+                trial = copy.deepcopy(self.model)
+                apply_patch_stage(trial, stage, split)
+                peak_mem = MemoryScheduler().schedule(trial)
+                extra_macs = stage.macs - stage_macs
+                plans.append(PatchPlan(split, grid, peak_mem, macs + extra_macs, extra_macs))
+        return plans
+
+    def use_patches(self, plan: PatchPlan) -> None:
+        '''run the first stage of the model patch by patch as planned, call before optimize()'''
+        if plan.split == 0:
+            return
+        apply_patch_stage(self.model, make_patch_stage(self.model, plan.split, plan.grid), plan.split)
+        self.base_cost = None
+        self.live_cache = {}
+        self.tight = False
+        self.mem_scheduler = MemoryScheduler()
+        self.min_peak_mem_usage = self.mem_scheduler.schedule(self.model)
+
+    def reorder(self) -> bool:
+        '''run the ops in the topological order with the lowest scheduled peak, call before optimize()
+        the orders with the lowest peak of live bytes are scheduled, returns whether the order changed'''
+        current = sorted(self.model.operators.keys())
+        best: tuple[int, list[int]] = (self.min_peak_mem_usage, current)
+        for prefer_area in (False, True):
+            order = best_order(self.model, prefer_area)
+            if order == current:
+                continue
+            trial = copy.deepcopy(self.model)
+            trial.reorder_operators(order)
+            peak_mem = MemoryScheduler().schedule(trial)
+            if peak_mem < best[0]:
+                best = (peak_mem, order)
+        if best[1] == current:
+            return False
+        self.model.reorder_operators(best[1])
+        self.base_cost = None
+        self.live_cache = {}
+        self.tight = False
+        self.mem_scheduler = MemoryScheduler()
+        self.min_peak_mem_usage = self.mem_scheduler.schedule(self.model)
+        return True
+
+    def search_schedule(self) -> None:
+        '''spend time_budget once, on the placement order of the base schedule optimize() and pareto() start from
+        patch plan and reorder trials are compared by the greedy placement'''
+        if self.time_budget is None or self.searched:
+            return
+        self.min_peak_mem_usage = self.mem_scheduler.schedule(self.model, self.time_budget, self.jobs)
+        self.tight = False
+        self.searched = True
+
+    def optimize(self, sram_scale: float = 1, footprint_path: str | None = "footprint.png") -> tuple[Model, int]:
+        '''sram_scale: allowed peak sram usage against minimum usage
+        footprint_path: where to plot the memory footprint, None to skip plotting'''
+        self.search_schedule()
+        self.spend(self.min_peak_mem_usage * sram_scale)
+
+        self.set_data_layout()
+        final_peak_mem = self.mem_scheduler.reschedule(self.model)
+        self.mem_scheduler.commit()
+        self.schedule_report = self.mem_scheduler.report(self.model)
+        if footprint_path is not None:
+            visualize_memory(self.model, peak_mem=final_peak_mem, path=footprint_path)
         
-        # iterative optimization
-        for op_idx, op in self.model.operators.items():
+        return (self.model, final_peak_mem)
+
+    def try_schedule(self, peak_limit: float, move: Move) -> int:
+        '''reschedule after applying move, commit if the peak stays within peak_limit, a rejected move is reverted by the caller
+        returns the peak, or the lower bound of a move already over the limit, which is rejected without scheduling.
+        while the committed schedule peaks at its lower bound, a move within the limit is accepted on its bound,
+        flush() schedules the moves accepted so'''
+        bound = max(self.live(), default=0)
+        if bound > peak_limit:
+            return bound
+        if self.tight and self.lazy:
+            self.pending.append(move)
+            return bound
+        peak_mem = self.mem_scheduler.reschedule(self.model)
+        if peak_mem > peak_limit:
+            self.mem_scheduler.rollback(self.model)
+        else:
+            self.mem_scheduler.commit()
+            self.tight = peak_mem == bound
+        return peak_mem
+
+    def flush(self, peak_limit: float) -> list[tuple[int, Move]]:
+        '''schedule the moves accepted on their bound, if they do not fit together they are tried again one at a time
+        returns the moves rejected then with the peak they need'''
+        if len(self.pending) == 0:
+            return []
+        self.set_data_layout()
+        peak_mem = self.mem_scheduler.reschedule(self.model)
+        if peak_mem <= peak_limit:
+            self.mem_scheduler.commit()
+            self.tight = peak_mem == max(self.live(), default=0)
+            self.pending = []
+            return []
+        self.mem_scheduler.rollback(self.model)
+        (pending, self.pending) = (self.pending, [])
+        self.lazy = False
+        for move in reversed(pending):
+            self.revert_move(move)
+        rejected: list[tuple[int, Move]] = []
+        for move in pending:
+            # a move may depend on an earlier one rejected this time
+            if not self.can_apply(move):
+                continue
+            self.apply_move(move)
+            self.set_data_layout()
+            peak_mem = self.try_schedule(peak_limit, move)
+            if peak_mem > peak_limit:
+                self.revert_move(move)
+                rejected.append((peak_mem, move))
+        return rejected + self.flush(peak_limit)
+
+    def restore(self, decisions: Decisions) -> None:
+        '''set the overlap and pre-padding decisions of an earlier state and commit its schedule'''
+        decisions.apply(self.model)
+        self.set_data_layout()
+        peak_mem = self.mem_scheduler.reschedule(self.model)
+        self.mem_scheduler.commit()
+        self.tight = peak_mem == max(self.live(), default=0)
+        self.pending = []
+
+    def spend(self, peak_limit: float) -> list[tuple[int, Move]]:
+        '''spend peak_limit on moves from the current decisions, by the ratio greedy and by op order,
+        and keep the result with fewer estimated cycles. returns the moves either one rejected with the peak they need'''
+        start = Decisions.capture(self.model, self.min_peak_mem_usage)
+        heap: list[tuple[float, int, Move]] = []
+        queued: set[Move] = set()
+        self.queue_moves(heap, queued)
+        rejected = self.spend_budget(peak_limit, heap, queued)
+        greedy = Decisions.capture(self.model, self.min_peak_mem_usage)
+        greedy_cycles = self.latency.model_cycles(self.model)
+        # the ratio greedy is a heuristic, trying the moves in op order saves more on some models
+        self.restore(start)
+        rejected += self.spend_in_order(peak_limit)
+        if greedy_cycles <= self.latency.model_cycles(self.model):
+            self.restore(greedy)
+        return rejected
+
+    def spend_in_order(self, peak_limit: float) -> list[tuple[int, Move]]:
+        '''try de-overlapping and then pre-padding every conv in op order, keep what stays within peak_limit
+        moves that save no estimated cycles are not scheduled. returns the moves rejected with the peak they need'''
+        rejected: list[tuple[int, Move]] = []
+        self.lazy = True
+        for op in list(self.model.operators.values()):
             if not (isinstance(op, Conv2D) or isinstance(op, DepthConv2D)):
                 continue
+            for move in [("overlap", (op.idx,)), ("prepad", (op.idx,))]:
+                if not self.can_apply(move):
+                    continue
+                if self.saved_cycles(move) <= 0:
+                    self.revert_move(move)
+                    continue
+                peak_mem = self.try_schedule(peak_limit, move)
+                if peak_mem > peak_limit:
+                    self.revert_move(move)
+                    rejected.append((peak_mem, move))
+        rejected += self.flush(peak_limit)
+        self.set_data_layout()
+        return rejected
+
+    def queue_moves(self, heap: list[tuple[float, int, Move]], queued: set[Move]) -> None:
+        for move in self.moves():
+            if move not in queued:
+                queued.add(move)
+                heapq.heappush(heap, (-self.score_move(move)[0], len(queued), move))
+
+    def spend_budget(self, peak_limit: float, heap: list[tuple[float, int, Move]], queued: set[Move]) -> list[tuple[int, Move]]:
+        '''apply the moves of heap with the most estimated cycles saved per byte first, while the peak stays within peak_limit
+        every move is scored when queued and scored again when it comes first.
+        returns the moves rejected over the limit with the peak they need, they are not queued again.
+        moves saving nothing are queued again after the next accepted move'''
+        rejected: list[tuple[int, Move]] = []
+        self.lazy = True
+        while len(heap) > 0 or len(self.pending) > 0:
+            if len(heap) == 0:
+                flushed = self.flush(peak_limit)
+                rejected += flushed
+                queued.update(move for (_, move) in flushed)
+                # moves of an earlier state can open again
+                self.queue_moves(heap, queued)
+                continue
+            (_, order, move) = heapq.heappop(heap)
+            if not self.can_apply(move):
+                queued.discard(move)
+                continue
+            (ratio, saved) = self.score_move(move)
+            if saved <= 0:
+                queued.discard(move)
+                continue
+            if len(heap) > 0 and ratio < -heap[0][0]:
+                heapq.heappush(heap, (-ratio, order, move))
+                continue
+            self.apply_move(move)
+            self.set_data_layout()
+            peak_mem = self.try_schedule(peak_limit, move)
+            if peak_mem > peak_limit:
+                self.revert_move(move)
+                rejected.append((peak_mem, move))
+                continue
+            queued.discard(move)
+            # a move can open moves or make others worth it, like pre-padding the input of a depthwise conv that stopped overlapping
+            self.queue_moves(heap, queued)
+        self.set_data_layout()
+        return rejected
 
-            # try to de-overlap input and output
+    def pareto(self, max_scale: float = 2) -> list[ParetoPoint]:
+        '''non-dominated (peak sram, estimated cycles, flash size) configs with peaks up to max_scale times the minimum
+        sweeps the sram limit up from the minimum peak, every level spends its limit from the starting decisions
+        the same way optimize() does, and the next level is the lowest peak a move rejected at this one needs.
+        the model is left with the decisions of the last level, apply those of a point to generate it'''
+        self.search_schedule()
+        flash_size = const_bytes(self.model)
+        max_peak = self.min_peak_mem_usage * max_scale
+        peak_limit = float(self.min_peak_mem_usage)
+        start = Decisions.capture(self.model, self.min_peak_mem_usage)
+        points: list[ParetoPoint] = []
+        while True:
+            self.restore(start)
+            rejected = self.spend(peak_limit)
+            self.set_data_layout()
+            peak_mem = self.mem_scheduler.reschedule(self.model)
+            self.mem_scheduler.commit()
+            points.append(ParetoPoint(peak_mem, self.latency.model_cycles(self.model), flash_size,
+                                      Decisions.capture(self.model, peak_mem)))
+            levels = [needed for (needed, _) in rejected if needed <= max_peak]
+            if len(levels) == 0:
+                break
+            peak_limit = float(min(levels))
+        return pareto_front(points)
+
+    def moves(self) -> list[Move]:
+        '''de-overlap and pre-pad moves open in the current model'''
+        moves: list[Move] = []
+        for op in self.model.operators.values():
+            if not (isinstance(op, Conv2D) or isinstance(op, DepthConv2D)):
+                continue
             if op.io_overlap:
+                moves.append(("overlap", (op.idx,)))
+                producer = self.model.operators.get(self.model.tensors[op.input_idx].src_op)
+                if isinstance(op, DepthConv2D) and isinstance(producer, Conv2D) and producer.io_overlap:
+                    # the depthwise input only turns CHW once both stop overlapping
+                    moves.append(("overlap", (producer.idx, op.idx)))
+            elif self.can_apply(("prepad", (op.idx,))):
+                moves.append(("prepad", (op.idx,)))
+        return moves
+
+    def can_apply(self, move: Move) -> bool:
+        (kind, op_idx_list) = move
+        if kind == "overlap":
+            return all(self.model.operators[op_idx].io_overlap for op_idx in op_idx_list)
+        op = self.model.operators[op_idx_list[0]]
+        # XXX: This is assuming pre-padding has no interference with overlapping
+        if not isinstance(op, DepthConv2D) or op.io_overlap or op.idx == 0 or (op.pad_h == 0 and op.pad_w == 0):
+            return False
+        input = self.model.tensors[op.input_idx]
+        # fused blocks, patch stages and overlapped 1x1 convs write their output without pre-padding
+        producer = self.model.operators.get(input.src_op)
+        if isinstance(producer, (InvertedResidual, PatchStage)) or (isinstance(producer, Conv2D) and producer.io_overlap):
+            return False
+        after_pad_size = (input.dim_h + 2 * op.pad_h) * (input.dim_w + 2 * op.pad_w)
+        ch_size = input.dim_h * input.dim_w
+        return after_pad_size - ch_size < ch_size
+
+    def apply_move(self, move: Move) -> None:
+        (kind, op_idx_list) = move
+        for op_idx in op_idx_list:
+            op = self.model.operators[op_idx]
+            assert isinstance(op, Conv2D) or isinstance(op, DepthConv2D)
+            if kind == "overlap":
                 op.io_overlap = False
-                self.set_data_layout()
-                current_peak_mem = self.mem_scheduler.schedule(self.model)
-                if current_peak_mem > self.min_peak_mem_usage * sram_scale:
-                    op.io_overlap = True
+            else:
+                input = self.model.tensors[op.input_idx]
+                input.prepad_h, input.prepad_w = op.pad_h, op.pad_w
+                op.pad_h, op.pad_w = 0, 0
 
-            # try to pre-pad input
-            # XXX: This is assuming pre-padding has no interference with overlapping
-            if (not op.io_overlap) and op_idx != 0 and (op.pad_h != 0 or op.pad_w != 0):
+    def revert_move(self, move: Move) -> None:
+        (kind, op_idx_list) = move
+        for op_idx in op_idx_list:
+            op = self.model.operators[op_idx]
+            assert isinstance(op, Conv2D) or isinstance(op, DepthConv2D)
+            if kind == "overlap":
+                op.io_overlap = True
+            else:
                 input = self.model.tensors[op.input_idx]
-                if isinstance(op, DepthConv2D):
-                    after_pad_size = (input.dim_h + 2 * op.pad_h) * (input.dim_w + 2 * op.pad_w)
-                    ch_size = input.dim_h * input.dim_w
-                    ch_pad_size = after_pad_size - ch_size
-                    if ch_pad_size < ch_size:
-                        input.prepad_h, input.prepad_w = op.pad_h, op.pad_w
-                        op.pad_h, op.pad_w = 0, 0
-                        self.set_data_layout()
-                        current_peak_mem = self.mem_scheduler.schedule(self.model)
-                        if current_peak_mem > self.min_peak_mem_usage * sram_scale:
-                            op.pad_h, op.pad_w = input.prepad_h, input.prepad_w
-                            input.prepad_h, input.prepad_w = 0, 0
+                op.pad_h, op.pad_w = input.prepad_h, input.prepad_w
+                input.prepad_h, input.prepad_w = 0, 0
+
+    def decisions_key(self) -> tuple:
+        '''overlap and padding of every conv, the layout and pre-padding of all tensors follow from them'''
+        return tuple((op.idx, op.io_overlap, op.pad_h, op.pad_w) for op in self.model.operators.values()
+                     if isinstance(op, Conv2D) or isinstance(op, DepthConv2D))
 
+    def tensor_states(self) -> dict:
+        return {idx: (tensor.layout, tensor.prepad_h, tensor.prepad_w) for idx, tensor in self.model.tensors.items()}
+
+    def changed_ops(self, key: tuple, tensors: dict) -> set[int]:
+        '''ops whose estimated cycles may differ from the state of key and tensors, with the layout set'''
+        changed = {now[0] for (before, now) in zip(key, self.decisions_key()) if before != now}
+        for idx, tensor in self.model.tensors.items():
+            if tensors[idx] != (tensor.layout, tensor.prepad_h, tensor.prepad_w):
+                changed.update(tensor.dst_op)
+                if tensor.src_op >= 0:
+                    changed.add(tensor.src_op)
+        return changed
+
+    def live(self) -> list[int]:
+        '''live_bytes() of the current decisions, call with the layout set for them'''
+        key = self.decisions_key()
+        if key not in self.live_cache:
+            self.live_cache[key] = live_bytes(self.model)
+        return self.live_cache[key]
+
+    def base(self) -> BaseCost:
+        '''cost of the current decisions, only the ops changed since the last base are costed again'''
+        key = self.decisions_key()
+        if self.base_cost is not None and self.base_cost[0] == key:
+            return self.base_cost
         self.set_data_layout()
-        final_peak_mem = self.mem_scheduler.schedule(self.model)
-        visualize_memory(self.model, peak_mem=final_peak_mem)
-        
-        return (self.model, final_peak_mem)
-    
+        if self.base_cost is None:
+            cycles = {op.idx: self.latency.op_cycles(self.model, op) for op in self.model.operators.values()}
+        else:
+            (last_key, last_tensors, cycles, _) = self.base_cost
+            cycles = dict(cycles)
+            for op_idx in self.changed_ops(last_key, last_tensors):
+                cycles[op_idx] = self.latency.op_cycles(self.model, self.model.operators[op_idx])
+        self.base_cost = (key, self.tensor_states(), cycles, self.live())
+        return self.base_cost
+
+    def saved_cycles(self, move: Move) -> float:
+        '''estimated cycles move saves, the move is left applied with the layout set for it'''
+        (key, tensors, cycles, _) = self.base()
+        self.apply_move(move)
+        self.set_data_layout()
+        return sum(cycles[op_idx] - self.latency.op_cycles(self.model, self.model.operators[op_idx])
+                   for op_idx in self.changed_ops(key, tensors))
+
+    def score_move(self, move: Move) -> tuple[float, float]:
+        '''(estimated cycles saved per byte, cycles saved) of move, the bytes are the most it adds to any column
+        the layout is left as set for the move, call set_data_layout() before scheduling'''
+        live = self.base()[3]
+        saved = self.saved_cycles(move)
+        extra_bytes = max(after - before for before, after in zip(live, self.live()))
+        self.revert_move(move)
+        return (saved / max(extra_bytes, 1), saved)
+
     def set_data_layout(self):
         # set all output layout to default as HWC
         for op in self.model.operators.values():
@@ -77,10 +440,19 @@ class Optimizer:
             input_tensor = self.model.tensors[op.input_idx]
             output_tensor = self.model.tensors[op.output_idx]
             # overlapped input and output must have the layout
+            producer = self.model.operators.get(input_tensor.src_op)
             if op.io_overlap:
                 input_tensor.layout = output_tensor.layout
+            elif isinstance(producer, Conv2D) and producer.io_overlap:
+                # overlapped 1x1 convs only run in HWC, the depthwise conv converts in its buffer
+                input_tensor.layout = DataLayout.HWC
             else:
                 input_tensor.layout = DataLayout.CHW
+
+        # fused blocks expand whole input rows, pixels must be contiguous
+        for op in self.model.operators.values():
+            if isinstance(op, InvertedResidual):
+                self.model.tensors[op.input_idx].layout = DataLayout.HWC
             
         # check data layout alignment for ADD and MUL
         for op in self.model.operators.values():
@@ -102,4 +474,14 @@ class Optimizer:
             # overlapped input and output must have the layout
             if op.io_overlap:
                 input_tensor.layout = output_tensor.layout
-        
\ No newline at end of file
+        
+        # an overlapped chain can hand an add output a layout of its own,
+        # fall back to HWC for the add and carry it down the overlapped chain
+        for op in self.model.operators.values():
+            if isinstance(op, Add) or isinstance(op, Mul):
+                tensors = [self.model.tensors[idx] for idx in [*op.input_idx, op.output_idx]]
+                if len({tensor.layout for tensor in tensors}) > 1:
+                    for tensor in tensors:
+                        tensor.layout = DataLayout.HWC
+            elif (isinstance(op, Conv2D) or isinstance(op, DepthConv2D)) and op.io_overlap:
+                self.model.tensors[op.output_idx].layout = self.model.tensors[op.input_idx].layout
@@ -0,0 +1,95 @@
+import numpy as np
+from ..ir import DataLayout, Model, Operator, Tensor
+from ..ir.operator import Conv2D, DepthConv2D
+
+# work terms of an op, in the order of the coefficient vector
+# mac: multiply-accumulates, copy: memcpy bytes, strided_copy: bytes moved one by one with a stride,
+# set: memset bytes, call: inner kernel calls and loop segments
+COST_TERMS = ["mac", "copy", "strided_copy", "set", "call"]
+
+# cycles per unit of every term, rough numbers for a cortex-m4 with the DSP extension
+DEFAULT_CYCLES = [0.8, 0.3, 3.0, 0.25, 40.0]
+
+
+def prepad_bytes(tensor: Tensor) -> int:
+    '''bytes of the pre-padded border the producer sets'''
+    padded = (tensor.dim_h + 2 * tensor.prepad_h) * (tensor.dim_w + 2 * tensor.prepad_w)
+    return int((padded - tensor.dim_h * tensor.dim_w) * tensor.dim_c)
+
+
+def op_work(model: Model, op: Operator) -> list[float]:
+    '''amount of every COST_TERMS term the kernel of op does'''
+    work = dict.fromkeys(COST_TERMS, 0.0)
+    work["mac"] = float(op.mac_count(model))
+    output = model.tensors[op.output_idx]
+    match op:
+        case Conv2D():
+            input = model.tensors[op.input_idx]
+            weight = model.tensors[op.weight_idx]
+            pixels = output.dim_h * output.dim_w
+            work["set"] = prepad_bytes(output)
+            # a vec_mul call for every two output pixels
+            work["call"] = pixels / 2
+            if weight.dim_h == weight.dim_w == 1:
+                if op.io_overlap:
+                    # overlapped input and output run in a low to high and a high to low segment
+                    work["call"] += 2
+            else:
+                # im2col copies a window row by row
+                work["copy"] = float(pixels * weight.dim_h * weight.dim_w * input.dim_c)
+        case DepthConv2D():
+            input = model.tensors[op.input_idx]
+            plane = (input.dim_h + 2 * input.prepad_h) * (input.dim_w + 2 * input.prepad_w)
+            # one channel conv call per channel
+            work["call"] = input.dim_c
+            if op.pad_h != 0 or op.pad_w != 0 or input.layout != DataLayout.CHW:
+                # every channel goes through the buffer, HWC channels are gathered byte by byte
+                if input.layout == DataLayout.HWC:
+                    work["strided_copy"] = float(plane * input.dim_c)
+                else:
+                    work["copy"] = float(plane * input.dim_c)
+            if op.pad_h != 0 or op.pad_w != 0:
+                row_size = input.dim_w + 2 * input.prepad_w + 2 * op.pad_w
+                work["set"] = float(2 * op.pad_h * row_size + 2 * op.pad_w * (input.dim_h + 2 * input.prepad_h))
+        case _:
+            work["set"] = prepad_bytes(output)
+    return [work[term] for term in COST_TERMS]
+
+
+class LatencyModel:
+    '''analytical latency of the generated kernels, a weighted sum of the work terms of every op'''
+    # cycles per unit of every COST_TERMS term
+    cycles: list[float]
+
+    def __init__(self, cycles: list[float] | None = None) -> None:
+        self.cycles = list(DEFAULT_CYCLES if cycles is None else cycles)
+
+    def op_cycles(self, model: Model, op: Operator) -> float:
+        return float(np.dot(op_work(model, op), self.cycles))
+
+    def model_cycles(self, model: Model) -> float:
+        return sum(self.op_cycles(model, op) for op in model.operators.values())
+
+    def calibrate(self, samples: list[tuple[Model, dict[int, float]]]) -> None:
+        '''fit the cycles per unit to measured ticks of optimized models, {op idx: ticks} for each
+        e.g. {layer.op_idx: layer.ticks for layer in profile_host(...)}, in the unit the ticks are in
+        terms no sample exercises keep their cycles, the fit is least squares without negative cycles'''
+        rows = []
+        ticks = []
+        for (model, measured) in samples:
+            for op_idx, op_ticks in measured.items():
+                rows.append(op_work(model, model.operators[op_idx]))
+                ticks.append(op_ticks)
+        work = np.array(rows, np.float64).reshape(-1, len(COST_TERMS))
+        target = np.array(ticks, np.float64)
+        exercised = [term for term in range(len(COST_TERMS)) if np.any(work[:, term] != 0)]
+        active = list(exercised)
+        fit = np.zeros(0)
+        while len(active) > 0:
+            (fit, _, _, _) = np.linalg.lstsq(work[:, active], target, rcond=None)
+            if np.all(fit >= 0):
+                break
+            # the most negative term is explained by the others
+            active.pop(int(np.argmin(fit)))
+        for term in exercised:
+            self.cycles[term] = float(fit[active.index(term)]) if term in active else 0.0
@@ -1,158 +1,567 @@
+import math
+import os
+import random
+import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate
+from typing import Callable, Iterable
+
 from numpy import float64
 import matplotlib
 
-from ..ir.operator import Conv2D, DepthConv2D
+from ..ir.operator import has_buffer, preferred_buffer_size
 from ..ir import Model
 from ..utils import Rect, get_align_groups, get_buf_rect, get_rect
 
 
 # block: (start, end)
 Blocks = list[tuple[float, float]]
+# journal entry: (node store, node, old bounds, new bounds)
+JournalEntry = tuple[list[list[float]], int, list[float], list[float]]
+
+
+def insert_block(bounds: list[float], head: float, tail: float) -> list[float]:
+    # bounds: flattened sorted disjoint blocks [start0, end0, start1, end1, ...]
+    # merge (head, tail) into bounds, touching blocks are joined
+    lo = bisect_left(bounds, head)
+    hi = bisect_right(bounds, tail)
+    new_bounds = bounds[:lo]
+    if lo % 2 == 0:
+        new_bounds.append(head)
+    if hi % 2 == 0:
+        new_bounds.append(tail)
+    new_bounds.extend(bounds[hi:])
+    return new_bounds
+
+
+def contains_block(bounds: list[float], head: float, tail: float) -> bool:
+    lo = bisect_right(bounds, head)
+    return lo % 2 == 1 and lo == bisect_left(bounds, tail)
+
+
+def free_slots(blocks: Iterable[tuple[float, float]], height: int) -> Blocks:
+    # blocks must be sorted by start, but may overlap each other
+    slots: Blocks = []
+    last_end = 0
+    for start, end in blocks:
+        if start - last_end >= height:
+            slots.append((last_end, start))
+        if end > last_end:
+            last_end = end
+    slots.append((last_end, float('inf')))
+    return slots
 
 
 class MemoryFootprint:
-    # a column contains a list of allocated blocks with (start, end)
-    columns: list[Blocks]
+    # segment tree over op indices (columns), leaf of column i is node size + i
+    # cover: allocated blocks spanning every column of the node
+    # union: allocated blocks touching any column of the node
+    # journal: every node update, so that placements can be undone
+    op_num: int
+    size: int
+    cover: list[list[float]]
+    union: list[list[float]]
+    journal: list[JournalEntry]
 
     def __init__(self, op_num: int) -> None:
-        self.columns = [[] for _ in range(op_num)]
+        self.op_num = op_num
+        self.size = 1
+        while self.size < op_num:
+            self.size *= 2
+        self.cover = [[] for _ in range(2 * self.size)]
+        self.union = [[] for _ in range(2 * self.size)]
+        self.journal = []
+
+    def _update(self, store: list[list[float]], node: int, head: float, tail: float) -> None:
+        bounds = insert_block(store[node], head, tail)
+        self.journal.append((store, node, store[node], bounds))
+        store[node] = bounds
+
+    def checkpoint(self) -> int:
+        return len(self.journal)
+
+    def undo(self, checkpoint: int) -> list[JournalEntry]:
+        # revert all updates after checkpoint, return them for redo
+        entries = self.journal[checkpoint:]
+        del self.journal[checkpoint:]
+        for store, node, old_bounds, _ in reversed(entries):
+            store[node] = old_bounds
+        return entries
+
+    def redo(self, entries: list[JournalEntry]) -> None:
+        for store, node, _, new_bounds in entries:
+            store[node] = new_bounds
+        self.journal.extend(entries)
+
+    def _full_nodes(self, start: int, width: int) -> list[int]:
+        # canonical nodes exactly covering [start, start + width)
+        full: list[int] = []
+        lo, hi = start + self.size, start + width + self.size
+        while lo < hi:
+            if lo & 1:
+                full.append(lo)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                full.append(hi)
+            lo >>= 1
+            hi >>= 1
+        return full
+
+    def _partial_nodes(self, start: int, width: int) -> list[int]:
+        # every ancestor of a canonical node is an ancestor of one of the range ends
+        return [(start + self.size) >> 1, (start + width - 1 + self.size) >> 1]
+
+    def place(self, start: int, width: int, head: float, tail: float) -> None:
+        # update ancestors first: union of a node contains the unions of its children,
+        # once the block is covered, all further ancestors cover it
+        for node in self._partial_nodes(start, width):
+            while node > 0 and not contains_block(self.union[node], head, tail):
+                self._update(self.union, node, head, tail)
+                node >>= 1
+        for node in self._full_nodes(start, width):
+            self._update(self.cover, node, head, tail)
+            self._update(self.union, node, head, tail)
+
+    def occupied(self, start: int, width: int) -> Iterable[tuple[float, float]]:
+        # allocated blocks of any column in [start, start + width), sorted by start
+        block_lists = [self.union[node] for node in self._full_nodes(start, width)]
+        # both range ends are at the same depth, walk up until they meet
+        node_a, node_b = self._partial_nodes(start, width)
+        while node_a != node_b:
+            block_lists.append(self.cover[node_a])
+            block_lists.append(self.cover[node_b])
+            node_a >>= 1
+            node_b >>= 1
+        while node_a > 0:
+            block_lists.append(self.cover[node_a])
+            node_a >>= 1
+        block_lists = [bounds for bounds in block_lists if len(bounds) != 0]
+        if len(block_lists) == 1:
+            bounds = block_lists[0]
+            return zip(bounds[0::2], bounds[1::2])
+        blocks = []
+        for bounds in block_lists:
+            blocks.extend(zip(bounds[0::2], bounds[1::2]))
+        blocks.sort()
+        return blocks
+
+    def peak(self) -> int:
+        return int(self.union[1][-1]) if len(self.union[1]) > 0 else 0
 
     def __str__(self) -> str:
         result = ""
-        for idx, col in enumerate(self.columns):
+        for idx in range(self.op_num):
             result += f"{idx}: "
-            for block in col:
+            for block in self.occupied(idx, 1):
                 result += f"({(int(block[0]), int(block[1]))})"
             result += "\n"
         return result
 
+# placement orders of the portfolio, rects are placed by ascending key
+PLACEMENT_ORDERS: dict[str, Callable[[Rect], tuple]] = {
+    "area": lambda rect: (-rect.width * rect.height,),
+    "height": lambda rect: (-rect.height, -rect.width),
+    "lifetime": lambda rect: (-rect.width, -rect.height),
+    "start": lambda rect: (rect.start, -rect.height),
+}
+# portfolio members that keep searching until the deadline
+SEARCH_STRATEGIES = ["anneal", "random"]
+# starting temperature of annealing, as a fraction of the peak
+ANNEAL_TEMPERATURE = 0.02
+
+
+# rect id: (is buffer, tensor idx or op idx of the buffer)
+RectId = tuple[bool, float64]
+
+
+def rect_id(rect: Rect) -> RectId:
+    return (rect.is_buffer, rect.idx)
+
+
+def footprint_columns(rect: Rect) -> tuple[int, int]:
+    '''(start, width) of rect in the footprint, which has two columns per op
+    a buffer is only used while its op runs, so it takes the second half of the column before the op
+    and the first half of the op column, the buffers of consecutive ops may share space'''
+    if rect.is_buffer:
+        op_idx = int(rect.idx)
+        start = max(2 * op_idx - 1, 0)
+        return (start, 2 * op_idx + 1 - start)
+    return (2 * rect.start, 2 * rect.width)
+
+
+def get_placement_rects(model: Model) -> list[Rect]:
+    '''op outputs and buffers at their minimum size, all placed in one loop'''
+    return get_rect(model) + get_buf_rect(model)
+
+
+class SearchResult:
+    '''best placement order one portfolio member found'''
+    strategy: str
+    peak_mem: int
+    trials: int
+    order: list[RectId]
+
+    def __init__(self, strategy: str, peak_mem: int, trials: int, order: list[RectId]) -> None:
+        self.strategy = strategy
+        self.peak_mem = peak_mem
+        self.trials = trials
+        self.order = order
+
+
+# rect key: (rect id, height, width, start, alignment groups of the tensor)
+RectKey = tuple[RectId, int, int, int, tuple[tuple[int, frozenset[float64]], ...]]
+
+
+class ScheduleState:
+    # rects in placement order, with their keys and the footprint
+    # checkpoint taken before each placement (plus one after the last)
+    rect_list: list[Rect]
+    keys: list[RectKey]
+    checkpoints: list[int]
+    footprint: MemoryFootprint
+    # (addr, size) of the buffer of every op, grown past the placed minimum
+    buffers: dict[int, tuple[int, int]]
+    peak_mem: int
+
+    def __init__(self, rect_list: list[Rect], keys: list[RectKey], checkpoints: list[int],
+                 footprint: MemoryFootprint, buffers: dict[int, tuple[int, int]], peak_mem: int) -> None:
+        self.rect_list = rect_list
+        self.keys = keys
+        self.checkpoints = checkpoints
+        self.footprint = footprint
+        self.buffers = buffers
+        self.peak_mem = peak_mem
+
+
+class ScheduleTrial:
+    # uncommitted schedule, diverging from the committed one at rect index diverge
+    state: ScheduleState
+    diverge: int
+    redo: list[JournalEntry]
+
+    def __init__(self, state: ScheduleState, diverge: int, redo: list[JournalEntry]) -> None:
+        self.state = state
+        self.diverge = diverge
+        self.redo = redo
+
+
+def get_rect_key(rect: Rect, align_groups: list[tuple[set[float64], int, int]]) -> RectKey:
+    groups = tuple((group[1], frozenset(group[0])) for group in align_groups if not rect.is_buffer and rect.idx in group[0])
+    return (rect_id(rect), rect.height, rect.width, rect.start, groups)
+
+
+def update_align_base(rect: Rect, align_groups: list[tuple[set[float64], int, int]]) -> None:
+    align_group_idx = -1
+    for idx, align_group in enumerate(align_groups):
+        if not rect.is_buffer and rect.idx in align_group[0]:
+            align_group_idx = idx
+    if align_group_idx >= 0 and align_groups[align_group_idx][2] < 0:
+        # need to update align base of the align group
+        align_rects, align_step, _ = align_groups[align_group_idx]
+        align_groups[align_group_idx] = (align_rects, align_step, rect.addr)
+
+
+def live_bytes(model: Model) -> list[int]:
+    '''lowest top any placement can reach at every column
+    live tensors plus the largest buffer, buffers never overlap tensors but may overlap each other.
+    members of an alignment group sit whole steps apart, so among themselves each one takes its size rounded up to the step'''
+    op_num = len(model.operators)
+    align_groups = get_align_groups(model)
+    group_of = {idx: group for group, (members, _, _) in enumerate(align_groups) for idx in members}
+    # bytes starting minus bytes ending at every column
+    tensor_delta = [0] * (op_num + 1)
+    # rounded bytes of each alignment group at the columns it is live
+    group_live: list[dict[int, int]] = [{} for _ in align_groups]
+    for rect in get_rect(model):
+        height = int(rect.height)
+        tensor_delta[rect.start] += height
+        tensor_delta[rect.start + rect.width] -= height
+        group = group_of.get(rect.idx)
+        if group is not None:
+            align_step = int(align_groups[group][1])
+            for column in range(rect.start, rect.start + rect.width):
+                group_live[group][column] = group_live[group].get(column, 0) + -(-height // align_step) * align_step
+    tensor_live = list(accumulate(tensor_delta[:op_num]))
+    for live in group_live:
+        for column, group_bytes in live.items():
+            tensor_live[column] = max(tensor_live[column], group_bytes)
+    buffer_live = [0] * op_num
+    for rect in get_buf_rect(model):
+        for column in range(rect.start, rect.start + rect.width):
+            buffer_live[column] = max(buffer_live[column], int(rect.height))
+    return [tensor + buffer for tensor, buffer in zip(tensor_live, buffer_live)]
+
+
+def lower_bound(model: Model) -> int:
+    '''no placement peaks below the busiest column'''
+    return max(live_bytes(model), default=0)
+
+
+class ScheduleReport:
+    '''peak of a schedule against the liveness lower bound'''
+    peak_mem: int
+    # column where the placement reaches its peak
+    peak_column: int
+    lower_bound: int
+    # busiest column, where the bound comes from
+    bound_column: int
+    # live bytes at the peak column, the rest of the peak there is fragmentation
+    peak_column_live: int
+
+    def __init__(self, peak_mem: int, peak_column: int, lower_bound: int, bound_column: int, peak_column_live: int) -> None:
+        self.peak_mem = peak_mem
+        self.peak_column = peak_column
+        self.lower_bound = lower_bound
+        self.bound_column = bound_column
+        self.peak_column_live = peak_column_live
+
+    @property
+    def gap(self) -> int:
+        return self.peak_mem - self.lower_bound
+
+    def __str__(self) -> str:
+        return f"peak {self.peak_mem} at op {self.peak_column} ({self.peak_column_live} live), " \
+               f"lower bound {self.lower_bound} at op {self.bound_column}, gap {self.gap} ({self.gap / max(self.lower_bound, 1) * 100:.1f}%)"
+
+
+def search_order(model: Model, strategy: str, seed: int, deadline: float, bound: int) -> SearchResult:
+    '''placement order with the lowest peak one portfolio member finds before deadline (a time.time() value)'''
+    rect_list = get_placement_rects(model)
+    if strategy in PLACEMENT_ORDERS:
+        order = [rect_id(rect) for rect in sorted(rect_list, key=PLACEMENT_ORDERS[strategy])]
+        scheduler = MemoryScheduler()
+        scheduler.set_order(order)
+        return SearchResult(strategy, scheduler.schedule(model), 1, order)
+
+    rng = random.Random(seed)
+    current = [rect_id(rect) for rect in sorted(rect_list, key=PLACEMENT_ORDERS["area"])]
+    scheduler = MemoryScheduler()
+    scheduler.set_order(current)
+    current_peak = scheduler.schedule(model)
+    best = SearchResult(strategy, current_peak, 1, current)
+    start = time.time()
+    while len(current) > 1 and best.peak_mem > bound and (now := time.time()) < deadline:
+        if strategy == "random":
+            # best fit in area order, with every area scaled by noise
+            noise = {rect_id(rect): rng.uniform(0.5, 1.5) for rect in rect_list}
+            order = [rect_id(rect) for rect in sorted(rect_list, key=lambda rect: -rect.width * rect.height * noise[rect_id(rect)])]
+        else:
+            # move one rect, the rects before the move keep their places in the committed schedule
+            (i, j) = sorted(rng.sample(range(len(current)), 2))
+            order = current.copy()
+            if rng.random() < 0.5:
+                order.insert(i, order.pop(j))
+            else:
+                order.insert(j, order.pop(i))
+        scheduler.set_order(order)
+        peak_mem = scheduler.reschedule(model)
+        best.trials += 1
+        temperature = ANNEAL_TEMPERATURE * best.peak_mem * (deadline - now) / (deadline - start)
+        if strategy == "random":
+            accept = peak_mem < current_peak
+        else:
+            accept = peak_mem <= current_peak or rng.random() < math.exp((current_peak - peak_mem) / max(temperature, 1e-9))
+        if accept:
+            scheduler.commit()
+            (current, current_peak) = (order, peak_mem)
+            if peak_mem < best.peak_mem:
+                (best.peak_mem, best.order) = (peak_mem, order)
+        else:
+            scheduler.rollback(model)
+    return best
+
+
+def format_search(results: list[SearchResult], bound: int) -> str:
+    header = ("strategy", "trials", "peak_sram")
+    rows = [header] + [(result.strategy, str(result.trials), str(result.peak_mem)) for result in results]
+    widths = [max(len(row[col]) for row in rows) for col in range(len(header))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows]
+    best = min(result.peak_mem for result in results)
+    lines.append(f"lower bound {bound}, gap {best - bound} ({(best - bound) / max(bound, 1) * 100:.1f}%)")
+    return "\n".join(lines)
+
+
 class MemoryScheduler:
+    committed: ScheduleState | None = None
+    trial: ScheduleTrial | None = None
+    # rank of every rect in placement order, None for the default order by area
+    placement: dict[RectId, int] | None = None
+    # results of the last portfolio search
+    search_results: list[SearchResult]
+    lower_bound: int = 0
+
+    def __init__(self) -> None:
+        self.search_results = []
+
+    def set_order(self, order: list[RectId] | None) -> None:
+        '''place rects in the given order, rects not listed go last by area'''
+        self.placement = None if order is None else {idx: rank for rank, idx in enumerate(order)}
+
     def place_rect(self, rect: Rect, footprint: MemoryFootprint):
-        takeup_columns = [rect.start + col for col in range(rect.width)]
-        addr_head = rect.addr
-        addr_tail = addr_head + rect.height
-        # mark memory block as taken
-        takeup_columns = [rect.start + col for col in range(rect.width)]
-        for col_idx in takeup_columns:
-            col = footprint.columns[col_idx]
-            new_col_head = [
-                block for block in col if block[1] <= addr_head]
-            new_col_tail = [
-                block for block in col if block[0] >= addr_tail]
-            new_block = (addr_head, addr_tail)
-
-            if len(new_col_head) != 0 and new_col_head[-1][1] == addr_head:
-                prev_block = new_col_head.pop(-1)
-                new_block = (prev_block[0], addr_tail)
-            if len(new_col_tail) != 0 and new_col_tail[0][0] == addr_tail:
-                next_block = new_col_tail.pop(0)
-                new_block = (new_block[0], next_block[1])
-
-            new_col = new_col_head
-            new_col.append(new_block)
-            new_col.extend(new_col_tail)
-            footprint.columns[col_idx] = new_col
+        (start, width) = footprint_columns(rect)
+        footprint.place(start, width, rect.addr, rect.addr + rect.height)
     
     def find_slots(self, rect: Rect, footprint: MemoryFootprint) -> Blocks:
-        takeup_columns = [rect.start + col for col in range(rect.width)]
-        # find all free blocks (slots)
-        total_slots: Blocks = [(0, float('inf'))]
-        for col_idx in takeup_columns:
-            current_slots: Blocks = []
-            col = footprint.columns[col_idx]
-            last_end = 0
-            for start, end in col:
-                free_size = start - last_end
-                if free_size >= rect.height:
-                    current_slots.append((last_end, start))
-                last_end = end
-            current_slots.append((last_end, float('inf')))
-            # print(f"col {col_idx} slots: {current_slots}")
-            total_slots = inter_slots(total_slots, current_slots)
-            # print(f"total slots after inter: {total_slots}")
-        total_slots = list(
-            filter(lambda slot: slot[1]-slot[0] >= rect.height, total_slots))
-        return total_slots
-
-    def schedule(self, model: Model) -> int:
-        rect_list = get_rect(model)
-        rect_list.sort(key=lambda rect: rect.width * rect.height, reverse=True)
-        footprint = MemoryFootprint(len(model.operators))
-        align_groups = get_align_groups(model)
-        # fit op activations
-        for rect in rect_list:
-            # TODO: Add cache feature for optimization
-            total_slots = self.find_slots(rect, footprint)
-            
-            # check if there is alignment requirement
-            align_group_idx = -1
-            for idx, align_group in enumerate(align_groups):
-                if rect.idx in align_group[0]:
-                    align_base = align_group[2]
-                    align_step = align_group[1]
-                    align_group_idx = idx
-                    if align_base >= 0:
-                        # there is an alignment base, pad all slots
-                        for slot_idx, slot in enumerate(total_slots):
-                            base_diff = abs(slot[0] - align_base)
-                            pad_size = align_step - base_diff % align_step
-                            pad_size = 0 if pad_size == align_step else pad_size
-                            total_slots[slot_idx] = (slot[0] + pad_size, slot[1])
-                        # remove slots smaller than rect after alignment
-                        total_slots = list(
-                            filter(lambda slot: slot[1]-slot[0] >= rect.height, total_slots))
-            total_slots.sort(key=lambda slot: slot[1]-slot[0])
-            rect.addr = int(total_slots[0][0])
-            self.place_rect(rect, footprint)
-            model.tensors[rect.idx].addr = rect.addr
-            if align_group_idx >= 0 and align_groups[align_group_idx][2] < 0:
-                # need to update align base of the align group
-                align_group = align_groups[align_group_idx]
+        (start, width) = footprint_columns(rect)
+        return free_slots(footprint.occupied(start, width), rect.height)
+
+    def fit_rect(self, rect: Rect, footprint: MemoryFootprint, align_groups: list[tuple[set[float64], int, int]]) -> None:
+        total_slots = self.find_slots(rect, footprint)
+        
+        # check if there is alignment requirement
+        for align_group in align_groups:
+            if not rect.is_buffer and rect.idx in align_group[0]:
+                align_base = align_group[2]
                 align_step = align_group[1]
-                align_rects = align_group[0]
-                align_groups[align_group_idx] = (align_rects, align_step, rect.addr)
-                
-        # find peak memory usage
-        peak_mem = int(max(column[-1][1] if len(column) > 0
-                       else 0 for column in footprint.columns))
-        # fit minimum buffer for ops
-        buf_rect_list = get_buf_rect(model)
-        for buf_rect in buf_rect_list:
-            op = model.operators[int(buf_rect.idx)]
-            assert isinstance(op, Conv2D) or isinstance(op, DepthConv2D), "only (depthwise) conv2d requires buffer"
-            
-            total_slots = self.find_slots(buf_rect, footprint)
-            total_slots.sort(key=lambda slot: slot[1]-slot[0])
-            # buffers do not interfere with each other
-            # thus no need to really place them on the footprint
-            # only the address and peak memory matter
-            if total_slots[0][0] + buf_rect.height > peak_mem:
-                # peak mem is raised due to buffer requirement
-                peak_mem = int(total_slots[0][0] + buf_rect.height)
-                buf_rect.addr = int(total_slots[0][0])
-                op.buffer_addr = buf_rect.addr
-                op.buffer_size = buf_rect.height
-            else:
-                # find largest slot that does not raise peak mem
-                total_slots.sort(key=lambda slot: slot[1]-slot[0] if slot[1]!=float("inf") else peak_mem - slot[0], reverse=True)
-                slot = total_slots[0]
-                buf_rect.addr = int(slot[0])
-                op.buffer_addr = buf_rect.addr
-                op.buffer_size = int(slot[1]-slot[0] if slot[1]!=float("inf") else peak_mem - slot[0])
+                if align_base >= 0:
+                    # there is an alignment base, pad all slots
+                    for slot_idx, slot in enumerate(total_slots):
+                        base_diff = abs(slot[0] - align_base)
+                        pad_size = align_step - base_diff % align_step
+                        pad_size = 0 if pad_size == align_step else pad_size
+                        total_slots[slot_idx] = (slot[0] + pad_size, slot[1])
+                    # remove slots smaller than rect after alignment
+                    total_slots = list(
+                        filter(lambda slot: slot[1]-slot[0] >= rect.height, total_slots))
+        total_slots.sort(key=lambda slot: slot[1]-slot[0])
+        rect.addr = int(total_slots[0][0])
+        self.place_rect(rect, footprint)
+        update_align_base(rect, align_groups)
+
+    def grow_buffers(self, model: Model, rect_list: list[Rect], footprint: MemoryFootprint, peak_mem: int) -> dict[int, tuple[int, int]]:
+        '''buffers are placed at their minimum size, then each one grows into the free space right above it,
+        up to its preferred size and without raising the peak'''
+        buffers: dict[int, tuple[int, int]] = {}
+        for rect in rect_list:
+            if not rect.is_buffer:
+                continue
+            op = model.operators[int(rect.idx)]
+            assert has_buffer(op), "only (depthwise) conv2d, fused blocks and patch stages require buffer"
+            (start, width) = footprint_columns(rect)
+            end = rect.addr + rect.height
+            # free space of the buffer columns starting right at the buffer end
+            slack = [slot[1] for slot in free_slots(footprint.occupied(start, width), 0) if slot[0] == end]
+            ceiling = int(min(slack[0], peak_mem)) if len(slack) > 0 else end
+            op.buffer_addr = rect.addr
+            op.buffer_size = max(rect.height, min(preferred_buffer_size(op, model), ceiling - rect.addr))
+            buffers[op.idx] = (op.buffer_addr, op.buffer_size)
+        return buffers
+
+    def schedule(self, model: Model, time_budget: float | None = None, jobs: int | None = None) -> int:
+        '''schedule from scratch and commit the result
+        time_budget: seconds to search placement orders with a portfolio of strategies in jobs worker processes,
+        the best order found is kept for later reschedules'''
+        if time_budget is not None:
+            self.search(model, time_budget, jobs)
+        self.committed = None
+        self.trial = None
+        peak_mem = self.reschedule(model)
+        self.commit()
         return peak_mem
 
+    def search(self, model: Model, time_budget: float, jobs: int | None = None) -> None:
+        '''run the portfolio: every fixed order once, annealing over the order and randomized best fit until the deadline'''
+        self.lower_bound = lower_bound(model)
+        deadline = time.time() + time_budget
+        workers = jobs if jobs is not None else os.cpu_count() or 1
+        tasks = [(strategy, 0) for strategy in PLACEMENT_ORDERS]
+        tasks += [(SEARCH_STRATEGIES[seed % len(SEARCH_STRATEGIES)], seed) for seed in range(max(workers, len(SEARCH_STRATEGIES)))]
+        if workers == 1:
+            # members run one after another in this process, each until its share of the budget left,
+            # the fixed orders take one placement and hand the rest of their share on to the searches
+            self.search_results = []
+            for member, (strategy, seed) in enumerate(tasks):
+                member_deadline = time.time() + (deadline - time.time()) / (len(tasks) - member)
+                self.search_results.append(search_order(model, strategy, seed, member_deadline, self.lower_bound))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(search_order, model, strategy, seed, deadline, self.lower_bound) for strategy, seed in tasks]
+                self.search_results = [future.result() for future in futures]
+        # ties go to the earlier member, the plain area order first
+        best = min(self.search_results, key=lambda result: result.peak_mem)
+        self.set_order(best.order)
 
-def inter_slots(slots1: Blocks, slots2: Blocks) -> Blocks:
-    slots2_skip = 0
-    inter_slots = []
-    for start1, end1 in slots1:
-        for start2, end2 in slots2[slots2_skip:]:
-            if end1 <= start2:
-                break
-            if end2 <= start1:
-                slots2_skip += 1
-                continue
-            # slot1 and slot2 has intersection
-            start, end = max(start1, start2), min(end1, end2)
-            inter_slots.append((start, end))
-    return inter_slots
+    def report(self, model: Model) -> ScheduleReport:
+        '''gap of the committed schedule to the lower bound'''
+        assert self.committed is not None and self.trial is None, "report needs a committed schedule and no open trial"
+        committed = self.committed
+        live = live_bytes(model)
+        top = [int(max((end for _, end in committed.footprint.occupied(2 * column, 2)), default=0)) for column in range(len(live))]
+        for op_idx, (buffer_addr, buffer_size) in committed.buffers.items():
+            # same columns as get_buf_rect
+            for column in range(max(op_idx - 1, 0), op_idx + 1):
+                top[column] = max(top[column], buffer_addr + buffer_size)
+        peak_column = max(range(len(top)), key=lambda column: (top[column], -column))
+        bound_column = max(range(len(live)), key=lambda column: (live[column], -column))
+        return ScheduleReport(committed.peak_mem, peak_column, live[bound_column], bound_column, live[peak_column])
+
+    def reschedule(self, model: Model) -> int:
+        '''schedule incrementally against the committed schedule, result must be committed or rolled back'''
+        assert self.trial is None, "previous trial is neither committed nor rolled back"
+        rect_list = get_placement_rects(model)
+        if self.placement is None:
+            rect_list.sort(key=lambda rect: rect.width * rect.height, reverse=True)
+        else:
+            placement = self.placement
+            rect_list.sort(key=lambda rect: (placement.get(rect_id(rect), len(placement)), -rect.width * rect.height))
+        align_groups = get_align_groups(model)
+        keys = [get_rect_key(rect, align_groups) for rect in rect_list]
+
+        # placement is greedy in rect order, so all rects before the first changed one
+        # keep their addresses, only the changed rect and the ones after it are re-placed
+        committed = self.committed
+        if committed is None or committed.footprint.op_num != 2 * len(model.operators):
+            footprint = MemoryFootprint(2 * len(model.operators))
+            diverge = 0
+            checkpoints = [footprint.checkpoint()]
+            redo = []
+        else:
+            footprint = committed.footprint
+            diverge = 0
+            while diverge < min(len(keys), len(committed.keys)) and keys[diverge] == committed.keys[diverge]:
+                diverge += 1
+            checkpoints = committed.checkpoints[:diverge + 1]
+            redo = footprint.undo(checkpoints[-1])
+            for rect, committed_rect in zip(rect_list[:diverge], committed.rect_list):
+                rect.addr = committed_rect.addr
+                update_align_base(rect, align_groups)
+
+        # fit op activations and buffers
+        for rect in rect_list[diverge:]:
+            self.fit_rect(rect, footprint, align_groups)
+            if not rect.is_buffer:
+                model.tensors[rect.idx].addr = rect.addr
+            checkpoints.append(footprint.checkpoint())
+
+        peak_mem = footprint.peak()
+        buffers = self.grow_buffers(model, rect_list, footprint, peak_mem)
+        state = ScheduleState(rect_list, keys, checkpoints, footprint, buffers, peak_mem)
+        self.trial = ScheduleTrial(state, diverge, redo)
+        return peak_mem
+
+    def commit(self) -> None:
+        assert self.trial is not None, "no trial to commit"
+        self.committed = self.trial.state
+        self.trial = None
+
+    def rollback(self, model: Model) -> None:
+        assert self.trial is not None, "no trial to roll back"
+        trial = self.trial
+        committed = self.committed
+        self.trial = None
+        if committed is None:
+            return
+        # restore footprint and addresses of the committed schedule
+        if trial.state.footprint is committed.footprint:
+            committed.footprint.undo(trial.state.checkpoints[trial.diverge])
+            committed.footprint.redo(trial.redo)
+        for rect in committed.rect_list[trial.diverge:]:
+            if not rect.is_buffer:
+                model.tensors[rect.idx].addr = rect.addr
+        for op_idx, (buffer_addr, buffer_size) in committed.buffers.items():
+            op = model.operators[op_idx]
+            assert has_buffer(op)
+            op.buffer_addr = buffer_addr
+            op.buffer_size = buffer_size
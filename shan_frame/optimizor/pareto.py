@@ -0,0 +1,64 @@
+from ..ir import Model
+from ..ir.decisions import Decisions
+from ..ir.operator import activation_inputs
+
+
+class ParetoPoint:
+    peak_mem: int
+    # estimated by the latency model of the optimizer
+    cycles: float
+    # weights and biases
+    flash_size: int
+    decisions: Decisions
+
+    def __init__(self, peak_mem: int, cycles: float, flash_size: int, decisions: Decisions) -> None:
+        self.peak_mem = peak_mem
+        self.cycles = cycles
+        self.flash_size = flash_size
+        self.decisions = decisions
+
+    def cost(self) -> tuple[int, float, int]:
+        return (self.peak_mem, self.cycles, self.flash_size)
+
+
+def const_bytes(model: Model) -> int:
+    '''bytes of the weights and biases the ops read from flash'''
+    size = 0
+    for op in model.operators.values():
+        activations = activation_inputs(op)
+        for idx in op.input_idx_list:
+            if idx not in activations:
+                size += model.tensors[idx].data.nbytes
+    return size
+
+
+def pareto_front(points: list[ParetoPoint]) -> list[ParetoPoint]:
+    '''points no other point is as good as in every cost and better in one, by peak sram, the first of equal ones'''
+    front: list[ParetoPoint] = []
+    for point in sorted(points, key=lambda point: point.cost()):
+        if all(any(a < b for a, b in zip(point.cost(), other.cost())) for other in front):
+            front.append(point)
+    return front
+
+
+def best_point(points: list[ParetoPoint], sram_size: int) -> ParetoPoint | None:
+    '''fastest point within sram_size, fewer flash bytes on a tie, None if nothing fits'''
+    candidates = [point for point in points if point.peak_mem <= sram_size]
+    if len(candidates) == 0:
+        return None
+    return min(candidates, key=lambda point: (point.cycles, point.flash_size, point.peak_mem))
+
+
+def format_pareto(points: list[ParetoPoint]) -> str:
+    header = ("peak_sram", "cycles", "flash", "no_overlap", "prepad")
+    rows = [header]
+    for point in points:
+        rows.append((
+            str(point.peak_mem),
+            f"{point.cycles:.0f}",
+            str(point.flash_size),
+            str(sum(not io_overlap for io_overlap in point.decisions.io_overlap.values())),
+            str(len(point.decisions.prepad)),
+        ))
+    widths = [max(len(row[col]) for row in rows) for col in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
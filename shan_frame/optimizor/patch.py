@@ -0,0 +1,194 @@
+from numpy import float64
+from ..ir import Model
+from ..ir.operator import Conv2D, DepthConv2D, Add, InvertedResidual, PatchStage, activation_inputs
+
+# (y, x, h, w) of a tensor
+Region = tuple[int, int, int, int]
+
+# patch grids tried for every split point
+PATCH_GRIDS: list[tuple[int, int]] = [(2, 2), (3, 3), (4, 4)]
+
+
+class PatchPlan:
+    '''ops [0, split) run patch by patch over a grid of the output of op split - 1
+    split 0 is the plain layer by layer execution'''
+    split: int
+    grid: tuple[int, int]
+    peak_mem: int
+    # whole model, halos included
+    macs: int
+    extra_macs: int
+
+    def __init__(self, split: int, grid: tuple[int, int], peak_mem: int, macs: int, extra_macs: int) -> None:
+        self.split = split
+        self.grid = grid
+        self.peak_mem = peak_mem
+        self.macs = macs
+        self.extra_macs = extra_macs
+
+    @property
+    def mac_overhead(self) -> float:
+        return self.extra_macs / (self.macs - self.extra_macs)
+
+
+def flatten_ops(ops: list) -> list[Conv2D | DepthConv2D | Add] | None:
+    '''sub ops a patch stage can run, None if any op is not supported'''
+    flat: list[Conv2D | DepthConv2D | Add] = []
+    for op in ops:
+        match op:
+            case Conv2D() | DepthConv2D() | Add():
+                flat.append(op)
+            case InvertedResidual():
+                flat.extend(op.sub_ops())
+            case _:
+                return None
+    return flat
+
+
+def is_closed_prefix(model: Model, split: int) -> bool:
+    '''ops [0, split) only read the model input and their own outputs,
+    and only the output of the last of them is read afterwards'''
+    ops = [model.operators[idx] for idx in range(split)]
+    model_input = ops[0].input_idx_list[0]
+    produced = {op.output_idx for op in ops}
+    for op in ops:
+        if any(idx != model_input and idx not in produced for idx in activation_inputs(op)):
+            return False
+    for idx in produced - {ops[-1].output_idx} | {model_input}:
+        if any(dst_op >= split for dst_op in model.tensors[idx].dst_op):
+            return False
+    return len(model.tensors[ops[-1].output_idx].dst_op) > 0
+
+
+def patch_splits(model: Model, min_scale: int = 8) -> list[int]:
+    '''split points of the high resolution first stage: closed prefixes of supported ops
+    whose output is at least 1/min_scale of the model input height'''
+    model_input = model.tensors[model.operators[0].input_idx_list[0]]
+    splits = []
+    for split in range(1, len(model.operators)):
+        if flatten_ops([model.operators[idx] for idx in range(split)]) is None:
+            break
+        output = model.tensors[model.operators[split - 1].output_idx]
+        if output.dim_h * min_scale < model_input.dim_h:
+            break
+        if is_closed_prefix(model, split):
+            splits.append(split)
+    return splits
+
+
+def split_range(size: int, parts: int) -> list[tuple[int, int]]:
+    # (start, length) of near equal parts
+    return [(size * i // parts, size * (i + 1) // parts - size * i // parts) for i in range(parts)]
+
+
+def input_region(model: Model, op: Conv2D | DepthConv2D | Add, input_idx: float64, region: Region) -> Region:
+    '''part of the input op reads to compute region of its output, padding excluded'''
+    if isinstance(op, Add):
+        return region
+    (y, x, h, w) = region
+    input = model.tensors[input_idx]
+    weight = model.tensors[op.weight_idx]
+    y0 = max(0, y * op.stride_h - op.pad_h)
+    y1 = min(input.dim_h, (y + h - 1) * op.stride_h - op.pad_h + weight.dim_h)
+    x0 = max(0, x * op.stride_w - op.pad_w)
+    x1 = min(input.dim_w, (x + w - 1) * op.stride_w - op.pad_w + weight.dim_w)
+    return (y0, x0, y1 - y0, x1 - x0)
+
+
+def union(a: Region, b: Region) -> Region:
+    y0, x0 = min(a[0], b[0]), min(a[1], b[1])
+    y1, x1 = max(a[0] + a[2], b[0] + b[2]), max(a[1] + a[3], b[1] + b[3])
+    return (y0, x0, y1 - y0, x1 - x0)
+
+
+def plan_regions(model: Model, ops: list[Conv2D | DepthConv2D | Add], grid: tuple[int, int]) -> list[dict[float64, Region]]:
+    '''regions of every stage tensor each patch needs, walking receptive fields back from the output patch'''
+    output = model.tensors[ops[-1].output_idx]
+    regions = []
+    for (y, h) in split_range(output.dim_h, grid[0]):
+        for (x, w) in split_range(output.dim_w, grid[1]):
+            need: dict[float64, Region] = {ops[-1].output_idx: (y, x, h, w)}
+            # consumers come after producers, so every region is complete before its producer is reached
+            for op in reversed(ops):
+                for idx in activation_inputs(op):
+                    region = input_region(model, op, idx, need[op.output_idx])
+                    need[idx] = union(need[idx], region) if idx in need else region
+            regions.append(need)
+    return regions
+
+
+def allocate_tiles(model: Model, ops: list[Conv2D | DepthConv2D | Add], regions: list[dict[float64, Region]]) -> tuple[dict[float64, int], int]:
+    '''first fit offsets of the intermediate tiles in the stage buffer, and the buffer size'''
+    last_use: dict[float64, int] = {}
+    for pos, op in enumerate(ops):
+        for idx in activation_inputs(op):
+            last_use[idx] = pos
+    offsets: dict[float64, int] = {}
+    tile_bytes: dict[float64, int] = {}
+    size = 0
+    for pos, op in enumerate(ops[:-1]):
+        idx = op.output_idx
+        tile_bytes[idx] = max(region[idx][2] * region[idx][3] for region in regions) * model.tensors[idx].dim_c
+        # tiles still read by this op or later ones
+        live = sorted((offsets[other], offsets[other] + tile_bytes[other]) for other in offsets if last_use[other] >= pos)
+        offset = 0
+        for (start, end) in live:
+            if offset + tile_bytes[idx] <= start:
+                break
+            offset = max(offset, end)
+        offsets[idx] = offset
+        size = max(size, offset + tile_bytes[idx])
+    return (offsets, size)
+
+
+def make_patch_stage(model: Model, split: int, grid: tuple[int, int]) -> PatchStage:
+    ops = flatten_ops([model.operators[idx] for idx in range(split)])
+    assert ops is not None, f"ops before {split} can not run patch by patch"
+    regions = plan_regions(model, ops, grid)
+    (tile_offsets, tile_size) = allocate_tiles(model, ops, regions)
+    macs = 0
+    for op in ops:
+        output = model.tensors[op.output_idx]
+        area = sum(int(region[op.output_idx][2] * region[op.output_idx][3]) for region in regions)
+        # mac count is proportional to the output area
+        macs += int(op.mac_count(model)) * area // int(output.dim_h * output.dim_w)
+    return PatchStage(ops, grid, regions, tile_offsets, tile_size, macs)
+
+
+def apply_patch_stage(model: Model, stage: PatchStage, split: int):
+    '''replace ops [0, split) with stage'''
+    for op_idx in range(split):
+        op = model.operators.pop(op_idx)
+        for input_idx in op.input_idx_list:
+            model.tensors[input_idx].dst_op.discard(op_idx)
+    for sub_op in stage.ops[:-1]:
+        # intermediate tensors stay in the model for their shape and quantization only
+        model.tensors[sub_op.output_idx].src_op = -1
+    stage.idx = 0
+    model.operators[stage.idx] = stage
+    for input_idx in stage.input_idx_list:
+        model.tensors[input_idx].dst_op.add(stage.idx)
+    model.tensors[stage.output_idx].src_op = stage.idx
+    model.trim_operator()
+
+
+def best_patch_plan(plans: list[PatchPlan], max_overhead: float) -> PatchPlan:
+    '''lowest peak sram within max_overhead extra macs, fewer macs on a tie'''
+    candidates = [plan for plan in plans if plan.mac_overhead <= max_overhead]
+    return min(candidates, key=lambda plan: (plan.peak_mem, plan.macs))
+
+
+def format_patch_plans(plans: list[PatchPlan]) -> str:
+    header = ("split", "grid", "peak_sram", "macs", "extra_macs", "overhead")
+    rows = [header]
+    for plan in plans:
+        rows.append((
+            str(plan.split),
+            f"{plan.grid[0]}x{plan.grid[1]}",
+            str(plan.peak_mem),
+            str(plan.macs),
+            str(plan.extra_macs),
+            f"{plan.mac_overhead * 100:.1f}%",
+        ))
+    widths = [max(len(row[col]) for row in rows) for col in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
@@ -0,0 +1,91 @@
+from ..ir import Model
+from ..ir.operator import Conv2D, DepthConv2D, activation_inputs, has_buffer
+
+
+class OpGraph:
+    '''ops of a trimmed model as bit sets, op i is bit i'''
+    # ops whose outputs each op reads
+    deps: list[int]
+    # ops reading the output of each op
+    consumers: list[int]
+    output_size: list[int]
+    buffer_size: list[int]
+    # op whose input ends where its output starts, see get_rect
+    overlapped: list[bool]
+
+    def __init__(self, model: Model) -> None:
+        ops = [model.operators[idx] for idx in sorted(model.operators.keys())]
+        self.deps = [0] * len(ops)
+        self.consumers = [0] * len(ops)
+        for op in ops:
+            for input_idx in activation_inputs(op):
+                src_op = model.tensors[input_idx].src_op
+                if src_op >= 0:
+                    self.deps[op.idx] |= 1 << src_op
+                    self.consumers[src_op] |= 1 << op.idx
+        self.output_size = [int(model.tensors[op.output_idx].mem_size()) for op in ops]
+        self.buffer_size = [int(op.min_buffer_size(model)) if has_buffer(op) else 0 for op in ops]
+        self.overlapped = [(isinstance(op, Conv2D) or isinstance(op, DepthConv2D)) and op.io_overlap for op in ops]
+
+
+class OrderState:
+    peak: int
+    # live bytes summed over the steps so far
+    area: int
+    # bytes of the executed op outputs still to be read
+    live: int
+    order: tuple[int, ...]
+
+    def __init__(self, peak: int, area: int, live: int, order: tuple[int, ...]) -> None:
+        self.peak = peak
+        self.area = area
+        self.live = live
+        self.order = order
+
+
+def step(graph: OpGraph, executed: int, state: OrderState, op: int) -> OrderState:
+    '''state after running op next, memory at the step counts like the columns of get_rect'''
+    remaining = ~(executed | 1 << op)
+    mem = state.live + graph.output_size[op] + graph.buffer_size[op]
+    live = state.live + (graph.output_size[op] if graph.consumers[op] != 0 else 0)
+    deps = graph.deps[op]
+    while deps != 0:
+        src_op = (deps & -deps).bit_length() - 1
+        deps &= deps - 1
+        if graph.consumers[src_op] & remaining == 0:
+            # last read of the input, an overlapped op already writes over it
+            live -= graph.output_size[src_op]
+            if graph.overlapped[op]:
+                mem -= graph.output_size[src_op]
+    return OrderState(max(state.peak, mem), state.area + mem, live, state.order + (op,))
+
+
+def best_order(model: Model, prefer_area: bool = False, max_states: int = 4096) -> list[int]:
+    '''topological order of the ops with the lowest peak of live bytes
+    dynamic programming over the sets of executed ops, exact while every step has at most max_states sets,
+    a beam of the best max_states beyond. ties go to the lower summed live bytes if prefer_area,
+    then to the order closest to the current one'''
+    graph = OpGraph(model)
+    op_num = len(graph.deps)
+
+    def key(state: OrderState) -> tuple:
+        return (state.peak, state.area, state.order) if prefer_area else (state.peak, state.order)
+
+    states: dict[int, OrderState] = {0: OrderState(0, 0, 0, ())}
+    for _ in range(op_num):
+        next_states: dict[int, OrderState] = {}
+        for executed, state in states.items():
+            for op in range(op_num):
+                if executed >> op & 1 or graph.deps[op] & ~executed != 0:
+                    continue
+                new_state = step(graph, executed, state, op)
+                new_executed = executed | 1 << op
+                current = next_states.get(new_executed)
+                if current is None or key(new_state) < key(current):
+                    next_states[new_executed] = new_state
+        if len(next_states) > max_states:
+            kept = sorted(next_states.items(), key=lambda item: key(item[1]))[:max_states]
+            next_states = dict(kept)
+        states = next_states
+    (state,) = states.values()
+    return list(state.order)
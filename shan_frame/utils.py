@@ -1,12 +1,34 @@
 import math
+import mmap
 from typing import Any, Iterator
 import numpy as np
 from tflite import Model as TFliteModel
 from tflite import Operator as TFliteOP
+from tflite import SubGraph, OperatorCode
 from tflite import TensorType, BuiltinOperator
 
 from .ir import DataLayout, Quantization, Tensor as IRTensor, Model as IRModel, OperatorType
-from .ir.operator import Conv2D, DepthConv2D
+from .ir.operator import Conv2D, DepthConv2D, has_buffer
+
+def _build_str_map(obj) -> dict[int, str]:
+    ret = {}
+    for field_name in dir(obj):
+        if not field_name.startswith("_"):
+            field_value = getattr(obj, field_name)
+            if isinstance(field_value, int):
+                ret[field_value] = field_name
+    return ret
+
+
+# BuiltinOperator code -> op name
+BUILTIN_OP_NAMES: dict[int, str] = _build_str_map(BuiltinOperator())
+
+
+def _op_code_name(op_code: OperatorCode) -> str:
+    # DeprecatedBuiltinCode saturates at 127, extended ops only live in BuiltinCode
+    op_code_id = max(op_code.DeprecatedBuiltinCode(), op_code.BuiltinCode())
+    return BUILTIN_OP_NAMES.get(op_code_id, f"UNKNOWN({op_code_id})")
+
 
 class TFLiteTensorWrpper:
     def __init__(self, tensor_idx, tensor, buffer, qnn_params):
@@ -16,86 +38,118 @@ class TFLiteTensorWrpper:
         self.qnn_params = qnn_params
 
 
-def get_input_tensors(op: TFliteOP, model: TFliteModel) -> list[IRTensor]:
+class TFLiteLoader:
+    model_path: str
+    tflite_model: TFliteModel
+    subgraph: SubGraph
+    # op name by opcode idx
+    op_codes: list[str]
+    # decoded tensors by tflite tensor idx
+    tensors: dict[int, IRTensor]
+
+    def __init__(self, model_path: str) -> None:
+        self.model_path = model_path
+        # weights are views into the mapping, so the file is never copied into memory
+        with open(model_path, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.tflite_model = TFliteModel.GetRootAs(buf, 0)
+        subgraph = self.tflite_model.Subgraphs(0)
+        if subgraph is None:
+            raise RuntimeError("subgraph 0 not exist")
+        self.subgraph = subgraph
+        self.op_codes = []
+        for i in range(self.tflite_model.OperatorCodesLength()):
+            op_code = self.tflite_model.OperatorCodes(i)
+            assert op_code is not None, f"No op code found at {i}"
+            self.op_codes.append(_op_code_name(op_code))
+        self.tensors = {}
+
+    def op_code_str(self, op: TFliteOP) -> str:
+        return self.op_codes[op.OpcodeIndex()]
+
+    def get_tensor(self, idx: np.float64) -> IRTensor:
+        tensor = self.tensors.get(int(idx))
+        if tensor is None:
+            tensor = _decode_tensor(idx, self.subgraph, self.tflite_model)
+            self.tensors[int(idx)] = tensor
+        return tensor
+
+
+def get_input_tensors(op: TFliteOP, loader: TFLiteLoader) -> list[IRTensor]:
     inputs = op.InputsAsNumpy()
     assert isinstance(inputs, np.ndarray), f"no input found in {op}"
-    return _get_tensors(iter(inputs), model)
+    return [loader.get_tensor(idx) for idx in inputs]
 
 
-def get_output_tensors(op: TFliteOP, model: TFliteModel) -> list[IRTensor]:
+def get_output_tensors(op: TFliteOP, loader: TFLiteLoader) -> list[IRTensor]:
     inputs = op.OutputsAsNumpy()
     assert isinstance(inputs, np.ndarray), f"no output found in {op}"
-    return _get_tensors(iter(inputs), model)
-
-
-def _get_tensors(tensor_index_list: Iterator[np.float64], model: TFliteModel) -> list[IRTensor]:
-    ret = []
-    subgraph = model.Subgraphs(0)
-    assert subgraph is not None, "No subgraph found"
-    for idx in tensor_index_list:
-        ir_tensor = IRTensor()
-        ir_tensor.tflite_tensor_idx = idx
-        tensor = subgraph.Tensors(idx)
-
-        assert tensor is not None, f"Tensor at idx {idx} found"
-        # determine shape
-        tensor_shape = tensor.ShapeAsNumpy()
-        assert isinstance(
-            tensor_shape, np.ndarray), f"Tensor at idx {idx} has no shape"
-        match tensor_shape.size:
-            case 4:
-                ir_tensor.dim_n, ir_tensor.dim_h, ir_tensor.dim_w, ir_tensor.dim_c = tensor_shape
-            case 2:
-                ir_tensor.dim_n, ir_tensor.dim_c = 1, 1
-                ir_tensor.dim_h, ir_tensor.dim_w = tensor_shape
-            case 1:
-                ir_tensor.dim_n, ir_tensor.dim_h, ir_tensor.dim_w = 1, 1, 1
-                ir_tensor.dim_c = tensor_shape[0]
-            case _:
-                raise RuntimeError(
-                    f"unsupported tensor shape dimension: {tensor_shape.size}")
-
-        # determine data
-        buffer_idx = tensor.Buffer()
-        buffer = model.Buffers(buffer_idx)
-        match tensor.Type():
-            case TensorType.INT8:
-                np_type = np.int8
-            case TensorType.INT32:
-                np_type = np.int32
-            case TensorType.FLOAT32:
-                np_type = np.float32
-            case _:
-                raise NotImplementedError(f"unsupported tensor type {tensor.Type()}")        
-        data = np.ndarray([], np_type)
-        if buffer is not None:
-            data_tmp = buffer.DataAsNumpy()
-            if isinstance(data_tmp, np.ndarray):
-                data = np.frombuffer(data_tmp, dtype=np_type)
-        ir_tensor.data = data
-
-        # determine quantization
-        tflite_qparams = tensor.Quantization()
-        if tflite_qparams is None:
-            # TODO: support floating-point operators with no quantization
-            raise NotImplementedError("Quantization parameters not found")
-        scale = tflite_qparams.ScaleAsNumpy()
-        zero_point = tflite_qparams.ZeroPointAsNumpy()
-        if isinstance(scale, np.ndarray) and isinstance(zero_point, np.ndarray):
-            if scale.size != 1 and zero_point.size != 1:
-                ir_tensor.quant_type = Quantization.PER_CHANNEL
-            elif scale.size == 1 and zero_point.size == 1:
-                ir_tensor.quant_type = Quantization.PER_TENSOR
-            else:
-                raise NotImplementedError("Unsupported quantization setup")
-            ir_tensor.scales = scale
-            ir_tensor.zero_point = zero_point
+    return [loader.get_tensor(idx) for idx in inputs]
+
+
+def _decode_tensor(idx: np.float64, subgraph: SubGraph, model: TFliteModel) -> IRTensor:
+    ir_tensor = IRTensor()
+    ir_tensor.tflite_tensor_idx = idx
+    tensor = subgraph.Tensors(idx)
+
+    assert tensor is not None, f"Tensor at idx {idx} found"
+    # determine shape
+    tensor_shape = tensor.ShapeAsNumpy()
+    assert isinstance(
+        tensor_shape, np.ndarray), f"Tensor at idx {idx} has no shape"
+    match tensor_shape.size:
+        case 4:
+            ir_tensor.dim_n, ir_tensor.dim_h, ir_tensor.dim_w, ir_tensor.dim_c = tensor_shape
+        case 2:
+            ir_tensor.dim_n, ir_tensor.dim_c = 1, 1
+            ir_tensor.dim_h, ir_tensor.dim_w = tensor_shape
+        case 1:
+            ir_tensor.dim_n, ir_tensor.dim_h, ir_tensor.dim_w = 1, 1, 1
+            ir_tensor.dim_c = tensor_shape[0]
+        case _:
+            raise RuntimeError(
+                f"unsupported tensor shape dimension: {tensor_shape.size}")
+
+    # determine data
+    buffer_idx = tensor.Buffer()
+    buffer = model.Buffers(buffer_idx)
+    match tensor.Type():
+        case TensorType.INT8:
+            np_type = np.int8
+        case TensorType.INT32:
+            np_type = np.int32
+        case TensorType.FLOAT32:
+            np_type = np.float32
+        case _:
+            raise NotImplementedError(f"unsupported tensor type {tensor.Type()}")        
+    data = np.ndarray([], np_type)
+    if buffer is not None:
+        data_tmp = buffer.DataAsNumpy()
+        if isinstance(data_tmp, np.ndarray):
+            data = np.frombuffer(data_tmp, dtype=np_type)
+    ir_tensor.data = data
+
+    # determine quantization
+    tflite_qparams = tensor.Quantization()
+    if tflite_qparams is None:
+        # TODO: support floating-point operators with no quantization
+        raise NotImplementedError("Quantization parameters not found")
+    scale = tflite_qparams.ScaleAsNumpy()
+    zero_point = tflite_qparams.ZeroPointAsNumpy()
+    if isinstance(scale, np.ndarray) and isinstance(zero_point, np.ndarray):
+        if scale.size != 1 and zero_point.size != 1:
+            ir_tensor.quant_type = Quantization.PER_CHANNEL
+        elif scale.size == 1 and zero_point.size == 1:
+            ir_tensor.quant_type = Quantization.PER_TENSOR
         else:
-            ir_tensor.quant_type = Quantization.NO_QUANTIZATION
-            ir_tensor.scales = np.ndarray([0], np.float64)
-            ir_tensor.zero_point = np.ndarray([0], np.float64)
-        ret.append(ir_tensor)
-    return ret
+            raise NotImplementedError("Unsupported quantization setup")
+        ir_tensor.scales = scale
+        ir_tensor.zero_point = zero_point
+    else:
+        ir_tensor.quant_type = Quantization.NO_QUANTIZATION
+        ir_tensor.scales = np.ndarray([0], np.float64)
+        ir_tensor.zero_point = np.ndarray([0], np.float64)
+    return ir_tensor
 
 
 def _get_wrapper_tensors(tensor_index_list: Iterator[np.float64], model: TFliteModel):
@@ -185,35 +239,25 @@ def getOpCodeStr(op, model: TFliteModel):
     op_code_list_idx = op.OpcodeIndex()
     op_code = model.OperatorCodes(op_code_list_idx)
     assert op_code is not None, "No op code found"
-    op_code_id = op_code.DeprecatedBuiltinCode()
-
-    def _build_str_map(obj):
-        ret = {}
-        for field_name in dir(obj):
-            if not field_name.startswith("_"):
-                field_value = getattr(obj, field_name)
-                if isinstance(field_value, int):
-                    ret[field_value] = field_name
-        return ret
-
-    builtin_op_code = _build_str_map(BuiltinOperator())
-
-    return builtin_op_code[op_code_id]
+    return _op_code_name(op_code)
 
 
 class Rect:
+    # tensor idx, or op idx for a buffer
     idx: np.float64
     height: int
     width: int
     start: int
     addr: int
+    is_buffer: bool
 
-    def __init__(self, idx: np.float64, height: int, weight: int, start: int, addr: int) -> None:
+    def __init__(self, idx: np.float64, height: int, weight: int, start: int, addr: int, is_buffer: bool = False) -> None:
         self.idx = idx
         self.height = height
         self.width = weight
         self.start = start
         self.addr = addr
+        self.is_buffer = is_buffer
 
     def __str__(self) -> str:
         return f"{{h: {self.height}, w: {self.width}, ({self.start}, {self.addr})}}"
@@ -276,7 +320,7 @@ def get_buf_rect(model: IRModel) -> list[Rect]:
     for op_idx in op_idx_list:
         op = model.operators[op_idx]
         # if a buffer is required, generate rect
-        if not (isinstance(op, DepthConv2D) or isinstance(op, Conv2D)):
+        if not has_buffer(op):
             continue
         min_buffer_size = op.min_buffer_size(model)
         if min_buffer_size == 0:
@@ -285,6 +329,6 @@ def get_buf_rect(model: IRModel) -> list[Rect]:
         buf_start = 0 if op_idx == 0 else op_idx - 1
         buf_lifetime = op_idx + 1 - buf_start
         buffer_rect = Rect(np.float64(op_idx), min_buffer_size,
-                           buf_lifetime, buf_start, 0)
+                           buf_lifetime, buf_start, op.buffer_addr, True)
         rect_list.append(buffer_rect)
     return rect_list